@@ -28,16 +28,19 @@ from django.utils import timezone
 from health.models import Cart
 from health.serializers import CartSerializer
 from health.serializers import TestSerializer
+from utils.conditional_get import ConditionalListMixin
 
 
-class CitiesListView(generics.ListAPIView):
+class CitiesListView(ConditionalListMixin, generics.ListAPIView):
     queryset = Cities.objects.filter(is_active=True)
     serializer_class = CitiesSerializer
+    etag_fields = ('id', 'city')
 
 
-class ProfessionsListView(generics.ListAPIView):
+class ProfessionsListView(ConditionalListMixin, generics.ListAPIView):
     queryset = Professions.objects.filter(is_active=True)
     serializer_class = ProfessionSerializer
+    etag_fields = ('id', 'profession')
 
 
 from rest_framework.pagination import PageNumberPagination
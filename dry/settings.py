@@ -137,6 +137,22 @@ DATABASES = {
         "PORT": os.environ.get("SUPBASE_DB_PORT"),
     }
 }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Per-user health read cache (utils.health_cache). Entries are keyed by a
+    # generation counter kept in Mongo, so every process sees invalidations;
+    # set HEALTH_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+    # and HEALTH_CACHE_LOCATION to a directory to share entries between workers.
+    'health': {
+        'BACKEND': os.getenv('HEALTH_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('HEALTH_CACHE_LOCATION', 'health'),
+        'TIMEOUT': int(os.getenv('HEALTH_CACHE_TIMEOUT', '300')),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('HEALTH_CACHE_MAX_ENTRIES', '10000'))},
+    },
+}
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -0,0 +1,137 @@
+import os
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+from .models import HEALTH_PANEL_MODELS, Cart, Test, Payment, ReportAnalysisCache, ReportAnalysisJob
+
+# Report analyses unused for this long are dropped by Mongo's TTL monitor
+REPORT_CACHE_TTL_SECONDS = int(os.getenv('REPORT_CACHE_TTL_DAYS', '30')) * 24 * 3600
+
+
+# -------------------------
+# Index registry
+# -------------------------
+# Document -> indexes its collection must have. Each index is a dict with a
+# unique 'name', its 'keys' and any extra create_index options (e.g. unique).
+# The panel indexes end with _id so that the (created_at, _id) keyset used by
+# the cursor pagination of the list endpoints is fully index-ordered.
+def _panel_indexes():
+    return [
+        {'name': 'user_id_created_at', 'keys': [('user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'dietician_id_created_at', 'keys': [('dietician_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]},
+        {'name': 'created_at', 'keys': [('created_at', DESCENDING), ('_id', DESCENDING)]},
+    ]
+
+
+INDEX_REGISTRY = {model_class: _panel_indexes() for model_class in HEALTH_PANEL_MODELS.values()}
+INDEX_REGISTRY[Cart] = [
+    {'name': 'user_id_unique', 'keys': [('user_id', ASCENDING)], 'unique': True},
+]
+INDEX_REGISTRY[Test] = [
+    {'name': 'category', 'keys': [('category', ASCENDING)]},
+    # Full-text fallback of the test search endpoint
+    {'name': 'search_text', 'keys': [
+        ('testName', TEXT), ('parametersCovered_list.name', TEXT), ('faqs.question', TEXT), ('faqs.answer', TEXT),
+    ], 'weights': {'testName': 10, 'parametersCovered_list.name': 5, 'faqs.question': 2, 'faqs.answer': 1}},
+]
+INDEX_REGISTRY[Payment] = [
+    {'name': 'test_booking_id', 'keys': [('test_booking_id', ASCENDING)]},
+]
+INDEX_REGISTRY[ReportAnalysisCache] = [
+    # Also the LRU order of the size-based eviction
+    {'name': 'last_used_at_ttl', 'keys': [('last_used_at', ASCENDING)], 'expireAfterSeconds': REPORT_CACHE_TTL_SECONDS},
+]
+INDEX_REGISTRY[ReportAnalysisJob] = [
+    # Claim order of the workers
+    {'name': 'status_next_attempt_at', 'keys': [('status', ASCENDING), ('next_attempt_at', ASCENDING)]},
+]
+
+
+# The hot queries of the API: (label, document, filter, sort). Used to check
+# with explain() that every one of them is served by an index.
+def _canonical_queries():
+    queries = []
+    for panel_type, model_class in HEALTH_PANEL_MODELS.items():
+        queries.append((f'{panel_type} by user', model_class, {'user_id': 1}, [('created_at', DESCENDING)]))
+        queries.append((f'{panel_type} by dietician', model_class, {'dietician_id': 1}, [('created_at', DESCENDING)]))
+        queries.append((f'{panel_type} page', model_class, {}, [('created_at', DESCENDING), ('_id', DESCENDING)]))
+    queries.append(('cart by user', Cart, {'user_id': 1}, None))
+    queries.append(('tests by category', Test, {'category': None}, None))
+    queries.append(('payments by booking', Payment, {'test_booking_id': ''}, None))
+    return queries
+
+
+CANONICAL_QUERIES = _canonical_queries()
+
+
+def _index_options(spec):
+    return {key: value for key, value in spec.items() if key not in ('name', 'keys')}
+
+
+def _same_index(current, spec):
+    if bool(current.get('unique')) != bool(spec.get('unique')):
+        return False
+    if any(direction == TEXT for _, direction in spec['keys']):
+        # Text indexes are reported as (_fts, _ftsx) keys; compare their fields and weights instead
+        weights = spec.get('weights') or {field: 1 for field, direction in spec['keys'] if direction == TEXT}
+        return current.get('weights') == weights
+    return [tuple(key) for key in current['key']] == spec['keys']
+
+
+def diff_indexes(model_class):
+    """
+    Compares the live indexes of a collection with the registry.
+    Returns (missing, changed, unregistered) where missing and changed are
+    registry specs and unregistered are names of live indexes not in the registry.
+    """
+    live = model_class._get_collection().index_information()
+    missing, changed = [], []
+
+    for spec in INDEX_REGISTRY.get(model_class, []):
+        current = live.get(spec['name'])
+        if current is None:
+            missing.append(spec)
+        elif not _same_index(current, spec):
+            changed.append(spec)
+
+    registered = {spec['name'] for spec in INDEX_REGISTRY.get(model_class, [])}
+    unregistered = [name for name in live if name != '_id_' and name not in registered]
+    return missing, changed, unregistered
+
+
+def ensure_indexes(model_class, drop_unregistered=False):
+    """Creates missing indexes, recreates changed ones and optionally drops unregistered ones."""
+    collection = model_class._get_collection()
+    missing, changed, unregistered = diff_indexes(model_class)
+
+    for spec in changed:
+        collection.drop_index(spec['name'])
+    for spec in missing + changed:
+        collection.create_index(spec['keys'], name=spec['name'], **_index_options(spec))
+    if drop_unregistered:
+        for name in unregistered:
+            collection.drop_index(name)
+
+    return missing, changed, unregistered
+
+
+def _plan_stages(plan):
+    stages = [plan.get('stage')]
+    for child_key in ('inputStage', 'queryPlan'):
+        if child_key in plan:
+            stages.extend(_plan_stages(plan[child_key]))
+    for child in plan.get('inputStages', []):
+        stages.extend(_plan_stages(child))
+    return [stage for stage in stages if stage]
+
+
+def explain_canonical_queries():
+    """Returns [(label, collection name, winning plan stages)] for every canonical query."""
+    results = []
+    for label, model_class, query, sort in CANONICAL_QUERIES:
+        cursor = model_class._get_collection().find(query).limit(1)
+        if sort:
+            cursor = cursor.sort(sort)
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        results.append((label, model_class._get_collection_name(), _plan_stages(winning_plan)))
+    return results
@@ -0,0 +1,327 @@
+import datetime
+import os
+import random
+import statistics
+import time
+from io import BytesIO
+
+import pdfplumber
+from bson import ObjectId
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from mongoengine import connect, disconnect
+from pymongo import monitoring
+from rest_framework.renderers import JSONRenderer
+
+from health.models import BodyParameters
+from health.raw_serializers import raw_serialize_many
+from health.serializers import BodyParametersSerializer
+from utils.health_score import (
+    batch_result_rows, body_parameters_columns, calculate_health_score, calculate_health_scores_batch,
+    clear_score_cache, score_cache_info,
+)
+from utils.pdf_extraction import PDF_WORKERS, extract_pages, render_pages
+from utils.user_utils import dietician_clients_health_summary
+
+
+class MongoCommandCounter(monitoring.CommandListener):
+    """Counts the commands (round-trips) sent to MongoDB."""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def reconnect_with_listener(listener):
+    # Listeners can only be attached when the MongoClient is created
+    disconnect()
+    connect(
+        db=os.getenv('MONGO_DB_NAME'),
+        host=os.getenv('MONGO_HOST'),
+        username=os.getenv('MONGO_USERNAME'),
+        password=os.getenv('MONGO_PASSWORD'),
+        event_listeners=[listener],
+    )
+
+
+def synthetic_body_parameters(count, user_id=1):
+    """Builds raw body_parameters documents, as returned by as_pymongo(), for one user's history."""
+    rng = random.Random(count)
+    started = datetime.datetime(2020, 1, 1)
+    documents = []
+    for index in range(count):
+        created_at = started + datetime.timedelta(hours=index, microseconds=rng.randrange(1000) * 1000)
+        documents.append({
+            '_id': ObjectId(),
+            'user_id': user_id,
+            'dietician_id': 7,
+            'stress_level': float(rng.randint(1, 10)),
+            'sleep_time': round(rng.uniform(4, 10), 1),
+            'sleep_quality': rng.choice(['Excellent', 'Good', 'Fair', 'Poor']),
+            'height': str(rng.randint(150, 195)),
+            'weight': round(rng.uniform(45, 120), 1),
+            'bmi': round(rng.uniform(16, 35), 1),
+            'viseral_fats': rng.randint(1, 20),
+            'body_fat': round(rng.uniform(8, 40), 1),
+            'muscle': round(rng.uniform(20, 45), 1),
+            'body_age': float(rng.randint(18, 80)),
+            'waste_water': rng.choice(['A', 'B', 'C']),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'score': round(rng.uniform(30, 100), 2),
+            'status': rng.choice(['Good', 'Moderate', 'Needs Attention']),
+            'components': {'bmi': 100, 'body_fat': 80},
+        })
+    return documents
+
+
+def _pdf_text(value):
+    return str(value).replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def synthetic_report_pdf(pages, seed=0):
+    """
+    Builds a lab-report-like PDF: odd pages hold a ruled results table
+    (Investigation / Observed Value / Biological Reference Interval), even
+    pages interpretation text without any ruling line.
+    """
+    rng = random.Random(seed)
+    streams = []
+    for number in range(1, pages + 1):
+        if number % 2:
+            columns = (50, 250, 380, 545)
+            top, height, rows = 780, 18, 30
+            ops = ['0.5 w']
+            for row in range(rows + 1):
+                ops.append(f'{columns[0]} {top - row * height} m {columns[-1]} {top - row * height} l S')
+            for x in columns:
+                ops.append(f'{x} {top} m {x} {top - rows * height} l S')
+            cells = [('Investigation', 'Observed Value', 'Biological Reference Interval')]
+            for row in range(1, rows):
+                low = rng.randint(1, 50)
+                cells.append((f'Parameter {number}-{row}', f'{rng.uniform(0, 100):.1f}', f'{low} - {low + rng.randint(5, 50)}'))
+            for row, values in enumerate(cells):
+                for x, value in zip(columns, values):
+                    ops.append(f'BT /F1 9 Tf {x + 4} {top - (row + 1) * height + 5} Td ({_pdf_text(value)}) Tj ET')
+        else:
+            ops = ['BT /F1 10 Tf 50 800 Td 14 TL']
+            for _ in range(50):
+                words = ' '.join(rng.choice(('level', 'within', 'range', 'serum', 'normal', 'advised', 'follow-up', 'values'))
+                                 for _ in range(12))
+                ops.append(f'({_pdf_text(words)}) Tj T*')
+            ops.append('ET')
+        streams.append('\n'.join(ops).encode())
+
+    objects = [b'<< /Type /Catalog /Pages 2 0 R >>', None, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>']
+    kids = []
+    for stream in streams:
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+        objects.append(
+            b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Resources << /Font << /F1 3 0 R >> >> '
+            b'/Contents %d 0 R >>' % (len(objects))
+        )
+        kids.append(f'{len(objects)} 0 R')
+    objects[1] = f'<< /Type /Pages /Kids [{" ".join(kids)}] /Count {len(kids)} >>'.encode()
+
+    output, offsets = bytearray(b'%PDF-1.4\n'), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(output)
+    output += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    output += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    output += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+def sequential_pdf_text(pdf_bytes):
+    """The analyzer's former extraction: text and tables of every page, one page after the other."""
+    full_text = []
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        for page_num, page in enumerate(pdf.pages):
+            full_text.append(f"\n--- PAGE {page_num + 1} ---\n")
+            text = page.extract_text()
+            if text:
+                full_text.append(text)
+            for table in page.extract_tables():
+                if table:
+                    full_text.append("\n--- TABLE START ---\n")
+                    for row in table:
+                        full_text.append("\t".join(cell if cell is not None else "" for cell in row))
+                    full_text.append("\n--- TABLE END ---\n")
+    return "\n".join(full_text)
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the hot health code paths against the configured databases.'
+
+    suites = ('dashboard', 'serializers', 'scoring', 'pdf')
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=self.suites)
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per case (after one warm-up run).')
+        parser.add_argument(
+            '--dietician-id', type=int, action='append', dest='dietician_ids', default=[],
+            help='Dietician to benchmark the dashboard for; repeat to compare client counts.',
+        )
+        parser.add_argument(
+            '--documents', type=int, default=10000,
+            help='Size of the synthetic history used by the serializers and scoring suites.',
+        )
+        parser.add_argument('--pdfs', type=int, default=5, help='Synthetic reports used by the pdf suite.')
+        parser.add_argument('--pages', type=int, default=12, help='Pages of each synthetic report.')
+        parser.add_argument('--workers', type=int, default=PDF_WORKERS, help='Extraction processes of the pdf suite.')
+
+    def handle(self, *args, **options):
+        getattr(self, f"bench_{options['suite']}")(options)
+
+    def report(self, label, timings, **counters):
+        extra = ' '.join(f'{key}={value}' for key, value in counters.items())
+        self.stdout.write(
+            f'{label}: {extra} median={statistics.median(timings) * 1000:.2f}ms '
+            f'min={min(timings) * 1000:.2f}ms runs={len(timings)}'
+        )
+
+    def bench_dashboard(self, options):
+        if not options['dietician_ids']:
+            raise CommandError('Pass at least one --dietician-id.')
+
+        counter = MongoCommandCounter()
+        reconnect_with_listener(counter)
+
+        query_counts = set()
+        for dietician_id in options['dietician_ids']:
+            summary = dietician_clients_health_summary(dietician_id)
+            if summary.get('status') == 'error':
+                raise CommandError(summary['message'])
+
+            timings = []
+            for _ in range(options['repeat']):
+                mongo_before = counter.count
+                with CaptureQueriesContext(connection) as sql:
+                    started = time.perf_counter()
+                    dietician_clients_health_summary(dietician_id)
+                    timings.append(time.perf_counter() - started)
+                mongo_commands = counter.count - mongo_before
+
+            query_counts.add((len(sql.captured_queries), mongo_commands))
+            self.report(
+                f'dashboard dietician={dietician_id}', timings,
+                clients=summary['totalClients'], sql_queries=len(sql.captured_queries),
+                mongo_commands=mongo_commands,
+            )
+
+        if len(query_counts) == 1:
+            self.stdout.write(self.style.SUCCESS('Query count is constant across dieticians.'))
+        else:
+            self.stdout.write(self.style.WARNING(f'Query count varies across dieticians: {sorted(query_counts)}'))
+
+    def bench_serializers(self, options):
+        # Runs fully in memory: both paths start from the same raw documents,
+        # so only hydration and serialization are measured.
+        documents = synthetic_body_parameters(options['documents'])
+        renderer = JSONRenderer()
+
+        def document_path():
+            records = [BodyParameters._from_son(son) for son in documents]
+            return BodyParametersSerializer(records, many=True).data
+
+        def raw_path():
+            return raw_serialize_many(BodyParametersSerializer, documents)
+
+        if renderer.render(document_path()) != renderer.render(raw_path()):
+            raise CommandError('Raw serializer output differs from BodyParametersSerializer.')
+
+        medians = {}
+        for label, path in (('document serializer', document_path), ('raw serializer', raw_path)):
+            path()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                path()
+                timings.append(time.perf_counter() - started)
+            medians[label] = statistics.median(timings)
+            self.report(f'{label} documents={len(documents)}', timings)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Outputs are identical; raw path is {medians['document serializer'] / medians['raw serializer']:.1f}x faster."
+        ))
+
+    def bench_scoring(self, options):
+        documents = synthetic_body_parameters(options['documents'])
+        columns = body_parameters_columns(documents)
+
+        def scalar_path():
+            return [calculate_health_score(document) for document in documents]
+
+        def batch_path():
+            return calculate_health_scores_batch(columns)
+
+        if scalar_path() != batch_result_rows(batch_path()):
+            raise CommandError('Batch scores differ from calculate_health_score.')
+
+        def cold_scalar_path():
+            clear_score_cache()
+            return scalar_path()
+
+        for label, path in (
+            ('scalar scoring (cold cache)', cold_scalar_path),
+            ('scalar scoring (warm cache)', scalar_path),
+            ('batch scoring', batch_path),
+        ):
+            path()
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                path()
+                timings.append(time.perf_counter() - started)
+            self.report(
+                f'{label} rows={len(documents)}', timings,
+                rows_per_second=f'{len(documents) / statistics.median(timings):,.0f}',
+            )
+
+        cache = score_cache_info()
+        self.stdout.write(f"score cache: hits={cache['hits']} misses={cache['misses']} size={cache['size']}/{cache['maxsize']}")
+        self.stdout.write(self.style.SUCCESS('Batch results are identical to calculate_health_score.'))
+
+    def bench_pdf(self, options):
+        corpus = [synthetic_report_pdf(options['pages'], seed) for seed in range(options['pdfs'])]
+        workers = options['workers']
+
+        for pdf_bytes in corpus:
+            if render_pages(extract_pages(pdf_bytes, workers)) != sequential_pdf_text(pdf_bytes):
+                raise CommandError('Page-level extraction output differs from the sequential extraction.')
+
+        medians = {}
+        for label, path in (
+            ('sequential', sequential_pdf_text),
+            ('page engine, 1 process', lambda pdf_bytes: render_pages(extract_pages(pdf_bytes, 1))),
+            (f'page engine, {workers} processes', lambda pdf_bytes: render_pages(extract_pages(pdf_bytes, workers))),
+        ):
+            path(corpus[0])
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                for pdf_bytes in corpus:
+                    path(pdf_bytes)
+                timings.append((time.perf_counter() - started) / len(corpus))
+            medians[label] = statistics.median(timings)
+            self.report(
+                f'{label} pages={options["pages"]}', timings,
+                pages_per_second=f'{options["pages"] / medians[label]:,.0f}',
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Outputs are identical; the page engine is {medians["sequential"] / min(list(medians.values())[1:]):.1f}x faster per report.'
+        ))
+
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+
+from health.indexes import INDEX_REGISTRY, diff_indexes, ensure_indexes, explain_canonical_queries
+
+
+class Command(BaseCommand):
+    help = 'Creates, diffs or drops the MongoDB indexes declared in health.indexes.INDEX_REGISTRY.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the differences.')
+        parser.add_argument(
+            '--drop-unregistered', action='store_true',
+            help='Drop indexes of registered collections that are not in the registry.',
+        )
+        parser.add_argument('--explain', action='store_true', help='Report explain() plans of the canonical queries.')
+
+    def handle(self, *args, **options):
+        for model_class in INDEX_REGISTRY:
+            collection_name = model_class._get_collection_name()
+            if options['dry_run']:
+                missing, changed, unregistered = diff_indexes(model_class)
+            else:
+                missing, changed, unregistered = ensure_indexes(model_class, options['drop_unregistered'])
+
+            for spec in missing:
+                self.stdout.write(f"{collection_name}: missing {spec['name']}")
+            for spec in changed:
+                self.stdout.write(f"{collection_name}: changed {spec['name']}")
+            for name in unregistered:
+                action = 'dropped' if options['drop_unregistered'] and not options['dry_run'] else 'unregistered'
+                self.stdout.write(f'{collection_name}: {action} {name}')
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS('Indexes are in sync with the registry.'))
+
+        if options['explain']:
+            collection_scans = 0
+            for label, collection_name, stages in explain_canonical_queries():
+                if 'COLLSCAN' in stages:
+                    collection_scans += 1
+                    self.stdout.write(self.style.WARNING(f"{label} ({collection_name}): {' <- '.join(stages)}"))
+                else:
+                    self.stdout.write(f"{label} ({collection_name}): {' <- '.join(stages)}")
+
+            if collection_scans:
+                self.stdout.write(self.style.WARNING(f'{collection_scans} canonical queries still use a COLLSCAN.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('No canonical query uses a COLLSCAN.'))
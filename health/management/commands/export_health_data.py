@@ -0,0 +1,50 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from health.models import HEALTH_PANEL_MODELS
+from utils.health_export import iter_ndjson
+
+
+class Command(BaseCommand):
+    help = 'Streams a health collection to an NDJSON file (gzipped if the name ends with .gz) in bounded memory.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('panel_type', choices=sorted(HEALTH_PANEL_MODELS))
+        parser.add_argument('--output', default='-', help='Output file, "-" for stdout.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--user-id', type=int)
+        parser.add_argument('--dietician-id', type=int)
+
+    def handle(self, *args, **options):
+        query = {}
+        if options['user_id'] is not None:
+            query['user_id'] = options['user_id']
+        if options['dietician_id'] is not None:
+            query['dietician_id'] = options['dietician_id']
+
+        collection = HEALTH_PANEL_MODELS[options['panel_type']]._get_collection()
+        output = options['output']
+
+        if output == '-':
+            stream = sys.stdout
+        elif output.endswith('.gz'):
+            stream = gzip.open(output, 'wt', encoding='utf-8')
+        else:
+            stream = open(output, 'w', encoding='utf-8')
+
+        exported = 0
+        started = time.perf_counter()
+        try:
+            for line in iter_ndjson(collection, query, batch_size=options['batch_size']):
+                stream.write(line)
+                exported += 1
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+        elapsed = time.perf_counter() - started
+        rate = exported / elapsed if elapsed else 0
+        self.stderr.write(f'Exported {exported} documents in {elapsed:.1f}s ({rate:.0f} docs/s).')
@@ -0,0 +1,229 @@
+import csv
+import gzip
+import json
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from mongoengine import EmbeddedDocumentField
+
+from health.models import HEALTH_PANEL_MODELS
+from utils.health_bulk import insert_rows, validate_rows
+
+# Fields that are never read from a file
+SKIPPED_FIELDS = ('id', 'score', 'status', 'components')
+
+
+def normalize(name):
+    return re.sub(r'[^a-z0-9.]+', '_', str(name).strip().lower()).strip('_')
+
+
+def field_paths(model_class):
+    """
+    Maps the accepted column names of a panel to field paths: every field by
+    name, embedded fields as parent.field (or parent__field), and embedded
+    fields also by their bare name when no other field has it.
+    """
+    paths, bare = {}, {}
+    for name, field in model_class._fields.items():
+        if name in SKIPPED_FIELDS:
+            continue
+        if isinstance(field, EmbeddedDocumentField):
+            for child in field.document_type._fields:
+                if child in SKIPPED_FIELDS:
+                    continue
+                paths[f'{name}.{child}'] = paths[f'{name}__{child}'] = (name, child)
+                bare.setdefault(child, []).append((name, child))
+        else:
+            paths[name] = (name,)
+    for child, candidates in bare.items():
+        if child not in paths and len(candidates) == 1:
+            paths[child] = candidates[0]
+    return paths
+
+
+def read_csv(path, delimiter):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', newline='', encoding='utf-8-sig') as source:
+        yield from csv.reader(source, delimiter=delimiter)
+
+
+def read_excel(path, sheet):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise CommandError('Reading Excel files needs openpyxl: pip install openpyxl')
+    # read_only streams the rows instead of loading the whole workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        worksheet = workbook[sheet] if sheet else workbook.active
+        yield from worksheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports health records of one panel type from a CSV (optionally gzipped) or Excel file. '
+        'Columns are matched to the panel fields by name (embedded fields as parent.field), rows are '
+        'validated in chunks on a process pool and written with unordered bulk inserts.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('panel_type', choices=sorted(HEALTH_PANEL_MODELS))
+        parser.add_argument('path', help='.csv, .csv.gz or .xlsx file with a header row.')
+        parser.add_argument('--sheet', help='Worksheet of an Excel file (default: the active one).')
+        parser.add_argument('--delimiter', default=',')
+        parser.add_argument('--map', action='append', default=[], metavar='COLUMN=FIELD',
+                            help='Reads COLUMN into FIELD (e.g. "Hb=hemogram.hemoglobin"); repeatable.')
+        parser.add_argument('--default', action='append', default=[], metavar='FIELD=VALUE',
+                            help='Value of FIELD for the rows that have none (e.g. dietician_id=12); repeatable.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per chunk.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Validation processes; 0 validates in this process.')
+        parser.add_argument('--errors', help='CSV file receiving the line number and errors of each rejected row.')
+        parser.add_argument('--show-errors', type=int, default=10, help='Rejected rows to print.')
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing anything.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        if not os.path.exists(options['path']):
+            raise CommandError(f'No such file: {options["path"]}')
+
+        self.options = options
+        self.panel_type = options['panel_type']
+        self.read = self.created = self.failed = 0
+        self.errors_file = self.errors_writer = None
+        if options['errors']:
+            self.errors_file = open(options['errors'], 'w', newline='')
+            self.errors_writer = csv.writer(self.errors_file)
+            self.errors_writer.writerow(['line', 'errors'])
+
+        if options['path'].lower().endswith(('.xlsx', '.xlsm')):
+            rows = read_excel(options['path'], options['sheet'])
+        else:
+            rows = read_csv(options['path'], options['delimiter'])
+
+        started = time.perf_counter()
+        try:
+            if options['workers'] > 0:
+                with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                    self.run(rows, lambda chunk: executor.submit(validate_rows, self.panel_type, chunk), options['workers'])
+            else:
+                self.run(rows, lambda chunk: validate_rows(self.panel_type, chunk), 0)
+        finally:
+            if self.errors_file:
+                self.errors_file.close()
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{self.read} rows read, {self.created} {"valid" if options["dry_run"] else "created"}, {self.failed} rejected '
+            f'in {elapsed:.1f}s ({self.read / elapsed if elapsed else 0:,.0f} rows/s)'
+        )
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING('Dry run: nothing was written.'))
+
+    def columns(self, header):
+        """Field path of each column (None for the ignored ones)."""
+        paths = field_paths(HEALTH_PANEL_MODELS[self.panel_type])
+        overrides = {}
+        for mapping in self.options['map']:
+            column, _, field = mapping.partition('=')
+            if normalize(field) not in paths:
+                raise CommandError(f'Unknown field in --map {mapping}')
+            overrides[normalize(column)] = paths[normalize(field)]
+
+        columns, ignored = [], []
+        for name in header:
+            key = normalize(name or '')
+            path = overrides.get(key) or paths.get(key)
+            columns.append(path)
+            if path is None and key:
+                ignored.append(str(name))
+        if ignored:
+            self.stdout.write(self.style.WARNING(f'Ignored columns: {", ".join(ignored)}'))
+        if not any(columns):
+            raise CommandError(f'No column matches a {self.panel_type} field.')
+        return columns
+
+    def defaults(self):
+        paths = field_paths(HEALTH_PANEL_MODELS[self.panel_type])
+        defaults = []
+        for default in self.options['default']:
+            field, _, value = default.partition('=')
+            if normalize(field) not in paths:
+                raise CommandError(f'Unknown field in --default {default}')
+            defaults.append((paths[normalize(field)], value))
+        return defaults
+
+    def chunks(self, rows):
+        """Yields lists of at most batch-size (line number, record) pairs."""
+        rows = iter(rows)
+        header = next(rows, None)
+        if header is None:
+            raise CommandError('The file is empty.')
+        columns, defaults = self.columns(header), self.defaults()
+
+        chunk = []
+        for line, values in enumerate(rows, start=2):
+            record = {}
+            for path, value in zip(columns, values):
+                if path is None or value is None or (isinstance(value, str) and not value.strip()):
+                    continue
+                if len(path) == 1:
+                    record[path[0]] = value
+                else:
+                    record.setdefault(path[0], {})[path[1]] = value
+            if not record:
+                continue
+            for path, value in defaults:
+                target = record if len(path) == 1 else record.setdefault(path[0], {})
+                target.setdefault(path[-1], value)
+
+            chunk.append((line, record))
+            if len(chunk) >= self.options['batch_size']:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def run(self, rows, validate, workers):
+        if not workers:
+            for chunk in self.chunks(rows):
+                self.apply(chunk, validate([record for _, record in chunk]))
+            return
+
+        # Keep a few chunks in flight so that parsing, validation and writes overlap
+        in_flight = deque()
+        for chunk in self.chunks(rows):
+            in_flight.append((chunk, validate([record for _, record in chunk])))
+            if len(in_flight) >= workers * 2:
+                chunk, future = in_flight.popleft()
+                self.apply(chunk, future.result())
+        while in_flight:
+            chunk, future = in_flight.popleft()
+            self.apply(chunk, future.result())
+
+    def apply(self, chunk, validated):
+        results, valid = validated
+        if not self.options['dry_run']:
+            results = insert_rows(self.panel_type, results, valid, with_data=False)
+
+        for (line, _), result in zip(chunk, results):
+            if result is None or result['status'] == 'created':
+                self.created += 1
+                continue
+            self.failed += 1
+            errors = json.dumps(result['errors'])
+            if self.errors_writer:
+                self.errors_writer.writerow([line, errors])
+            if self.failed <= self.options['show_errors']:
+                self.stdout.write(f'  line {line}: {errors}')
+
+        self.read += len(chunk)
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f'  {self.read} rows, {self.created} created, {self.failed} rejected')
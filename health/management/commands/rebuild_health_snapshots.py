@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from health.models import HEALTH_PANEL_MODELS
+from utils.health_snapshot import rebuild_latest_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the latest_health_snapshot collection from the health panel collections.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--type', action='append', dest='panel_types', choices=sorted(HEALTH_PANEL_MODELS),
+            help='Panel type to rebuild; repeat for several. Defaults to all panel types.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = rebuild_latest_snapshots(options['panel_types'], batch_size=options['batch_size'])
+        for panel_type, count in written.items():
+            self.stdout.write(f'{panel_type}: {count} users')
+        self.stdout.write(self.style.SUCCESS('Latest health snapshots rebuilt.'))
@@ -0,0 +1,27 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.core.management.base import BaseCommand, CommandError
+
+from utils.cart_utils import reprice_carts
+
+
+class Command(BaseCommand):
+    help = 'Refreshes the test price, name and parameter count stored in cart items and recomputes the cart totals.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--test-id', action='append', dest='test_ids',
+            help='Only reprice the items of this test; repeat for several. Defaults to all tests.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        test_ids = None
+        if options['test_ids']:
+            try:
+                test_ids = [ObjectId(test_id) for test_id in options['test_ids']]
+            except InvalidId as e:
+                raise CommandError(str(e))
+
+        updated = reprice_carts(test_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'{updated} carts repriced.'))
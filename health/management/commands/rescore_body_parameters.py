@@ -0,0 +1,147 @@
+import json
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+
+from health.models import BodyParameters
+from utils.health_score import RULES_VERSION, SCORE_INPUTS, score_records
+from utils.health_cache import invalidate_user_cache
+from utils.health_snapshot import update_snapshot_scores
+
+# Fields read from each record: the scoring inputs plus what the diff and the snapshot need
+PROJECTION = dict.fromkeys(SCORE_INPUTS + ('user_id', 'score', 'status', 'components'), 1)
+
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as checkpoint:
+        return ObjectId(json.load(checkpoint)['last_id'])
+
+
+def write_checkpoint(path, last_id, processed):
+    # Write then rename so that an interrupted run never leaves a truncated checkpoint
+    with open(f'{path}.tmp', 'w') as checkpoint:
+        json.dump({'last_id': str(last_id), 'processed': processed, 'rules_version': RULES_VERSION}, checkpoint)
+    os.replace(f'{path}.tmp', path)
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes BodyParameters scores with the current scoring rules. Records are read '
+        'in _id order, scored in batches on a process pool and written back with unordered bulk writes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Records per _id range.')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                            help='Scoring processes; 0 scores in this process.')
+        parser.add_argument('--all', action='store_true', dest='rescore_all',
+                            help='Rescore every record, not only those scored with another rules version.')
+        parser.add_argument('--checkpoint', help='JSON file recording the last rescored _id; resumes from it if present.')
+        parser.add_argument('--dry-run', action='store_true', help='Report the score changes without writing them.')
+        parser.add_argument('--show', type=int, default=10, help='Changed records to print in dry-run mode.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+
+        self.options = options
+        self.collection = BodyParameters._get_collection()
+        self.processed = 0
+        self.changed = 0
+        self.skipped = 0
+        self.transitions = Counter()
+        self.shown = 0
+
+        query = {} if options['rescore_all'] else {'components.rules_version': {'$ne': RULES_VERSION}}
+        last_id = read_checkpoint(options['checkpoint'])
+        if last_id:
+            self.stdout.write(f'Resuming after _id {last_id}')
+
+        started = time.perf_counter()
+        if options['workers'] > 0:
+            with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+                self.run(query, last_id, lambda records: executor.submit(score_records, records), options['workers'])
+        else:
+            self.run(query, last_id, score_records, 0)
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f'{self.processed} records scored, {self.changed} changed, {self.skipped} not scorable '
+            f'in {elapsed:.1f}s ({self.processed / elapsed if elapsed else 0:,.0f} records/s)'
+        )
+        if options['dry_run']:
+            for (before, after), count in self.transitions.most_common():
+                self.stdout.write(f'  status {before} -> {after}: {count}')
+            self.stdout.write(self.style.WARNING('Dry run: nothing was written.'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Rescored with rules version {RULES_VERSION}.'))
+
+    def batches(self, query, last_id):
+        """Yields the records of consecutive _id ranges, each read with one keyset query."""
+        batch_size = self.options['batch_size']
+        while True:
+            range_query = dict(query, _id={'$gt': last_id}) if last_id else query
+            records = list(self.collection.find(range_query, PROJECTION).sort('_id', 1).limit(batch_size))
+            if not records:
+                return
+            yield records
+            last_id = records[-1]['_id']
+
+    def run(self, query, last_id, score, workers):
+        if not workers:
+            for records in self.batches(query, last_id):
+                self.apply(records, score(records))
+            return
+
+        # Keep a few batches in flight so that reading, scoring and writing overlap,
+        # and apply them in _id order so that the checkpoint only ever moves forward
+        in_flight = deque()
+        for records in self.batches(query, last_id):
+            in_flight.append((records, score(records)))
+            if len(in_flight) >= workers * 2:
+                records, future = in_flight.popleft()
+                self.apply(records, future.result())
+        while in_flight:
+            records, future = in_flight.popleft()
+            self.apply(records, future.result())
+
+    def apply(self, records, results):
+        operations, rescored = [], []
+        for record, result in zip(records, results):
+            if result is None:
+                self.skipped += 1
+                continue
+            if (record.get('score'), record.get('status')) != (result['score'], result['status']):
+                self.changed += 1
+                self.transitions[(record.get('status'), result['status'])] += 1
+                self.show_change(record, result)
+            record.update(result)
+            rescored.append(record)
+            operations.append(UpdateOne({'_id': record['_id']}, {'$set': result}))
+
+        if operations and not self.options['dry_run']:
+            self.collection.bulk_write(operations, ordered=False)
+            update_snapshot_scores('body_parameters', rescored)
+            invalidate_user_cache('body_parameters', *(record.get('user_id') for record in rescored))
+
+        self.processed += len(records)
+        if self.options['checkpoint'] and not self.options['dry_run']:
+            write_checkpoint(self.options['checkpoint'], records[-1]['_id'], self.processed)
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f'  up to _id {records[-1]["_id"]}: {self.processed} records')
+
+    def show_change(self, record, result):
+        if not self.options['dry_run'] or self.shown >= self.options['show']:
+            return
+        self.shown += 1
+        self.stdout.write(
+            f"  {record['_id']} user {record.get('user_id')}: "
+            f"{record.get('score')} {record.get('status')} -> {result['score']} {result['status']}"
+        )
@@ -0,0 +1,29 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from utils.report_jobs import REPORT_JOB_WORKERS, drain
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs queued report analyses, including the retries that are due and the jobs whose '
+        'worker died. Use it where web processes do not outlive their requests.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=REPORT_JOB_WORKERS, help='Jobs run concurrently.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is due.')
+        parser.add_argument('--poll-interval', type=float, default=5.0, help='Seconds between polls when idle.')
+
+    def handle(self, *args, **options):
+        workers = max(1, options['workers'])
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                attempts = sum(executor.map(lambda _: drain(), range(workers)))
+                if attempts:
+                    self.stdout.write(f'{attempts} job attempts run.')
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
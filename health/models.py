@@ -1,6 +1,6 @@
 import datetime 
 from django.db import models
-from mongoengine import Document, EmbeddedDocument,ReferenceField,StringField, FloatField, DateTimeField, EmbeddedDocumentField, ObjectIdField,IntField, DictField,BooleanField, ListField, EmbeddedDocumentListField
+from mongoengine import Document, EmbeddedDocument,ReferenceField,StringField, FloatField, DateTimeField, EmbeddedDocumentField, ObjectIdField,IntField, DictField,BooleanField, ListField, EmbeddedDocumentListField, BinaryField
 from accounts.models import Account, UserProfile
 from bson import ObjectId
 
@@ -382,6 +382,114 @@ class DailyRoutine(Document):
     meta = {'collection': 'daily_routine'}
 
 
+# Panel type -> document for every per-user health panel
+HEALTH_PANEL_MODELS = {
+    'body_parameters': BodyParameters,
+    'blood_test': BloodTestValues,
+    'urine_examination': CompleteUrineExamination,
+    'esr': ErythrocyteSedimentationRate,
+    'bun_test': BloodUreaNitrogenTest,
+    'lipid_profile': LipidProfile,
+    'liver_function': LiverFunctionTest,
+    'medical_history': MedicalHistory,
+    'daily_routine': DailyRoutine,
+}
+
+
+# ####################    LatestHealthSnapshot   #######################################
+class LatestHealthSnapshot(Document):
+    # One document per user, maintained by the health write views.
+    # panels: panel type -> {record_id, score, status, bmi, created_at, updated_at}
+    user_id = IntField(primary_key=True)
+    panels = DictField()
+
+    meta = {'collection': 'latest_health_snapshot'}
+
+
+# ####################    CatalogVersion   #######################################
+class CatalogVersion(Document):
+    # Bumped by every test/category write so that the in-process catalogs of all
+    # workers know when to reload (see utils.test_catalog)
+    name = StringField(primary_key=True)
+    version = IntField(default=0)
+    updated_at = DateTimeField()
+
+    meta = {'collection': 'catalog_versions'}
+
+
+# ####################    HealthCacheGeneration   #######################################
+class HealthCacheGeneration(Document):
+    # One document per user: panel type -> counter bumped by every write of that
+    # panel, part of the key of the cached health reads (see utils.health_cache)
+    user_id = IntField(primary_key=True)
+    panels = DictField()
+
+    meta = {'collection': 'health_cache_generations'}
+
+
+# ####################    ReportAnalysisCache   #######################################
+class ReportAnalysisCache(Document):
+    # Results of the report analyzer keyed by '<kind>:<sha256 of the PDF>:<version>'
+    # (see utils.report_cache); value is the extracted text or the analysis JSON
+    key = StringField(primary_key=True)
+    kind = StringField()
+    value = StringField()
+    size = IntField()
+    created_at = DateTimeField(default=datetime.datetime.utcnow)
+    last_used_at = DateTimeField(default=datetime.datetime.utcnow)
+
+    meta = {'collection': 'report_analysis_cache'}
+
+
+# ####################    ReportAnalysisCacheStats   #######################################
+class ReportAnalysisCacheStats(Document):
+    # Running total of the ReportAnalysisCache entries (see utils.report_cache), in the document 'size';
+    # recounted by each eviction, as the TTL index deletes entries without updating it
+    key = StringField(primary_key=True)
+    size = IntField(default=0)
+    count = IntField(default=0)
+    counted_at = DateTimeField()
+
+    meta = {'collection': 'report_analysis_cache_stats'}
+
+
+# ####################    ReportAnalysisJob   #######################################
+class ReportAnalysisJob(Document):
+    # A queued analyze_pdf_report run (see utils.report_jobs).
+    # status: queued -> running -> succeeded | failed, back to queued between retries
+    user_id = IntField()  # whose report it is: the records are written for this user
+    submitted_by = IntField()  # the uploader, the user or their dietician or a staff member
+    filename = StringField()
+    pdf = BinaryField()
+    status = StringField(default='queued')
+    attempts = IntField(default=0)
+    max_attempts = IntField(default=3)
+    next_attempt_at = DateTimeField(default=datetime.datetime.utcnow)
+    lease_expires_at = DateTimeField()
+    result = StringField()  # analysis JSON
+    error = StringField()
+    timings = DictField()
+    records = DictField()  # {panel type: id} of the records written from the result
+    records_complete = BooleanField()  # every mapped panel was written
+    records_pending = DateTimeField()  # a request is writing them
+    created_at = DateTimeField(default=datetime.datetime.utcnow)
+    started_at = DateTimeField()
+    finished_at = DateTimeField()
+
+    meta = {'collection': 'report_analysis_jobs'}
+
+
+# ####################    ReportParserStats   #######################################
+class ReportParserStats(Document):
+    # Counters of the report template parser (see utils.report_templates):
+    # reports, fast_path, llm, template:<name>, fallback:<reason>
+    key = StringField(primary_key=True)
+    count = IntField(default=0)
+    last_at = DateTimeField()
+
+    meta = {'collection': 'report_parser_stats'}
+
+
     
 # -------------------------
 # Category Model
@@ -469,9 +577,9 @@ class Cart(Document):
     meta = {'collection': 'add_to_cart'}
 
     def clean(self):
-        """Auto-calculate totals before saving"""
+        """Auto-calculate totals before saving, from the prices stored on the items (no Test reads)"""
         try:
-            self.subTotal = sum(item.test.price for item in self.items)
+            self.subTotal = sum(item.price for item in self.items)
             self.total = self.subTotal
             self.netPayableAmount = self.total  # Can apply discounts/coupons later
         except Exception as e:
@@ -0,0 +1,122 @@
+"""
+Fast read path for the health endpoints.
+
+Converts raw pymongo documents (``QuerySet.as_pymongo()``) straight into the
+representation produced by the DocumentSerializers in ``health.serializers``,
+skipping MongoEngine hydration and per-object serializer introspection.
+
+The converters are compiled once per serializer class from the serializer's
+own field tree, so the output (field order, defaults, number and date
+formatting) stays identical to ``Serializer(instance).data``.
+"""
+from datetime import datetime
+
+from bson import DBRef
+from django.conf import settings
+from mongoengine.fields import EmbeddedDocumentField, ListField
+from rest_framework import fields as drf_fields
+from rest_framework import serializers as drf_serializers
+from rest_framework.settings import api_settings
+from rest_framework_mongoengine import fields as me_fields
+
+_MISSING = object()
+_converters = {}
+
+
+def _format_datetime(field):
+    # DRF formats naive datetimes as UTC ISO 8601 with a trailing Z when USE_TZ is on;
+    # anything else goes through the DRF field itself.
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    fast = settings.USE_TZ and output_format in (None, drf_fields.ISO_8601) and \
+        getattr(settings, 'TIME_ZONE', 'UTC') == 'UTC'
+
+    def convert(value):
+        if fast and isinstance(value, datetime) and value.tzinfo is None:
+            return value.isoformat() + 'Z'
+        return field.to_representation(value)
+    return convert
+
+
+def _reference_id(value):
+    return str(value.id if isinstance(value, DBRef) else value)
+
+
+def _leaf_converter(field):
+    if isinstance(field, drf_fields.IntegerField):
+        return int
+    if isinstance(field, drf_fields.FloatField):
+        return float
+    if isinstance(field, drf_fields.CharField):
+        return str
+    if isinstance(field, me_fields.ObjectIdField):
+        return str
+    if isinstance(field, drf_fields.DateTimeField):
+        return _format_datetime(field)
+    if isinstance(field, me_fields.ReferenceField) and not isinstance(field, me_fields.ComboReferenceField):
+        return _reference_id
+    if isinstance(field, drf_fields.DictField) and isinstance(field.child, drf_fields._UnvalidatedField):
+        return lambda value: {str(key): val for key, val in value.items()}
+    return field.to_representation
+
+
+def _embedded_document(model_field):
+    if isinstance(model_field, ListField):
+        model_field = model_field.field
+    if isinstance(model_field, EmbeddedDocumentField):
+        return model_field.document_type
+    return None
+
+
+def _compile(serializer, document_class):
+    model_fields = document_class._fields if document_class is not None else {}
+    steps = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+
+        model_field = model_fields.get(field.source)
+        key = model_field.db_field if model_field is not None else field.source
+        default = model_field.default if model_field is not None else None
+
+        list_child = getattr(field, 'child', None)
+        if isinstance(field, (drf_serializers.ListSerializer, drf_fields.ListField)) and \
+                isinstance(list_child, drf_serializers.BaseSerializer):
+            # Lists of embedded documents, declared or generated by DocumentSerializer
+            child = _compile(list_child, _embedded_document(model_field))
+            convert = (lambda child: lambda value: [child(item) for item in value])(child)
+        elif isinstance(field, drf_serializers.BaseSerializer):
+            convert = _compile(field, _embedded_document(model_field))
+        else:
+            convert = _leaf_converter(field)
+
+        steps.append((name, key, default, convert))
+
+    def convert_document(son):
+        data = {}
+        for name, key, default, convert in steps:
+            value = son.get(key, _MISSING)
+            if value is _MISSING:
+                # Mirror MongoEngine, which fills in field defaults on load
+                value = default() if callable(default) else default
+            data[name] = None if value is None else convert(value)
+        return data
+
+    return convert_document
+
+
+def get_converter(serializer_class):
+    """Returns the compiled son -> representation converter of a DocumentSerializer class."""
+    converter = _converters.get(serializer_class)
+    if converter is None:
+        converter = _compile(serializer_class(), serializer_class.Meta.model)
+        _converters[serializer_class] = converter
+    return converter
+
+
+def raw_serialize(serializer_class, son):
+    return get_converter(serializer_class)(son)
+
+
+def raw_serialize_many(serializer_class, sons):
+    convert = get_converter(serializer_class)
+    return [convert(son) for son in sons]
@@ -1,4 +1,7 @@
 from rest_framework_mongoengine import serializers
+from rest_framework.exceptions import ValidationError
+
+from utils.cart_utils import cart_items_for_tests
 # from .models import BodyParameters, BloodTestValues,ThyroidProfile,
 from .models import *
 
@@ -174,6 +177,20 @@ class DailyRoutineSerializer(serializers.DocumentSerializer):
         fields = '__all__'
 
 
+# Serializer of each panel type, keyed like HEALTH_PANEL_MODELS
+HEALTH_PANEL_SERIALIZERS = {
+    'body_parameters': BodyParametersSerializer,
+    'blood_test': BloodTestValuesSerializer,
+    'urine_examination': CompleteUrineExaminationSerializer,
+    'esr': ErythrocyteSedimentationRateSerializer,
+    'bun_test': BloodUreaNitrogenTestSerializer,
+    'lipid_profile': LipidProfileSerializer,
+    'liver_function': LiverFunctionTestSerializer,
+    'medical_history': MedicalHistorySerializer,
+    'daily_routine': DailyRoutineSerializer,
+}
+
+
 
 
 # -------------------------
@@ -240,6 +257,8 @@ class CartItemSerializer(serializers.EmbeddedDocumentSerializer):
     class Meta:
         model = CartItem
         fields = '__all__'
+        # Filled from the Test by CartSerializer: clients only choose the tests
+        read_only_fields = ('testName', 'parameterCount', 'price')
 
 
 # -------------------------
@@ -253,6 +272,15 @@ class CartSerializer(serializers.DocumentSerializer):
         model = Cart
         fields = '__all__'
 
+    def validate_items(self, items_data):
+        """Replaces the items by the requested tests with the name, parameter count and price of the Test documents."""
+        # References validate to a DBRef or a Test; both have the ObjectId as .id
+        test_ids = [getattr(item['test'], 'id', item['test']) for item in items_data]
+        items, missing = cart_items_for_tests(test_ids)
+        if missing:
+            raise ValidationError([f'Test {test_id} not found.' for test_id in missing])
+        return items
+
     def create(self, validated_data):
         items_data = validated_data.pop('items', [])
         cart_items = [CartItem(**item) for item in items_data]
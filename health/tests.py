@@ -1,3 +1,698 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import os
+import tempfile
+import unittest
+import uuid
+import warnings
+from unittest import mock
 
-# Create your tests here.
+from bson import Decimal128, ObjectId
+from pymongo.errors import DocumentTooLarge
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from mongoengine import connect, disconnect
+from mongoengine.connection import get_db
+
+from .models import (
+    BloodTestValues, BloodUreaNitrogenTest, Cart, ErythrocyteSedimentationRate, LipidProfile, ReportAnalysisCache, ReportAnalysisCacheStats,
+    ReportAnalysisJob, Test,
+)
+from .serializers import CartSerializer
+from .views import (
+    bulk_create_health_records, create_lipid_profile, get_health_timeline, delete_lipid_profile, get_latest_health_data_by_user,
+    update_lipid_profile, report_analysis_records, submit_report_analysis,
+)
+from accounts.models import Account
+from utils.cart_utils import add_test_to_cart, remove_test_from_cart
+from utils.health_cache import CACHE_ALIAS, cached_call
+from utils.health_export import encode_document
+from utils.health_snapshot import get_user_snapshot, refresh_latest_snapshot, snapshot_record_created
+from utils.health_score import add_score_cache_hook, calculate_health_score, clear_score_cache, remove_score_cache_hook
+from utils.health_timeline import fetch_timeline, timeline_pipeline
+from utils.pagination import HealthCursorPagination
+from utils.report_cache import get_cached, set_cached
+from utils.report_jobs import claim_job, get_job, ingest_job_result, run_job, submit_job
+from utils.report_mapping import ingest_report, map_report, report_date
+from utils.report_templates import parse_report
+
+try:
+    import mongomock
+except ImportError:
+    mongomock = None
+
+TEST_DB = 'healthsync_test'
+
+
+class MongoTestCase(SimpleTestCase):
+    """Runs against an in-memory Mongo (mongomock) so that the tests need no server; each test starts empty."""
+
+    @classmethod
+    def setUpClass(cls):
+        if mongomock is None:
+            raise unittest.SkipTest('The Mongo tests need mongomock: pip install mongomock')
+        super().setUpClass()
+        disconnect()
+        connect(TEST_DB, host='mongodb://localhost', mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect()
+        super().tearDownClass()
+
+    def setUp(self):
+        get_db().client.drop_database(TEST_DB)
+
+
+class CartTotalsTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_id = Test._get_collection().insert_one(
+            {'testName': 'Lipid Profile', 'price': 500.0, 'parametersCovered_count': 8}
+        ).inserted_id
+
+    def test_client_prices_are_ignored(self):
+        serializer = CartSerializer(data={
+            'user_id': 1,
+            'items': [{'test': str(self.test_id), 'price': 1, 'testName': 'Free test'}],
+            'netPayableAmount': 1,
+        })
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        cart = serializer.save()
+
+        self.assertEqual(cart.items[0].price, 500.0)
+        self.assertEqual(cart.items[0].testName, 'Lipid Profile')
+        self.assertEqual(cart.items[0].parameterCount, 8)
+        self.assertEqual((cart.subTotal, cart.total, cart.netPayableAmount), (500.0, 500.0, 500.0))
+
+    def test_update_reprices_items(self):
+        cart = Cart(user_id=1).save()
+        serializer = CartSerializer(cart, data={'items': [{'test': str(self.test_id), 'price': 0}] * 2}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.save().netPayableAmount, 1000.0)
+
+    def test_unknown_test_is_rejected(self):
+        serializer = CartSerializer(data={'user_id': 1, 'items': [{'test': str(ObjectId())}]})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('items', serializer.errors)
+
+
+class CartUpdateTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        tests = Test._get_collection()
+        self.lipid = tests.find_one({'_id': tests.insert_one({'testName': 'Lipid Profile', 'price': 500.0}).inserted_id})
+        self.thyroid = tests.find_one({'_id': tests.insert_one({'testName': 'Thyroid Profile', 'price': 300.0}).inserted_id})
+
+    def totals(self, cart):
+        return [item['test'] for item in cart['items']], (cart['subTotal'], cart['total'], cart['netPayableAmount'])
+
+    def test_first_add_creates_the_cart(self):
+        cart, added = add_test_to_cart(1, self.lipid)
+        self.assertTrue(added)
+        self.assertEqual(self.totals(cart), ([self.lipid['_id']], (500.0, 500.0, 500.0)))
+        self.assertEqual(Cart.objects(user_id=1).count(), 1)
+
+    def test_adds_update_the_totals(self):
+        add_test_to_cart(1, self.lipid)
+        cart, added = add_test_to_cart(1, self.thyroid)
+        self.assertTrue(added)
+        self.assertEqual(self.totals(cart), ([self.lipid['_id'], self.thyroid['_id']], (800.0, 800.0, 800.0)))
+
+    def test_duplicate_add_is_a_no_op(self):
+        add_test_to_cart(1, self.lipid)
+        add_test_to_cart(1, self.thyroid)
+        cart, added = add_test_to_cart(1, self.lipid)
+        self.assertFalse(added)
+        self.assertEqual(self.totals(cart), ([self.lipid['_id'], self.thyroid['_id']], (800.0, 800.0, 800.0)))
+
+    def test_remove_recomputes_the_totals(self):
+        add_test_to_cart(1, self.lipid)
+        add_test_to_cart(1, self.thyroid)
+        cart = remove_test_from_cart(1, self.lipid['_id'])
+        self.assertEqual(self.totals(cart), ([self.thyroid['_id']], (300.0, 300.0, 300.0)))
+        self.assertIsNone(remove_test_from_cart(1, self.lipid['_id']))
+        cart = remove_test_from_cart(1, self.thyroid['_id'])
+        self.assertEqual(self.totals(cart), ([], (0, 0, 0)))
+
+
+def _text_page(*lines, number=1):
+    return {'page': number, 'text': '\n'.join(lines), 'tables': []}
+
+
+class ReportTemplateTests(SimpleTestCase):
+    header = 'Investigation Observed Value Unit Biological Reference Interval'
+
+    def investigations(self, analysis):
+        return [investigation for section in analysis['test_sections'] for investigation in section['investigations']]
+
+    def test_numeric_names(self):
+        analysis, info = parse_report([_text_page(
+            'Thyroid Profile', self.header,
+            'Vitamin D 25 OH 32 ng/mL 30 - 100',
+            'CA 125 15 U/mL 0 - 35',
+            'T3 Total 1.2 ng/mL 0.6 - 1.81',
+        )])
+        self.assertEqual(info['coverage'], 1.0)
+        self.assertEqual(
+            [(row['name'], row['observed_value'], row.get('unit'), row['biological_reference_interval'])
+             for row in self.investigations(analysis)],
+            [('Vitamin D 25 OH', '32', 'ng/mL', '30 - 100'), ('CA 125', '15', 'U/mL', '0 - 35'),
+             ('T3 Total', '1.2', 'ng/mL', '0.6 - 1.81')],
+        )
+
+    def test_flags_are_not_part_of_the_name(self):
+        analysis, _ = parse_report([_text_page(
+            self.header, 'Triglycerides H 180 mg/dL < 150', 'HDL Cholesterol 38 L mg/dL > 40',
+        )])
+        self.assertEqual(
+            [(row['name'], row['observed_value']) for row in self.investigations(analysis)],
+            [('Triglycerides', '180'), ('HDL Cholesterol', '38')],
+        )
+
+    def test_rows_not_understood_lower_the_coverage(self):
+        analysis, info = parse_report([_text_page(
+            self.header, 'TSH 3.1 uIU/mL 0.35 - 5.5', 'Free T4 1.1 ng/dL see comment 2',
+        )])
+        self.assertIsNone(analysis)
+        self.assertEqual((info['candidates'], info['parsed']), (2, 1))
+
+    def test_unknown_layout_falls_back(self):
+        analysis, info = parse_report([_text_page('Hemoglobin 12.5 g/dL 12 - 15')])
+        self.assertIsNone(analysis)
+        self.assertEqual(info['templates'], [])
+
+
+def _investigation(name, value, interval='', unit=None):
+    investigation = {'name': name, 'observed_value': value, 'biological_reference_interval': interval, 'method': ''}
+    if unit:
+        investigation['unit'] = unit
+    return investigation
+
+
+def _analysis(*sections, collected_on='12/03/2024 09:10 AM'):
+    return {
+        'patient_details': {'collected_on': collected_on},
+        'test_sections': [
+            {'department': '', 'test_name': test_name, 'investigations': list(investigations)}
+            for test_name, investigations in sections
+        ],
+    }
+
+
+class ReportMappingTests(SimpleTestCase):
+    def test_units_are_converted(self):
+        panels = map_report(_analysis(
+            ('Lipid Profile', [_investigation('Total Cholesterol', '5.2', unit='mmol/L'),
+                               _investigation('HDL Cholesterol', '45 L', '> 40 mg/dL')]),
+            ('Vitamin D', [_investigation('25 Hydroxy Vitamin D', '75', '75 - 250 nmol/L')]),
+            ('Complete Blood Count', [_investigation('Platelet Count', '2.5', unit='lakhs/cumm'),
+                                      _investigation('Total WBC Count', '7.2', unit='10^3/µL'),
+                                      _investigation('Neutrophils', '60', '40 - 80 %'),
+                                      _investigation('Neutrophils', '4,320', unit='cells/cumm')]),
+        ))['panels']
+        self.assertEqual(panels['lipid_profile'], {'total_cholesterol': 201.084, 'hdl_cholesterol': 45.0})
+        self.assertAlmostEqual(panels['blood_test']['vitamin_d_25'], 30.05, places=2)
+        self.assertEqual(panels['esr']['hemogram'], {
+            'platelet_count': 250.0, 'total_wbc_count': 7200.0, 'neutrophils': 60.0, 'absolute_neutrophil_count': 4320.0,
+        })
+
+    def test_bun_is_converted_to_urea(self):
+        self.assertEqual(map_report(_analysis(('Renal', [_investigation('BUN', '10', '7 - 20 mg/dL')])))['panels'],
+                         {'bun_test': {'blood_urea_nitrogen': {'urea': 21.4}}})
+        self.assertEqual(map_report(_analysis(('Renal', [_investigation('Blood Urea', '5', unit='mmol/L')])))['panels'],
+                         {'bun_test': {'blood_urea_nitrogen': {'urea': 30.03}}})
+
+    def test_measured_urea_wins_over_bun(self):
+        for rows in ([_investigation('BUN', '10', unit='mg/dL'), _investigation('Blood Urea', '25', unit='mg/dL')],
+                     [_investigation('Blood Urea', '25', unit='mg/dL'), _investigation('BUN', '10', unit='mg/dL')]):
+            mapping = map_report(_analysis(('Renal', rows)))
+            self.assertEqual(mapping['panels'], {'bun_test': {'blood_urea_nitrogen': {'urea': 25.0}}})
+            self.assertEqual([row['name'] for row in mapping['mapped']], ['Blood Urea'])
+            self.assertEqual([row['name'] for row in mapping['unmapped']], ['BUN'])
+
+    def test_inverse_ratios_stay_unmapped(self):
+        mapping = map_report(_analysis(
+            ('Lipid Profile', [_investigation('HDL/LDL Ratio', '0.3'), _investigation('LDL/HDL Ratio', '3.1')]),
+            ('Liver Function', [_investigation('SGPT/SGOT Ratio', '1.4')]),
+        ))
+        self.assertEqual(mapping['panels'], {'lipid_profile': {'ldl_hdl_ratio': 3.1}})
+        self.assertEqual([row['name'] for row in mapping['unmapped']], ['HDL/LDL Ratio', 'SGPT/SGOT Ratio'])
+
+    def test_censored_values_are_not_stored(self):
+        mapping = map_report(_analysis(('Renal', [_investigation('Serum Creatinine', '<0.5', unit='mg/dL')])))
+        self.assertEqual(mapping['panels'], {})
+        self.assertEqual(mapping['unmapped'][0]['reason'], 'Censored value: <0.5')
+
+    def test_report_dates(self):
+        for text, expected in (('12/03/2024 09:10 AM', datetime.datetime(2024, 3, 12, 9, 10)),
+                               ('2024-03-12T09:15:00', datetime.datetime(2024, 3, 12, 9, 15)),
+                               ('2024-03-12T09:15:00+05:30', datetime.datetime(2024, 3, 12, 3, 45)),
+                               ('12-Mar-2024', datetime.datetime(2024, 3, 12)),
+                               ('soon', None)):
+            self.assertEqual(report_date(_analysis(collected_on=text)), expected, text)
+
+    def test_unknown_units_and_names_are_reported(self):
+        mapping = map_report(_analysis(('Misc', [_investigation('TSH', '3.1', unit='furlongs'), _investigation('ESR', '12')])))
+        self.assertEqual(mapping['panels'], {})
+        self.assertEqual([row['name'] for row in mapping['unmapped']], ['TSH', 'ESR'])
+
+
+class ReportIngestionTests(MongoTestCase):
+    analysis = _analysis(
+        ('Thyroid Profile', [_investigation('TSH', '3.1', unit='µIU/mL')]),
+        ('Lipid Profile', [_investigation('LDL Cholesterol', '130', '< 100 mg/dL')]),
+        ('Renal', [_investigation('Serum Creatinine', '88.4', unit='µmol/L')]),
+    )
+
+    def test_records_are_dated_like_the_report(self):
+        outcome = ingest_report(self.analysis, user_id=5)
+        self.assertEqual(outcome['errors'], {})
+        collected = datetime.datetime(2024, 3, 12, 9, 10)
+        self.assertEqual(BloodTestValues.objects.get(user_id=5).date, collected)
+        for model in (BloodTestValues, LipidProfile, BloodUreaNitrogenTest):
+            self.assertEqual(model.objects.get(user_id=5).created_at, collected)
+        self.assertEqual(BloodUreaNitrogenTest.objects.get(user_id=5).creatinine_serum.creatinine, 1.0)
+
+    def test_partial_failure_can_be_retried(self):
+        job_id = ReportAnalysisJob._get_collection().insert_one(
+            {'user_id': 5, 'status': 'succeeded', 'result': json.dumps(self.analysis)}
+        ).inserted_id
+        # The lipid profile insert is refused
+        lipid_profiles = LipidProfile._get_collection()
+        lipid_profiles.create_index('user_id', unique=True)
+        lipid_profiles.insert_one({'user_id': 5})
+
+        outcome = ingest_job_result({'_id': job_id, 'result': json.dumps(self.analysis)})
+        self.assertEqual(set(outcome['created']), {'blood_test', 'bun_test'})
+        self.assertEqual(set(outcome['errors']), {'lipid_profile'})
+
+        lipid_profiles.delete_many({})
+        outcome = ingest_job_result({'_id': job_id, 'result': json.dumps(self.analysis)})
+        self.assertEqual(set(outcome['created']), {'lipid_profile'})
+        self.assertEqual(set(outcome['records']), {'blood_test', 'bun_test', 'lipid_profile'})
+        self.assertEqual(BloodTestValues.objects(user_id=5).count(), 1)
+        self.assertIsNone(ingest_job_result({'_id': job_id, 'result': json.dumps(self.analysis)}))
+
+
+class ReportJobTests(MongoTestCase):
+    def submit(self, max_attempts=2):
+        return submit_job(b'%PDF-1.4', 'report.pdf', user_id=5, max_attempts=max_attempts, run_locally=False)
+
+    def expire_lease(self, job_id):
+        ReportAnalysisJob._get_collection().update_one(
+            {'_id': job_id}, {'$set': {'lease_expires_at': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)}}
+        )
+
+    def test_a_job_is_claimed_once(self):
+        job_id = self.submit()
+        job = claim_job()
+        self.assertEqual((job['_id'], job['status'], job['attempts']), (job_id, 'running', 1))
+        self.assertIsNone(claim_job())
+
+    @mock.patch('utils.report_jobs.analyze_pdf_report', return_value={'test_sections': []})
+    def test_success_drops_the_pdf(self, analyze):
+        job_id = self.submit()
+        self.assertEqual(run_job(claim_job()), 'succeeded')
+        analyze.assert_called_once()
+        job = ReportAnalysisJob._get_collection().find_one({'_id': job_id})
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertNotIn('pdf', job)
+
+    @mock.patch('utils.report_jobs.kick')
+    @mock.patch('utils.report_jobs.analyze_pdf_report', side_effect=TimeoutError('LLM timed out'))
+    def test_failures_are_retried_up_to_max_attempts(self, analyze, kick):
+        job_id = self.submit()
+        self.assertEqual(run_job(claim_job()), 'queued')
+        self.assertIsNone(claim_job())
+        ReportAnalysisJob._get_collection().update_one({'_id': job_id}, {'$set': {'next_attempt_at': datetime.datetime.utcnow()}})
+        self.assertEqual(run_job(claim_job()), 'failed')
+
+        job = ReportAnalysisJob._get_collection().find_one({'_id': job_id})
+        self.assertEqual((job['status'], job['attempts'], job['error']), ('failed', 2, 'LLM timed out'))
+        self.assertNotIn('pdf', job)
+
+    @mock.patch('utils.report_jobs.kick')
+    def test_unparsed_answers_are_retried(self, kick):
+        job_id = self.submit()
+        unparsed = {'error': 'Failed to parse JSON from LLM response', 'raw_response': '{"test_sections": ['}
+        with mock.patch('utils.report_jobs.analyze_pdf_report', return_value=unparsed):
+            self.assertEqual(run_job(claim_job()), 'queued')
+        self.assertEqual(get_job(job_id)['error'], 'Failed to parse JSON from LLM response')
+
+        ReportAnalysisJob._get_collection().update_one({'_id': job_id}, {'$set': {'next_attempt_at': datetime.datetime.utcnow()}})
+        with mock.patch('utils.report_jobs.analyze_pdf_report', return_value={'test_sections': []}):
+            self.assertEqual(run_job(claim_job()), 'succeeded')
+        job = get_job(job_id)
+        self.assertEqual((job['attempts'], job['error'], json.loads(job['result'])), (2, None, {'test_sections': []}))
+
+    def test_expired_lease_is_claimed_again(self):
+        job_id = self.submit()
+        stale = claim_job()
+        self.expire_lease(job_id)
+        job = claim_job()
+        self.assertEqual((job['_id'], job['attempts']), (job_id, 2))
+        # The worker that lost the lease may no longer record an outcome
+        with mock.patch('utils.report_jobs.analyze_pdf_report', return_value={'test_sections': []}):
+            run_job(stale)
+        self.assertEqual(get_job(job_id)['status'], 'running')
+
+    def test_expired_lease_on_the_last_attempt_fails(self):
+        job_id = self.submit(max_attempts=1)
+        claim_job()
+        self.expire_lease(job_id)
+        self.assertIsNone(claim_job())
+        job = ReportAnalysisJob._get_collection().find_one({'_id': job_id})
+        self.assertEqual((job['status'], job['attempts']), ('failed', 1))
+        self.assertNotIn('pdf', job)
+
+
+class HealthCacheKeyTests(SimpleTestCase):
+    def test_datetime_args_give_valid_keys(self):
+        calls = []
+        since = datetime.datetime(2024, 3, 12, 9, 10)
+
+        def read(*args):
+            calls.append(args)
+            return len(calls)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            first = cached_call('cache_key_test', 1, 'lipid_profile', {}, read, since, 'latest values')
+            second = cached_call('cache_key_test', 1, 'lipid_profile', {}, read, since, 'latest values')
+            other = cached_call('cache_key_test', 1, 'lipid_profile', {}, read, since.replace(hour=10), 'latest values')
+        self.assertEqual((first, second, other), (1, 1, 2))
+
+
+class ReportCacheTests(MongoTestCase):
+    def cache_size(self):
+        return ReportAnalysisCacheStats._get_collection().find_one({'_id': 'size'})['size']
+
+    @mock.patch('utils.report_cache.evict')
+    def test_inserts_keep_a_running_size(self, evict):
+        set_cached('pages', 'a', 1, 'x' * 10)
+        set_cached('pages', 'b', 1, 'x' * 20)
+        set_cached('pages', 'b', 1, 'x' * 20)
+        self.assertEqual(self.cache_size(), 30)
+        evict.assert_not_called()
+
+    @mock.patch('utils.report_cache.REPORT_CACHE_MAX_BYTES', 25)
+    def test_least_recently_used_is_evicted_over_budget(self):
+        set_cached('pages', 'a', 1, 'x' * 10)
+        set_cached('pages', 'b', 1, 'x' * 10)
+        ReportAnalysisCache._get_collection().update_one(
+            {'_id': 'pages:b:1'}, {'$set': {'last_used_at': datetime.datetime(2024, 1, 1)}}
+        )
+        set_cached('pages', 'c', 1, 'x' * 10)
+        self.assertEqual(sorted(doc['_id'] for doc in ReportAnalysisCache._get_collection().find()), ['pages:a:1', 'pages:c:1'])
+        self.assertEqual(self.cache_size(), 20)
+
+    def test_entries_too_large_are_not_cached(self):
+        with mock.patch.object(ReportAnalysisCache._get_collection(), 'insert_one', side_effect=DocumentTooLarge()):
+            set_cached('analysis', 'a', 1, '{}')
+        self.assertIsNone(get_cached('analysis', 'a', 1))
+
+
+class ExportEncodingTests(SimpleTestCase):
+    def test_decimal128_and_uuid(self):
+        line = encode_document({
+            '_id': ObjectId('0123456789abcdef01234567'), 'price': Decimal128('12.50'),
+            'token': uuid.UUID('12345678-1234-5678-1234-567812345678'), 'created_at': datetime.datetime(2024, 3, 12),
+        })
+        self.assertEqual(json.loads(line), {
+            'id': '0123456789abcdef01234567', 'price': 12.5, 'token': '12345678-1234-5678-1234-567812345678',
+            'created_at': '2024-03-12T00:00:00Z',
+        })
+
+
+class ScoreCacheHookTests(SimpleTestCase):
+    def test_each_call_reports_its_own_lookup(self):
+        outcomes = []
+        clear_score_cache()
+        add_score_cache_hook(outcomes.append)
+        try:
+            calculate_health_score({'bmi': 22})
+            calculate_health_score({'bmi': 22})
+            calculate_health_score({'bmi': 35})
+        finally:
+            remove_score_cache_hook(outcomes.append)
+        self.assertEqual(outcomes, [False, True, False])
+
+
+class DateRangeFilterTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        for hour in (0, 12, 23):
+            LipidProfile(user_id=1, created_at=datetime.datetime(2024, 3, 12, hour)).save()
+        LipidProfile(user_id=1, created_at=datetime.datetime(2024, 3, 13)).save()
+
+    def hours(self, **params):
+        request = Request(APIRequestFactory().get('/', params))
+        queryset = HealthCursorPagination().filter_queryset(LipidProfile.objects, request).order_by('created_at')
+        return [(record.created_at.day, record.created_at.hour) for record in queryset]
+
+    def test_end_date_includes_the_whole_day(self):
+        self.assertEqual(self.hours(end_date='2024-03-12'), [(12, 0), (12, 12), (12, 23)])
+
+    def test_end_datetime_is_inclusive(self):
+        self.assertEqual(self.hours(start_date='2024-03-12T12:00:00', end_date='2024-03-12T23:00:00'), [(12, 12), (12, 23)])
+
+
+class BulkCreateTests(MongoTestCase):
+    def post(self, rows):
+        request = APIRequestFactory().post('/', rows, format='json')
+        force_authenticate(request, user=Account(id=1, email='staff@example.com'))
+        return bulk_create_health_records(request, panel_type='lipid_profile')
+
+    def test_all_rows_created(self):
+        response = self.post([{'user_id': 1, 'total_cholesterol': 180}, {'user_id': 1, 'total_cholesterol': 190}])
+        self.assertEqual((response.status_code, response.data['created'], response.data['failed']), (201, 2, 0))
+        self.assertEqual(LipidProfile.objects(user_id=1).count(), 2)
+
+    def test_some_rows_fail(self):
+        response = self.post([{'user_id': 1, 'total_cholesterol': 180}, {'user_id': 1, 'total_cholesterol': 'high'}])
+        self.assertEqual((response.status_code, response.data['created'], response.data['failed']), (207, 1, 1))
+        self.assertEqual([result['status'] for result in response.data['results']], ['created', 'error'])
+        self.assertIn('total_cholesterol', response.data['results'][1]['errors'])
+        self.assertEqual(LipidProfile.objects(user_id=1).count(), 1)
+
+    def test_no_row_created(self):
+        response = self.post([{'user_id': 1, 'total_cholesterol': 'high'}])
+        self.assertEqual((response.status_code, response.data['created']), (400, 0))
+        self.assertEqual(self.post([]).status_code, 400)
+
+
+class ReportForClientTests(MongoTestCase):
+    dietician = Account(id=3, email='dietician@example.com', role='dietitian')
+
+    def submit(self, user, **data):
+        upload = SimpleUploadedFile('report.pdf', b'%PDF-1.4', content_type='application/pdf')
+        request = APIRequestFactory().post('/', dict(data, file=upload), format='multipart')
+        force_authenticate(request, user=user)
+        with mock.patch('utils.report_jobs.kick'):
+            return submit_report_analysis(request)
+
+    @mock.patch('health.views.is_client_of', return_value=True)
+    def test_dietician_uploads_for_a_client(self, is_client_of):
+        response = self.submit(self.dietician, user_id=7)
+        self.assertEqual(response.status_code, 202)
+        is_client_of.assert_called_once_with(3, 7)
+        job = ReportAnalysisJob._get_collection().find_one()
+        self.assertEqual((job['user_id'], job['submitted_by']), (7, 3))
+
+        analysis = _analysis(('Lipid Profile', [_investigation('LDL Cholesterol', '130', unit='mg/dL')]))
+        ReportAnalysisJob._get_collection().update_one(
+            {'_id': job['_id']}, {'$set': {'status': 'succeeded', 'result': json.dumps(analysis)}}
+        )
+        request = APIRequestFactory().post('/', {}, format='json')
+        force_authenticate(request, user=self.dietician)
+        self.assertEqual(report_analysis_records(request, job_id=str(job['_id'])).status_code, 201)
+        record = LipidProfile.objects.get()
+        self.assertEqual((record.user_id, record.dietician_id), (7, 3))
+
+    @mock.patch('health.views.is_client_of', return_value=False)
+    def test_other_users_are_refused(self, is_client_of):
+        self.assertEqual(self.submit(self.dietician, user_id=8).status_code, 403)
+        self.assertEqual(self.submit(Account(id=9, email='user@example.com'), user_id=8).status_code, 403)
+        self.assertEqual(self.submit(Account(id=1, email='staff@example.com', is_staff=True), user_id=8).status_code, 202)
+        self.assertEqual(ReportAnalysisJob._get_collection().find_one()['user_id'], 8)
+
+
+class LatestSnapshotTests(MongoTestCase):
+    def create(self, day):
+        record = LipidProfile(user_id=1, total_cholesterol=150 + day, created_at=datetime.datetime(2024, 3, day)).save()
+        snapshot_record_created('lipid_profile', record)
+        return record
+
+    def latest_id(self):
+        return (get_user_snapshot(1, ['lipid_profile']).get('lipid_profile') or {}).get('record_id')
+
+    def test_only_newer_records_are_promoted(self):
+        newer = self.create(12)
+        self.create(10)
+        self.assertEqual(self.latest_id(), newer.pk)
+
+    def test_update_refresh(self):
+        older, newer = self.create(10), self.create(12)
+        older.update(set__created_at=datetime.datetime(2024, 3, 14))
+        refresh_latest_snapshot('lipid_profile', 1)
+        self.assertEqual(self.latest_id(), older.pk)
+
+        newer.update(set__total_cholesterol=200)
+        refresh_latest_snapshot('lipid_profile', 1)
+        self.assertEqual(self.latest_id(), older.pk)
+
+    def test_delete_refresh(self):
+        older, newer = self.create(10), self.create(12)
+        newer.delete()
+        refresh_latest_snapshot('lipid_profile', 1)
+        self.assertEqual(self.latest_id(), older.pk)
+        older.delete()
+        refresh_latest_snapshot('lipid_profile', 1)
+        self.assertIsNone(self.latest_id())
+
+    def test_concurrent_create_is_kept(self):
+        older, newer = self.create(10), self.create(12)
+        newer.delete()
+        collection = LipidProfile._get_collection()
+        find_one = collection.find_one
+        created = []
+
+        def create_meanwhile(*args, **kwargs):
+            latest = find_one(*args, **kwargs)
+            created.append(self.create(14))
+            return latest
+
+        with mock.patch.object(collection, 'find_one', side_effect=create_meanwhile):
+            refresh_latest_snapshot('lipid_profile', 1)
+        self.assertEqual(self.latest_id(), created[0].pk)
+
+
+class LatestDataConditionalGetTests(MongoTestCase):
+    user = Account(id=1, email='user@example.com')
+
+    def setUp(self):
+        super().setUp()
+        # The read cache outlives the dropped database, whose generations restart at 0
+        caches[CACHE_ALIAS].clear()
+
+    def call(self, view, method='get', data=None, etag=None, **kwargs):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        request = getattr(APIRequestFactory(), method)('/?type=lipid_profile', data, format='json', **headers)
+        force_authenticate(request, user=self.user)
+        return view(request, **kwargs)
+
+    def get(self, etag=None):
+        return self.call(get_latest_health_data_by_user, etag=etag, user_id=1)
+
+    def assert_changed(self, etag):
+        response = self.get(etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get(response['ETag']).status_code, 304)
+        return response['ETag'], response.data['data']
+
+    def test_revalidation(self):
+        older = self.call(create_lipid_profile, 'post', {'user_id': 1, 'total_cholesterol': 150, 'created_at': '2024-03-10T00:00:00'})
+        self.assertEqual(older.status_code, 201)
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(self.get(etag).status_code, 304)
+
+        newer = self.call(create_lipid_profile, 'post', {'user_id': 1, 'total_cholesterol': 180})
+        etag, data = self.assert_changed(etag)
+        self.assertEqual(data['total_cholesterol'], 180)
+
+        newer_id = newer.data['data']['id']
+        self.call(update_lipid_profile, 'put', {'total_cholesterol': 190}, pk=newer_id)
+        etag, data = self.assert_changed(etag)
+        self.assertEqual(data['total_cholesterol'], 190)
+
+        self.call(delete_lipid_profile, 'delete', pk=newer_id)
+        etag, data = self.assert_changed(etag)
+        self.assertEqual(data['total_cholesterol'], 150)
+
+
+class HealthTimelineTests(MongoTestCase):
+    def test_branches_project_the_serialized_fields(self):
+        pipeline = timeline_pipeline(1, ['lipid_profile', 'esr'])
+        self.assertEqual(pipeline[3]['$project'], {field.db_field: 1 for field in LipidProfile._fields.values()})
+        self.assertIn({'$project': {field.db_field: 1 for field in ErythrocyteSedimentationRate._fields.values()}},
+                      pipeline[5]['$unionWith']['pipeline'])
+
+    def test_repeated_types_are_read_once(self):
+        LipidProfile._get_collection().insert_one({'user_id': 1, 'total_cholesterol': 180, 'lab_notes': 'x' * 1000,
+                                                   'created_at': datetime.datetime(2024, 3, 12)})
+        request = APIRequestFactory().get('/', {'type': 'lipid_profile,lipid_profile'})
+        force_authenticate(request, user=Account(id=1, email='user@example.com'))
+        response = get_health_timeline(request, user_id=1)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(result['type'], result['data']['total_cholesterol']) for result in response.data['results']],
+                         [('lipid_profile', 180.0)])
+        self.assertNotIn('lab_notes', fetch_timeline(1, ['lipid_profile'])[0])
+
+
+class ImportHealthCsvTests(MongoTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write(self, name, text):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w', newline='') as target:
+            target.write(text)
+        return path
+
+    def import_csv(self, path, *args):
+        output = io.StringIO()
+        call_command('import_health_csv', 'esr', path, '--workers', '0', *args, stdout=output)
+        return output.getvalue()
+
+    def test_columns_maps_defaults_and_errors(self):
+        path = self.write('esr.csv', (
+            'User ID,Hb,hemogram.mcv,Platelet Count,Notes\n'
+            '1,13.5,88,250,fasting\n'
+            '2,low,90,,\n'
+            ',,,,\n'
+            '3,12.1,,310,\n'
+        ))
+        errors = os.path.join(self.directory.name, 'errors.csv')
+        output = self.import_csv(path, '--map', 'Hb=hemogram.hemoglobin', '--default', 'dietician_id=12', '--errors', errors)
+
+        self.assertIn('Ignored columns: Notes', output)
+        self.assertIn('3 rows read, 2 created, 1 rejected', output)
+        records = {record.user_id: record for record in ErythrocyteSedimentationRate.objects}
+        self.assertEqual(sorted(records), [1, 3])
+        self.assertEqual((records[1].hemogram.hemoglobin, records[1].hemogram.mcv, records[1].hemogram.platelet_count),
+                         (13.5, 88.0, 250.0))
+        self.assertEqual((records[3].dietician_id, records[3].hemogram.mcv), (12, None))
+
+        with open(errors, newline='') as source:
+            rows = list(csv.reader(source))
+        self.assertEqual(rows[0], ['line', 'errors'])
+        self.assertEqual([row[0] for row in rows[1:]], ['3'])
+        self.assertIn('hemoglobin', rows[1][1])
+
+    def test_dry_run_writes_nothing(self):
+        output = self.import_csv(self.write('esr.csv', 'user_id,hemoglobin\n1,13.5\n'), '--dry-run')
+        self.assertIn('1 valid', output)
+        self.assertEqual(ErythrocyteSedimentationRate.objects.count(), 0)
+
+    def test_unknown_fields_are_refused(self):
+        path = self.write('esr.csv', 'user_id,hemoglobin\n1,13.5\n')
+        with self.assertRaisesMessage(CommandError, 'Unknown field in --map'):
+            self.import_csv(path, '--map', 'Hb=hemogram.nothing')
+        with self.assertRaisesMessage(CommandError, 'Unknown field in --default'):
+            self.import_csv(path, '--default', 'nothing=1')
+        with self.assertRaisesMessage(CommandError, 'No column matches'):
+            self.import_csv(self.write('other.csv', 'name,age\nA,3\n'))
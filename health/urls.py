@@ -5,6 +5,7 @@ urlpatterns = [
     path('body-parameters/', views.list_body_parameters),
     path('body-parameters/clientDashBoard/<str:dietician_id>/', views.list_user_body_summary),
     path('body-parameters/create/',views.create_body_parameters),
+    path('body-parameters/bulk/', views.bulk_create_health_records, {'panel_type': 'body_parameters'}),
     path('body-parameters/<str:pk>/',views.update_body_parameters),
     path('body-parameters/delete/<str:pk>/', views.delete_body_parameters, name='delete_body_parameters'),
     path('body-parameters/byUser/<str:user_id>/', views.get_body_parameters_by_user, name='get_body_parameters_by_user'),
@@ -15,12 +16,14 @@ urlpatterns = [
 
 
     path('blood-test/create/',views.create_blood_test_values),
+    path('blood-test/bulk/', views.bulk_create_health_records, {'panel_type': 'blood_test'}),
     path('blood-test/',views.list_blood_test_values),
     path('blood-test/<str:pk>/',views.update_blood_test_values),
     path('blood-test/delete/<str:pk>/', views.delete_blood_test_values),
 
 
     path('CUE/create/',views.create_complete_urine_examination),
+    path('CUE/bulk/', views.bulk_create_health_records, {'panel_type': 'urine_examination'}),
     path('CUE/',views.list_complete_urine_examinations),
     path('CUE/<str:pk>/',views.update_complete_urine_examination),
     path('CUE/delete/<str:pk>/', views.delete_complete_urine_examination),
@@ -28,30 +31,35 @@ urlpatterns = [
 
 
     path('ESR/create/',views.create_Erythrocyte_sedimentation_rate),
+    path('ESR/bulk/', views.bulk_create_health_records, {'panel_type': 'esr'}),
     path('ESR/',views.list_Erythrocyte_sedimentation_rates),
     path('ESR/<str:pk>/',views.update_Erythrocyte_sedimentation_rate),
     path('ESR/delete/<str:pk>/', views.delete_Erythrocyte_sedimentation_rate),
 
 
     path('blood-urea/create/', views.create_blood_urea_nitrogen_test),
+    path('blood-urea/bulk/', views.bulk_create_health_records, {'panel_type': 'bun_test'}),
     path('blood-urea/', views.list_blood_urea_nitrogen_tests),
     path('blood-urea/<str:pk>/', views.update_blood_urea_nitrogen_test),
     path('blood-urea/delete/<str:pk>/', views.delete_blood_urea_nitrogen_test),
 
 
     path('lipid-profile/create/', views.create_lipid_profile),
+    path('lipid-profile/bulk/', views.bulk_create_health_records, {'panel_type': 'lipid_profile'}),
     path('lipid-profile/', views.list_lipid_profiles),
     path('lipid-profile/<str:pk>/', views.update_lipid_profile),
     path('lipid-profile/delete/<str:pk>/', views.delete_lipid_profile),
 
 
     path('liver-function-test/create/', views.create_liver_function_test),
+    path('liver-function-test/bulk/', views.bulk_create_health_records, {'panel_type': 'liver_function'}),
     path('liver-function-test/', views.list_liver_function_tests),
     path('liver-function-test/<str:pk>/', views.update_liver_function_test),
     path('liver-function-test/delete/<str:pk>/', views.delete_liver_function_test),
 
 
     path('medical-history/create/', views.create_medical_history),
+    path('medical-history/bulk/', views.bulk_create_health_records, {'panel_type': 'medical_history'}),
     path('medical-history/', views.list_medical_histories),
     path('medical-history/<str:pk>/', views.update_medical_history),
     path('medical-history/delete/<str:pk>/', views.delete_medical_history),
@@ -59,6 +67,7 @@ urlpatterns = [
 
 
     path('daily-routine/create/', views.create_daily_routine),
+    path('daily-routine/bulk/', views.bulk_create_health_records, {'panel_type': 'daily_routine'}),
     path('daily-routine/', views.list_daily_routines),
     path('daily-routine/<str:pk>/', views.update_daily_routine),
     path('daily-routine/delete/<str:pk>/', views.delete_daily_routine),
@@ -67,6 +76,12 @@ urlpatterns = [
 ##################fetch  from all health models############
     path('latest/<int:user_id>/', views.get_latest_health_data_by_user, name='get_latest_health_data_by_user'),
     path('byUserId/<int:user_id>/', views.get_health_data_by_user),
+    path('timeline/<int:user_id>/', views.get_health_timeline, name='get_health_timeline'),
+    path('cache/stats/', views.health_cache_stats, name='health_cache_stats'),
+    path('report-analysis/', views.submit_report_analysis, name='submit_report_analysis'),
+    path('report-analysis/stats/', views.report_parser_stats, name='report_parser_stats'),
+    path('report-analysis/<str:job_id>/', views.report_analysis_status, name='report_analysis_status'),
+    path('report-analysis/<str:job_id>/records/', views.report_analysis_records, name='report_analysis_records'),
    
 
 #####category#######
@@ -84,6 +99,7 @@ urlpatterns = [
 ########test#######
     path('test/create/', views.test_create, name='test_create'),
     path('test/list/', views.test_list, name='test_list'),
+    path('test/search/', views.test_search, name='test_search'),
     path('test/<str:pk>/', views.test_update, name='test_update'),
     path('test/delete/<str:pk>/', views.test_delete, name='test_delete'),
     path('test/detail/<str:pk>/', views.test_detail, name='test_detail'),
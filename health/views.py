@@ -1,20 +1,58 @@
 from unicodedata import category
+import os
+from django.http import HttpResponse
 from django.utils.dateparse import parse_date
 from datetime import datetime, timedelta
-from rest_framework.decorators import api_view, permission_classes, authentication_classes
+from rest_framework.decorators import api_view, permission_classes, authentication_classes, renderer_classes
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework.response import Response
 from rest_framework import status
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from .models import *
 from datetime import datetime
-from utils.health_score import calculate_health_score
-from utils.user_utils import fetch_user_profile_by_id, dietician_clients_health_summary
-
+from utils.health_score import RULES_VERSION, calculate_health_score, refresh_stale_scores, score_cache_info
+from utils.user_utils import dietician_clients_health_summary, is_client_of
+from utils.health_snapshot import snapshot_record_created, refresh_latest_snapshot, get_latest_record, get_user_snapshot, update_snapshot_scores
+from utils.pagination import HealthCursorPagination, TestSearchPagination, decode_cursor, encode_cursor
+from utils.health_timeline import fetch_timeline, TYPE_FIELD as TIMELINE_TYPE_FIELD
+from utils.parallel_reads import run_timed, server_timing_header
+from utils.health_export import EXPORT_RENDERER_CLASSES, ndjson_export_response
+from utils.conditional_get import make_etag, not_modified, set_validators
+from utils.health_cache import cache_stats, cached_call, get_generations, invalidate_user_cache
+from utils.health_bulk import MAX_BULK_ROWS, bulk_insert_records
+from utils.report_jobs import MAX_PDF_BYTES, get_job, ingest_job_result, job_status, submit_job
+from utils.report_templates import parser_stats
+from utils.test_catalog import get_catalog, bump_catalog_version, find_raw_test
+from utils.cart_utils import add_test_to_cart, remove_test_from_cart, remove_test_from_all_carts, reprice_carts
+
+from bson import ObjectId
 from mongoengine.errors import DoesNotExist as RefDoesNotExist
 
 # from .models import BodyParameters, BloodTestValues
 from .serializers import BodyParametersSerializer, BloodTestValuesSerializer,CompleteUrineExaminationSerializer, ErythrocyteSedimentationRateSerializer, BloodUreaNitrogenTestSerializer,LipidProfileSerializer,LiverFunctionTestSerializer,MedicalHistorySerializer,DailyRoutineSerializer
+from .raw_serializers import raw_serialize, raw_serialize_many
+
+
+# Write-side hooks shared by the create/update/delete views of every health panel
+def _record_created(panel_type, record):
+    snapshot_record_created(panel_type, record)
+    invalidate_user_cache(panel_type, record.user_id)
+
+
+def _record_changed(panel_type, *user_ids):
+    for user_id in set(user_ids):
+        refresh_latest_snapshot(panel_type, user_id)
+    invalidate_user_cache(panel_type, *user_ids)
+
+
+# Body parameters scored with older rules are rescored when they are read
+def _with_current_scores(panel_type, documents):
+    if panel_type == 'body_parameters':
+        rescored = refresh_stale_scores(documents)
+        if rescored:
+            update_snapshot_scores(panel_type, rescored)
+    return documents
+
 
 # #################Body parameters############
 @api_view(['POST'])
@@ -26,7 +64,7 @@ def create_body_parameters(request):
         body_data = {
             'height': request.data.get('height'),
             'weight': request.data.get('weight'),
-            'BMI': request.data.get('bmi'),  # assuming key name in request
+            'bmi': request.data.get('bmi'),
             'body_fat': request.data.get('body_fat'),
             'muscle': request.data.get('muscle'),
             'viseral_fats': request.data.get('viseral_fats'),
@@ -49,8 +87,10 @@ def create_body_parameters(request):
         # Save only if calculation worked
         body_param = serializer.save(
             score=result['score'],
-            status=result['status']
+            status=result['status'],
+            components=result['components']
         )
+        _record_created('body_parameters', body_param)
 
         return Response({
             'message': 'Body parameters saved successfully.',
@@ -62,53 +102,35 @@ def create_body_parameters(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_user_body_summary(request, dietician_id):
-    summary_counts = dietician_clients_health_summary(dietician_id)
+    response_data = dietician_clients_health_summary(dietician_id)
 
-    user_ids = summary_counts.pop("_userIds", [])  # remove from final response
-
-    all_params = BodyParameters.objects.filter(user_id__in=user_ids).order_by('-created_at')
-
-    latest_per_user = {}
-    for param in all_params:
-        uid = str(param.user_id)
-        if uid not in latest_per_user:
-            latest_per_user[uid] = param
-
-    results = []
-    for uid, param in latest_per_user.items():
-        user_profile = fetch_user_profile_by_id(uid)
-        results.append({
-            "userId": uid,
-            "userProfile": user_profile,
-            "bmi": param.bmi,
-            "score": param.score,
-            "status": param.status,
-            "last_visit": param.created_at
-        })
-
-    response_data = {
-        **summary_counts,  # now contains only counts
-        "clients": results
-    }
+    if response_data.get("status") == "error":
+        return Response(response_data, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
     return Response(response_data, status=status.HTTP_200_OK)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_body_parameters(request):
-    body_params = BodyParameters.objects.all()
-    serializer = BodyParametersSerializer(body_params, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(BodyParameters, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(BodyParameters.objects.as_pymongo(), request)
+    _with_current_scores('body_parameters', page)
+    return paginator.get_paginated_response(raw_serialize_many(BodyParametersSerializer, page))
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_body_parameters_by_user(request, user_id):
     print("Called with user_id:", user_id)
-    body_params = BodyParameters.objects.filter(user_id=user_id)
-    print("Queryset count:", body_params.count())
-    serializer = BodyParametersSerializer(body_params, many=True)
-    return Response(serializer.data, status=200)
+    user_id = int(user_id)
+    data = cached_call(
+        'body_parameters_by_user', user_id, 'body_parameters', get_generations(user_id),
+        _records_of_user, 'body_parameters', user_id,
+    )
+    return Response(data, status=200)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -116,13 +138,13 @@ def get_body_parameters_by_user_latest_record(request, user_id):
     print("Called with user_id:", user_id)
 
     # Get the latest body parameter record for the user
-    latest_record = BodyParameters.objects.filter(user_id=user_id).order_by('-created_at').first()
+    latest_record = get_latest_record('body_parameters', int(user_id), as_pymongo=True)
 
     if not latest_record:
         return Response({"message": "No body parameter record found for this user."}, status=404)
 
-    serializer = BodyParametersSerializer(latest_record)
-    return Response(serializer.data, status=200)
+    _with_current_scores('body_parameters', [latest_record])
+    return Response(raw_serialize(BodyParametersSerializer, latest_record), status=200)
 
 
 @api_view(['PUT'])
@@ -130,6 +152,7 @@ def get_body_parameters_by_user_latest_record(request, user_id):
 def update_body_parameters(request, pk):
     try:
         body_param = BodyParameters.objects.get(pk=pk)
+        previous_user_id = body_param.user_id
     except BodyParameters.DoesNotExist:
         return Response({'error': 'Body Parameters not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -137,6 +160,7 @@ def update_body_parameters(request, pk):
     if serializer.is_valid():
         body_param.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('body_parameters', previous_user_id, body_param.user_id)
         return Response({
         'message': 'Body Parameters updated successfully.',
         'data': BodyParametersSerializer(body_param).data
@@ -150,6 +174,7 @@ def delete_body_parameters(request, pk):
     try:
         body_param = BodyParameters.objects.get(pk=pk)
         body_param.delete()
+        _record_changed('body_parameters', body_param.user_id)
         return Response({'message': 'Body Parameters deleted successfully.'}, status=status.HTTP_200_OK)
     except BodyParameters.DoesNotExist:
         return Response({'error': 'Body Parameters not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -166,7 +191,8 @@ def delete_body_parameters(request, pk):
 def create_blood_test_values(request):
     serializer = BloodTestValuesSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('blood_test', record)
         return Response({
             "message": "Blood Test values saved successfully.",
             "data": serializer.data
@@ -175,22 +201,27 @@ def create_blood_test_values(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_blood_test_values(request):
-    blood_tests= BloodTestValues.objects.all()
-    serializer= BloodTestValuesSerializer(blood_tests, many=True)
-    return Response(serializer.data,status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(BloodTestValues, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(BloodTestValues.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(BloodTestValuesSerializer, page))
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_blood_test_values(request,pk):
     try:
         blood_test= BloodTestValues.objects.get(pk=pk)
+        previous_user_id = blood_test.user_id
     except BloodTestValues.DoesNotExist:
         return Response({'error': 'Blood Test Values not found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = BloodTestValuesSerializer(blood_test, data=request.data, partial=True)
     if serializer.is_valid():
         blood_test.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('blood_test', previous_user_id, blood_test.user_id)
         return Response({'message': 'Blood Test Values updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -201,6 +232,7 @@ def delete_blood_test_values(request, pk):
     try:
         blood_test= BloodTestValues.objects.get(pk=pk)
         blood_test.delete()
+        _record_changed('blood_test', blood_test.user_id)
         return Response({'message': 'Blood test deleted successfully.'}, status=status.HTTP_200_OK)
     except BloodTestValues.DoesNotExist:
         return Response({'error': 'Blood test not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -228,29 +260,35 @@ def get_blood_by_user_latest_record(request, user_id):
 def create_complete_urine_examination(request):
     serializer = CompleteUrineExaminationSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('urine_examination', record)
         return Response({"message":"CUE saved successfully.",
          "data": serializer.data},status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_complete_urine_examinations(request):
-    cue= CompleteUrineExamination.objects.all()
-    serializer= CompleteUrineExaminationSerializer(cue, many=True)
-    return Response(serializer.data,status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(CompleteUrineExamination, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(CompleteUrineExamination.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(CompleteUrineExaminationSerializer, page))
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_complete_urine_examination(request,pk):
     try:
         cue= CompleteUrineExamination.objects.get(pk=pk)
+        previous_user_id = cue.user_id
     except CompleteUrineExamination.DoesNotExist:
         return Response({'error': 'CUE not found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = CompleteUrineExaminationSerializer(cue, data=request.data, partial=True)
     if serializer.is_valid():
         cue.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('urine_examination', previous_user_id, cue.user_id)
         return Response({'message': 'CUE updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -260,6 +298,7 @@ def delete_complete_urine_examination(request, pk):
     try:
         cue= CompleteUrineExamination.objects.get(pk=pk)
         cue.delete()
+        _record_changed('urine_examination', cue.user_id)
         return Response({'message': 'CUE deleted successfully.'}, status=status.HTTP_200_OK)
     except CompleteUrineExamination.DoesNotExist:
         return Response({'error': 'CUE not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -272,29 +311,35 @@ def delete_complete_urine_examination(request, pk):
 def create_Erythrocyte_sedimentation_rate(request):
     serializer = ErythrocyteSedimentationRateSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('esr', record)
         return Response({"message":"ESR saved successfully.",
          "data": serializer.data},status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_Erythrocyte_sedimentation_rates(request):
-    esr= ErythrocyteSedimentationRate.objects.all()
-    serializer= ErythrocyteSedimentationRateSerializer(esr, many=True)
-    return Response(serializer.data,status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(ErythrocyteSedimentationRate, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(ErythrocyteSedimentationRate.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(ErythrocyteSedimentationRateSerializer, page))
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_Erythrocyte_sedimentation_rate(request,pk):
     try:
         esr= ErythrocyteSedimentationRate.objects.get(pk=pk)
+        previous_user_id = esr.user_id
     except ErythrocyteSedimentationRate.DoesNotExist:
         return Response({'error': 'ESR not found'}, status=status.HTTP_404_NOT_FOUND)
     serializer = ErythrocyteSedimentationRateSerializer(esr, data=request.data, partial=True)
     if serializer.is_valid():
         esr.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('esr', previous_user_id, esr.user_id)
         return Response({'message': 'ESr updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -304,6 +349,7 @@ def delete_Erythrocyte_sedimentation_rate(request, pk):
     try:
         esr= ErythrocyteSedimentationRate.objects.get(pk=pk)
         esr.delete()
+        _record_changed('esr', esr.user_id)
         return Response({'message': 'ESR deleted successfully.'}, status=status.HTTP_200_OK)
     except ErythrocyteSedimentationRate.DoesNotExist:
         return Response({'error': 'ESR not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -315,23 +361,28 @@ def delete_Erythrocyte_sedimentation_rate(request, pk):
 def create_blood_urea_nitrogen_test(request):
     serializer = BloodUreaNitrogenTestSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('bun_test', record)
         return Response({"message": "Blood Urea Nitrogen Test saved successfully.",
          "data": serializer.data}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_blood_urea_nitrogen_tests(request):
-    tests = BloodUreaNitrogenTest.objects.all()
-    serializer = BloodUreaNitrogenTestSerializer(tests, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(BloodUreaNitrogenTest, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(BloodUreaNitrogenTest.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(BloodUreaNitrogenTestSerializer, page))
 
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_blood_urea_nitrogen_test(request, pk):
     try:
         test = BloodUreaNitrogenTest.objects.get(pk=pk)
+        previous_user_id = test.user_id
     except BloodUreaNitrogenTest.DoesNotExist:
         return Response({'error': 'Blood Urea Nitrogen Test not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -339,6 +390,7 @@ def update_blood_urea_nitrogen_test(request, pk):
     if serializer.is_valid():
         test.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('bun_test', previous_user_id, test.user_id)
         return Response({'message': 'Blood Urea Nitrogen Test updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -348,6 +400,7 @@ def delete_blood_urea_nitrogen_test(request, pk):
     try:
         test = BloodUreaNitrogenTest.objects.get(pk=pk)
         test.delete()
+        _record_changed('bun_test', test.user_id)
         return Response({'message': 'Blood Urea Nitrogen Test deleted successfully.'}, status=status.HTTP_200_OK)
     except BloodUreaNitrogenTest.DoesNotExist:
         return Response({'error': 'Blood Urea Nitrogen Test not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -360,7 +413,8 @@ def delete_blood_urea_nitrogen_test(request, pk):
 def create_lipid_profile(request):
     serializer = LipidProfileSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('lipid_profile', record)
         return Response({'message': 'Lipid Profile saved successfully.',
          "data": serializer.data}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -368,10 +422,13 @@ def create_lipid_profile(request):
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_lipid_profiles(request):
-    data = LipidProfile.objects.all()
-    serializer = LipidProfileSerializer(data, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(LipidProfile, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(LipidProfile.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(LipidProfileSerializer, page))
 
 
 @api_view(['PUT'])
@@ -379,6 +436,7 @@ def list_lipid_profiles(request):
 def update_lipid_profile(request, pk):
     try:
         obj = LipidProfile.objects.get(pk=pk)
+        previous_user_id = obj.user_id
     except LipidProfile.DoesNotExist:
         return Response({'error': 'Lipid Profile not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -386,6 +444,7 @@ def update_lipid_profile(request, pk):
     if serializer.is_valid():
         obj.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('lipid_profile', previous_user_id, obj.user_id)
         return Response({'message': 'Lipid Profile updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -396,6 +455,7 @@ def delete_lipid_profile(request, pk):
     try:
         obj= LipidProfile.objects.get(pk=pk)
         obj.delete()
+        _record_changed('lipid_profile', obj.user_id)
         return Response({'message': 'Lipid Profile deleted successfully.'}, status=status.HTTP_200_OK)
     except LipidProfile.DoesNotExist:
         return Response({'error': 'Lipid Profile not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -407,17 +467,21 @@ def delete_lipid_profile(request, pk):
 def create_liver_function_test(request):
     serializer = LiverFunctionTestSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('liver_function', record)
         return Response({'message': 'Liver Function Test saved successfully.',"data": serializer.data}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_liver_function_tests(request):
-    data = LiverFunctionTest.objects.all()
-    serializer = LiverFunctionTestSerializer(data, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(LiverFunctionTest, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(LiverFunctionTest.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(LiverFunctionTestSerializer, page))
 
 
 @api_view(['PUT'])
@@ -425,6 +489,7 @@ def list_liver_function_tests(request):
 def update_liver_function_test(request, pk):
     try:
         obj = LiverFunctionTest.objects.get(pk=pk)
+        previous_user_id = obj.user_id
     except LiverFunctionTest.DoesNotExist:
         return Response({'error': 'Liver Function Test not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -432,6 +497,7 @@ def update_liver_function_test(request, pk):
     if serializer.is_valid():
         obj.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('liver_function', previous_user_id, obj.user_id)
         return Response({'message': 'Liver Function Test updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -443,6 +509,7 @@ def delete_liver_function_test(request, pk):
     try:
         obj= LiverFunctionTest.objects.get(pk=pk)
         obj.delete()
+        _record_changed('liver_function', obj.user_id)
         return Response({'message': 'Liver Function Test deleted successfully.'}, status=status.HTTP_200_OK)
     except LiverFunctionTest.DoesNotExist:
         return Response({'error': 'Liver Function Test not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -454,17 +521,21 @@ def delete_liver_function_test(request, pk):
 def create_medical_history(request):
     serializer = MedicalHistorySerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('medical_history', record)
         return Response({'message': 'Medical History saved successfully.',"data": serializer.data}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_medical_histories(request):
-    data = MedicalHistory.objects.all()
-    serializer = MedicalHistorySerializer(data, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(MedicalHistory, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(MedicalHistory.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(MedicalHistorySerializer, page))
 
 
 @api_view(['PUT'])
@@ -472,6 +543,7 @@ def list_medical_histories(request):
 def update_medical_history(request, pk):
     try:
         obj = MedicalHistory.objects.get(pk=pk)
+        previous_user_id = obj.user_id
     except MedicalHistory.DoesNotExist:
         return Response({'error': 'Medical History not found'}, status=status.HTTP_404_NOT_FOUND)
 
@@ -479,6 +551,7 @@ def update_medical_history(request, pk):
     if serializer.is_valid():
         obj.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('medical_history', previous_user_id, obj.user_id)
         return Response({'message': 'Medical History updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -489,6 +562,7 @@ def delete_medical_history(request, pk):
     try:
         obj= MedicalHistory.objects.get(pk=pk)
         obj.delete()
+        _record_changed('medical_history', obj.user_id)
         return Response({'message': 'Medical History deleted successfully.'}, status=status.HTTP_200_OK)
     except MedicalHistory.DoesNotExist:
         return Response({'error': 'Medical History Test not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -502,17 +576,21 @@ def delete_medical_history(request, pk):
 def create_daily_routine(request):
     serializer = DailyRoutineSerializer(data=request.data)
     if serializer.is_valid():
-        serializer.save()
+        record = serializer.save()
+        _record_created('daily_routine', record)
         return Response({"message": "Daily routine saved successfully.","data": serializer.data}, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes(EXPORT_RENDERER_CLASSES)
 def list_daily_routines(request):
-    routines = DailyRoutine.objects.all()
-    serializer = DailyRoutineSerializer(routines, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    if request.accepted_renderer.format == 'ndjson':
+        return ndjson_export_response(DailyRoutine, request)
+    paginator = HealthCursorPagination()
+    page = paginator.paginate_queryset(DailyRoutine.objects.as_pymongo(), request)
+    return paginator.get_paginated_response(raw_serialize_many(DailyRoutineSerializer, page))
 
 
 @api_view(['PUT'])
@@ -520,6 +598,7 @@ def list_daily_routines(request):
 def update_daily_routine(request, pk):
     try:
         obj = DailyRoutine.objects.get(pk=pk)
+        previous_user_id = obj.user_id
     except DailyRoutine.DoesNotExist:
         return Response({'error': 'Daily routine not found'}, status=status.HTTP_404_NOT_FOUND)
     
@@ -528,6 +607,7 @@ def update_daily_routine(request, pk):
     if serializer.is_valid():
         obj.updated_at = datetime.utcnow()
         serializer.save()
+        _record_changed('daily_routine', previous_user_id, obj.user_id)
         return Response({'message': 'Daily routine updated successfully.'}, status=status.HTTP_200_OK)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -539,6 +619,7 @@ def delete_daily_routine(request, pk):
     try:
         obj= DailyRoutine.objects.get(pk=pk)
         obj.delete()
+        _record_changed('daily_routine', obj.user_id)
         return Response({'message': 'Daily routine deleted successfully.'}, status=status.HTTP_200_OK)
     except DailyRoutine.DoesNotExist:
         return Response({'error': 'Daily routine Test not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -559,6 +640,31 @@ MODEL_SERIALIZER_MAPPING = {
 }
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_create_health_records(request, panel_type):
+    """
+    Creates a list of records of one panel type (routed as <panel>/bulk/).
+    Rows are validated and inserted independently: the response reports each
+    row as created or with its errors, with 207 when only some were created.
+    """
+    rows = request.data
+    if not isinstance(rows, list) or not rows:
+        return Response({'error': 'Expected a non-empty list of records.'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(rows) > MAX_BULK_ROWS:
+        return Response({'error': f'At most {MAX_BULK_ROWS} records per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    results = bulk_insert_records(panel_type, rows)
+    created = sum(1 for result in results if result['status'] == 'created')
+    if created == len(results):
+        response_status = status.HTTP_201_CREATED
+    elif created:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    return Response({'created': created, 'failed': len(results) - created, 'results': results}, status=response_status)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_health_data_by_user(request, user_id):
@@ -571,12 +677,13 @@ def get_health_data_by_user(request, user_id):
     if not model_info:
         return Response({'success': False, 'message': f'Invalid type: {model_type}'}, status=status.HTTP_400_BAD_REQUEST)
 
-    model_class, serializer_class = model_info
-
     try:
-        records = model_class.objects.filter(user_id=int(user_id)).order_by('-created_at')
-        serializer = serializer_class(records, many=True)
-        return Response({'success': True, 'data': serializer.data}, status=status.HTTP_200_OK)
+        user_id = int(user_id)
+        data = cached_call(
+            'health_data_by_user', user_id, model_type, get_generations(user_id),
+            _records_of_user, model_type, user_id, '-created_at',
+        )
+        return Response({'success': True, 'data': data}, status=status.HTTP_200_OK)
     except Exception as e:
         return Response({'success': False, 'message': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     
@@ -584,6 +691,43 @@ def get_health_data_by_user(request, user_id):
 
 
 
+def _records_of_user(model_type, user_id, order_by=None):
+    model_class, serializer_class = MODEL_SERIALIZER_MAPPING[model_type]
+    records = model_class.objects.filter(user_id=user_id)
+    if order_by:
+        records = records.order_by(order_by)
+    return raw_serialize_many(serializer_class, _with_current_scores(model_type, list(records.as_pymongo())))
+
+
+def _records_of_day(model_type, user_id, start_of_day, end_of_day):
+    model_class, serializer_class = MODEL_SERIALIZER_MAPPING[model_type]
+    records = model_class.objects.filter(
+        user_id=user_id, created_at__gte=start_of_day, created_at__lt=end_of_day
+    ).order_by('created_at').as_pymongo()
+    return raw_serialize_many(serializer_class, _with_current_scores(model_type, list(records)))
+
+
+def _latest_record_data(model_type, user_id):
+    latest_record = get_latest_record(model_type, user_id, as_pymongo=True)
+    if not latest_record:
+        return None
+    _with_current_scores(model_type, [latest_record])
+    return raw_serialize(MODEL_SERIALIZER_MAPPING[model_type][1], latest_record)
+
+
+def _latest_data_etag(request, user_id, model_types):
+    # The snapshot entry of each type changes whenever its latest record is
+    # created, updated, deleted or rescored, so it validates the response
+    # without reading the panel collections. No Last-Modified: a delete makes
+    # an older record the latest, so the entries' updated_at can go back.
+    entries = get_user_snapshot(user_id, model_types)
+    parts = [RULES_VERSION, request.GET.get('type'), request.accepted_renderer.format]
+    for value in model_types:
+        entry = entries.get(value) or {}
+        parts.append((value, entry.get('record_id'), entry.get('updated_at'), entry.get('score'), entry.get('status')))
+    return make_etag(*parts)
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_latest_health_data_by_user(request, user_id):
@@ -596,18 +740,21 @@ def get_latest_health_data_by_user(request, user_id):
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    model_info = MODEL_SERIALIZER_MAPPING.get(model_type)
-    if not model_info:
+    # type=a,b,... or type=all returns {type: data} for every requested type
+    batch = model_type == 'all' or ',' in model_type
+    if model_type == 'all':
+        model_types = list(MODEL_SERIALIZER_MAPPING)
+    else:
+        model_types = list(dict.fromkeys(value for value in model_type.split(',') if value))
+
+    invalid = [value for value in model_types if value not in MODEL_SERIALIZER_MAPPING]
+    if invalid or not model_types:
         return Response(
-            {'success': False, 'message': f'Invalid type: {model_type}'},
+            {'success': False, 'message': f'Invalid type: {", ".join(invalid) or model_type}'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
-    model_class, serializer_class = model_info
-
     try:
-        queryset = model_class.objects.filter(user_id=int(user_id))
-
         # ✅ If last_updated param is provided → filter by DATE only
         if last_updated:
             filter_date = parse_date(last_updated)
@@ -620,29 +767,189 @@ def get_latest_health_data_by_user(request, user_id):
             # Start & end of the given day
             start_of_day = datetime.combine(filter_date, datetime.min.time())
             end_of_day = start_of_day + timedelta(days=1)
-
-            # MongoEngine range query
-            records = queryset.filter(created_at__gte=start_of_day, created_at__lt=end_of_day).order_by('created_at')
-
-            if not records:
+            generations = get_generations(int(user_id))
+            tasks = {
+                value: (cached_call, 'records_of_day', int(user_id), value, generations,
+                        _records_of_day, value, int(user_id), start_of_day, end_of_day)
+                for value in model_types
+            }
+        else:
+            # ✅ Default logic: latest single record, served from the latest_health_snapshot
+            etag = _latest_data_etag(request, int(user_id), model_types)
+            response = not_modified(request, etag, private=True)
+            if response is not None:
+                return response
+            generations = get_generations(int(user_id))
+            tasks = {
+                value: (cached_call, 'latest_record', int(user_id), value, generations,
+                        _latest_record_data, value, int(user_id))
+                for value in model_types
+            }
+
+        # One query per collection, run concurrently on the shared read pool
+        results, timings = run_timed(tasks)
+
+        if batch:
+            response = Response({'success': True, 'data': results}, status=status.HTTP_200_OK)
+        else:
+            data = results[model_types[0]]
+            if last_updated and not data:
                 return Response(
                     {'success': False, 'message': 'No records found'},
                     status=status.HTTP_404_NOT_FOUND
                 )
+            response = Response({'success': True, 'data': data}, status=status.HTTP_200_OK)
 
-            serializer = serializer_class(records, many=True)
-            return Response({'success': True, 'data': serializer.data}, status=status.HTTP_200_OK)
-
-        # ✅ Default logic (unchanged): latest single record
-        latest_record = queryset.order_by('-created_at').first()
-        if not latest_record:
-            return Response({'success': True, 'data': None}, status=status.HTTP_200_OK)
-
-        serializer = serializer_class(latest_record)
-        return Response({'success': True, 'data': serializer.data}, status=status.HTTP_200_OK)
+        response['Server-Timing'] = server_timing_header(timings)
+        if not last_updated:
+            set_validators(response, etag, private=True)
+        return response
 
     except Exception as e:
         return Response({'success': False, 'message': str(e)}, status=400 )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def health_cache_stats(request):
+    """
+    Hit/miss counters of the per-user health read cache and, under
+    score_cache, of the health score cache, for the process serving the request.
+    """
+    return Response(dict(cache_stats(), score_cache=score_cache_info()))
+
+
+REPORT_MAX_UPLOAD_BYTES = min(int(os.getenv('REPORT_MAX_UPLOAD_BYTES', str(MAX_PDF_BYTES))), MAX_PDF_BYTES)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def submit_report_analysis(request):
+    """
+    Queues the analysis of an uploaded PDF report (multipart field "file")
+    and answers 202 with the job id; poll report_analysis_status for the result.
+    A dietician or staff member uploading a client's report passes the
+    client's "user_id"; the records are then written for that user.
+    """
+    try:
+        user_id = int(request.data.get('user_id') or request.user.id)
+    except (TypeError, ValueError):
+        return Response({'error': 'Invalid user_id provided. Must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
+    if user_id != request.user.id and not request.user.is_staff and not (
+        request.user.is_dietician() and is_client_of(request.user.id, user_id)
+    ):
+        return Response({'error': 'You may only upload your own reports or those of your clients.'},
+                        status=status.HTTP_403_FORBIDDEN)
+
+    upload = request.FILES.get('file')
+    if upload is None:
+        return Response({'error': 'A PDF file is required in the "file" field.'}, status=status.HTTP_400_BAD_REQUEST)
+    if upload.size > REPORT_MAX_UPLOAD_BYTES:
+        return Response({'error': f'The file exceeds {REPORT_MAX_UPLOAD_BYTES} bytes.'}, status=status.HTTP_400_BAD_REQUEST)
+    pdf_bytes = upload.read()
+    if not pdf_bytes.startswith(b'%PDF'):
+        return Response({'error': 'The file is not a PDF.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    job_id = submit_job(pdf_bytes, upload.name, user_id=user_id, submitted_by=request.user.id)
+    return Response(
+        {'job_id': str(job_id), 'status': 'queued', 'status_url': request.build_absolute_uri(f'{job_id}/')},
+        status=status.HTTP_202_ACCEPTED,
+    )
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def report_parser_stats(request):
+    """How many analyzed reports were parsed by a layout template instead of the LLM."""
+    return Response(parser_stats())
+
+
+def _can_see_job(user, job):
+    return user.is_staff or user.id in (job.get('user_id'), job.get('submitted_by'))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def report_analysis_status(request, job_id):
+    """Status of a report analysis job, with its result once it succeeded."""
+    job = get_job(ObjectId(job_id)) if ObjectId.is_valid(job_id) else None
+    if job is None or not _can_see_job(request.user, job):
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(job_status(job))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def report_analysis_records(request, job_id):
+    """
+    Writes the health panels (blood test, lipid profile, liver function,
+    hemogram...) mapped from the result of a succeeded report analysis job.
+    The records belong to the job's user (see submit_report_analysis).
+    Optional body: {"dietician_id": 12, "dry_run": true}; a dietician's own
+    uploads default dietician_id to theirs. A dry run only returns the mapping. The response lists the mapped and unmapped
+    investigations with the ids of the created records; when only some panels
+    could be written it is a 207, and posting again retries the others.
+    """
+    job = get_job(ObjectId(job_id)) if ObjectId.is_valid(job_id) else None
+    if job is None or not _can_see_job(request.user, job):
+        return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+    if job['status'] != 'succeeded':
+        return Response({'error': f'The analysis is {job["status"]}.'}, status=status.HTTP_409_CONFLICT)
+
+    dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true')
+    dietician_id = request.data.get('dietician_id')
+    if dietician_id is None and request.user.is_dietician() and job.get('user_id') != request.user.id:
+        dietician_id = request.user.id
+    outcome = ingest_job_result(job, dietician_id, dry_run=dry_run)
+    if outcome is None:
+        return Response({'error': 'The records of this report were already created, or are being created.',
+                         'records': job.get('records')}, status=status.HTTP_409_CONFLICT)
+    if outcome['errors']:
+        response_status = status.HTTP_207_MULTI_STATUS if outcome['created'] else status.HTTP_400_BAD_REQUEST
+    elif not outcome['panels']:
+        response_status = status.HTTP_400_BAD_REQUEST
+    else:
+        response_status = status.HTTP_200_OK if dry_run else status.HTTP_201_CREATED
+    return Response(outcome, status=response_status)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_health_timeline(request, user_id):
+    """
+    All health records of a user across the panel collections, newest first,
+    in one $unionWith aggregation. Optional ?type=a,b restricts the panels;
+    paginated with ?cursor= and ?page_size= like the list endpoints.
+    """
+    model_types = list(dict.fromkeys(value for value in request.GET.get('type', '').split(',') if value))
+    invalid = [model_type for model_type in model_types if model_type not in MODEL_SERIALIZER_MAPPING]
+    if invalid:
+        return Response({'success': False, 'message': f'Invalid type: {", ".join(invalid)}'}, status=status.HTTP_400_BAD_REQUEST)
+
+    paginator = HealthCursorPagination()
+    page_size = paginator.get_page_size(request)
+    cursor = request.GET.get(paginator.cursor_query_param)
+    after = decode_cursor(cursor) if cursor else None
+
+    # Fetch one extra document to know whether there is a next page
+    documents = fetch_timeline(user_id, model_types or list(MODEL_SERIALIZER_MAPPING), after, page_size + 1)
+
+    next_cursor = None
+    if len(documents) > page_size:
+        documents = documents[:page_size]
+        next_cursor = encode_cursor(documents[-1].get('created_at'), documents[-1]['_id'])
+
+    _with_current_scores('body_parameters', [
+        document for document in documents if document[TIMELINE_TYPE_FIELD] == 'body_parameters'
+    ])
+
+    results = []
+    for document in documents:
+        model_type = document.pop(TIMELINE_TYPE_FIELD)
+        serializer_class = MODEL_SERIALIZER_MAPPING[model_type][1]
+        results.append({'type': model_type, 'data': raw_serialize(serializer_class, document)})
+
+    return Response({'next_cursor': next_cursor, 'results': results}, status=status.HTTP_200_OK)
 ##################test#######################
 from .serializers import TestSerializer
 @api_view(['POST'])
@@ -652,28 +959,47 @@ def test_create(request):
     serializer = TestSerializer(data=request.data)
     if serializer.is_valid():
         serializer.save()
+        bump_catalog_version()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 @api_view(['GET']) 
 def test_list(request):
-    category = request.data.get('category')
-    tests=Test.objects.filter(category=category) if category else Test.objects.all()
-    serializer = TestSerializer(tests, many=True)
-    return Response(serializer.data)
+    # Served from the in-process catalog; the category filter used to be read from the body only
+    category = request.query_params.get('category') or request.data.get('category')
+    catalog = get_catalog()
+    etag = make_etag('tests', catalog.version, category, request.accepted_renderer.format)
+    response = not_modified(request, etag, catalog.updated_at)
+    if response is not None:
+        return response
+    if request.accepted_renderer.format == 'json':
+        response = HttpResponse(catalog.list_json_for(category), content_type='application/json')
+    else:
+        response = Response(catalog.list_tests(category))
+    return set_validators(response, etag, catalog.updated_at)
+
+
+@api_view(['GET'])
+def test_search(request):
+    """Ranked search over test names, parameters covered and FAQs: ?q=...&page=&page_size="""
+    query = request.query_params.get('q', '')
+    paginator = TestSearchPagination()
+    page = paginator.paginate_queryset(get_catalog().search(query), request)
+    return paginator.get_paginated_response(page)
 
 
 @api_view(['GET'])
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 def test_detail(request, pk):
-    try:
-        test = Test.objects.get(id=pk)
-    except Test.DoesNotExist:
-        return Response(status=status.HTTP_404_NOT_FOUND)
+    test = get_catalog().get_test(pk)
+    if test is None:
+        raw_test = find_raw_test(pk)
+        if raw_test is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        test = raw_serialize(TestSerializer, raw_test)
 
-    serializer = TestSerializer(test)
-    return Response(serializer.data)
+    return Response(test)
 
 
 
@@ -687,9 +1013,14 @@ def test_update(request, pk):
     except Test.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
 
+    snapshot = (test.price, test.testName, test.parametersCovered_count)
     serializer = TestSerializer(test, data=request.data, partial=True)
     if serializer.is_valid():
         serializer.save()
+        bump_catalog_version()
+        # Carts store a snapshot of the test; refresh it when it changed
+        if (test.price, test.testName, test.parametersCovered_count) != snapshot:
+            reprice_carts([test.id])
         return Response(serializer.data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -702,6 +1033,9 @@ def test_delete(request, pk):
     except Test.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
     test.delete()
+    bump_catalog_version()
+    # Carts keep a reference to the test; drop it instead of leaving a broken reference
+    remove_test_from_all_carts(test.id)
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -714,6 +1048,7 @@ def category_create(request):
     serializer = CategorySerializer(data=request.data)
     if serializer.is_valid():
         serializer.save()
+        bump_catalog_version()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -721,9 +1056,16 @@ def category_create(request):
 @authentication_classes([JWTAuthentication])
 @permission_classes([IsAuthenticated])
 def category_list(request):
-    categories = Category.objects.all()
-    serializer = CategorySerializer(categories, many=True)
-    return Response(serializer.data)
+    catalog = get_catalog()
+    etag = make_etag('categories', catalog.version, request.accepted_renderer.format)
+    response = not_modified(request, etag, catalog.updated_at)
+    if response is not None:
+        return response
+    if request.accepted_renderer.format == 'json':
+        response = HttpResponse(catalog.category_list_json, content_type='application/json')
+    else:
+        response = Response(catalog.categories)
+    return set_validators(response, etag, catalog.updated_at)
 
 @api_view(['PUT'])
 @authentication_classes([JWTAuthentication])
@@ -737,6 +1079,7 @@ def category_update(request, pk):
     serializer = CategorySerializer(category, data=request.data, partial=True)
     if serializer.is_valid():
         serializer.save()
+        bump_catalog_version()
         return Response(serializer.data)
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -749,6 +1092,7 @@ def category_delete(request, pk):
     except Category.DoesNotExist:
         return Response(status=status.HTTP_404_NOT_FOUND)
     category.delete()
+    bump_catalog_version()
     return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -787,67 +1131,26 @@ def add_item_to_cart(request):
     #if not isinstance(quantity, int) or quantity <= 0:
         #return Response({"detail": "Quantity must be a positive integer."}, status=status.HTTP_400_BAD_REQUEST)
 
-    # Fetch test
+    # Fetch test from the in-process catalog
     try:
-        test_obj = Test.objects.get(id=test_id)
-    except Test.DoesNotExist:
-        return Response({"detail": "Test not found."}, status=status.HTTP_404_NOT_FOUND)
+        test_obj = find_raw_test(test_id)
     except Exception as e:
         return Response({"detail": f"Error retrieving test: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if test_obj is None:
+        return Response({"detail": "Test not found."}, status=status.HTTP_404_NOT_FOUND)
 
-    # Fetch or create cart
-    try:
-        cart = Cart.objects(user_id=user_id).first()
-        if not cart:
-            cart = Cart(user_id=user_id, items=[])
-    except Exception as e:
-        return Response({"detail": f"Error retrieving or creating cart: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    # Remove any broken references in cart before processing
-    valid_items = []
-    for item in cart.items:
-        try:
-            _ = item.test.id  # Triggers dereference
-            valid_items.append(item)
-        except RefDoesNotExist:
-            continue
-    cart.items = valid_items
-
-    # Check if item already in cart
-    cart_item_found = None
-    for item in cart.items:
-        try:
-            if str(item.test.id) == str(test_id):  # Safely compare ObjectId and str
-                cart_item_found = item
-                break
-        except RefDoesNotExist:
-            continue
-        except Exception as e:
-            return Response({"detail": f"Error reading cart item test reference: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    if cart_item_found:
-        return Response({"detail": "Test already exists in cart."}, status=status.HTTP_400_BAD_REQUEST)
-    else:
-        try:
-            new_cart_item = CartItem(
-                test=test_obj,
-                testName=test_obj.testName,
-                parameterCount=test_obj.parametersCovered_count,
-                #quantity=quantity,
-                price=test_obj.price,
-            )
-        except AttributeError:
-            return Response({"detail": "Missing required fields in test object."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        cart.items.append(new_cart_item)
-
-    # Save cart and return response
+    # One conditional update: pushes the item and increments the totals unless the test is already in the cart
     try:
-        cart.save()  # Will trigger `clean()` safely now
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        cart, added = add_test_to_cart(user_id, test_obj)
+    except (KeyError, TypeError):
+        return Response({"detail": "Missing required fields in test object."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
     except Exception as e:
         return Response({"detail": f"Error saving cart: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if not added:
+        return Response({"detail": "Test already exists in cart."}, status=status.HTTP_400_BAD_REQUEST)
+
+    return Response(raw_serialize(CartSerializer, cart), status=status.HTTP_201_CREATED)
 ##### cart update view ##S######
 @api_view(['PUT'])
 @authentication_classes([JWTAuthentication])
@@ -914,52 +1217,29 @@ def add_to_cart_delete(request,pk):
 @permission_classes([IsAuthenticated]) # Authentication restored
 def remove_item_from_cart(request):
     """
-    Removes a specified Test from the authenticated user's cart, or decreases its quantity.
-    Expected request.data: {"test_id": "test_mongo_object_id", "quantity": 1 (optional)}
-    If quantity is not provided, removes entire item.
+    Removes a specified Test from the authenticated user's cart.
+    Expected request.data: {"test_id": "test_mongo_object_id"}
     User ID is inferred from the authenticated user.
     """
     user_id = request.user.id # Get user ID from authenticated user
 
     test_id_to_remove = request.data.get('test_id')
-    quantity_to_remove = request.data.get('quantity') # Optional: if not provided, remove all
 
     if not test_id_to_remove:
         return Response({"detail": "test_id is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-    if quantity_to_remove is not None and (not isinstance(quantity_to_remove, int) or quantity_to_remove <= 0):
-        return Response({"detail": "Quantity to remove must be a positive integer or omitted."}, status=status.HTTP_400_BAD_REQUEST)
-
-    try:
-        # Get the user's cart
-        cart = Cart.objects.get(user_id=user_id)
-    except Cart.DoesNotExist:
-        return Response({"detail": "Cart not found for this user."}, status=status.HTTP_404_NOT_FOUND)
-    except Exception as e: # Catch potential errors if test_id is not a valid ObjectId for filtering
-        return Response({"detail": f"Error retrieving cart: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    # Find the cart item to remove/update
-    item_index_to_remove = -1
-    for i, item in enumerate(cart.items):
-        if str(item.test.id) == test_id_to_remove: # Convert ObjectId to string for comparison
-            item_index_to_remove = i
-            break
-
-    if item_index_to_remove == -1:
+    if not ObjectId.is_valid(test_id_to_remove):
         return Response({"detail": "Test not found in cart."}, status=status.HTTP_404_NOT_FOUND)
 
-    cart_item = cart.items[item_index_to_remove]
-
-    if quantity_to_remove is not None and quantity_to_remove > 0 and cart_item.quantity > quantity_to_remove:
-        # Decrease quantity
-        cart_item.quantity -= quantity_to_remove
-    else:
-        # Remove the entire item
-        cart.items.pop(item_index_to_remove)
-
     try:
-        cart.save() # This will trigger the clean() method to recalculate totals
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Pulls the item and recomputes the totals in one update
+        cart = remove_test_from_cart(user_id, ObjectId(test_id_to_remove))
     except Exception as e:
-        return Response({"detail": f"Error saving cart: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({"detail": f"Error saving cart: {e}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    if cart is None:
+        if not Cart.objects(user_id=user_id).count():
+            return Response({"detail": "Cart not found for this user."}, status=status.HTTP_404_NOT_FOUND)
+        return Response({"detail": "Test not found in cart."}, status=status.HTTP_404_NOT_FOUND)
+
+    return Response(raw_serialize(CartSerializer, cart), status=status.HTTP_200_OK)
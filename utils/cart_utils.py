@@ -0,0 +1,172 @@
+import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+
+from health.models import Cart, Test
+
+TOTAL_FIELDS = ('subTotal', 'total', 'netPayableAmount')
+
+# Attempts before giving up when concurrent requests keep changing the cart
+# between the conditional update and the fallback upsert
+MAX_ATTEMPTS = 3
+
+
+def _cart_collection():
+    return Cart._get_collection()
+
+
+def cart_item_from_test(test):
+    """The embedded CartItem document for a raw Test document, with the test's current name and price."""
+    return {
+        'test': test['_id'],
+        'testName': test.get('testName'),
+        'parameterCount': test.get('parametersCovered_count', 0),
+        'price': float(test['price']),
+    }
+
+
+def cart_items_for_tests(test_ids):
+    """
+    CartItem dicts of the tests, in order, priced from the Test documents with
+    one $in query. Returns (items, missing ids).
+    """
+    tests = {
+        test['_id']: test
+        for test in Test._get_collection().find(
+            {'_id': {'$in': list(test_ids)}}, {'testName': 1, 'price': 1, 'parametersCovered_count': 1}
+        )
+    }
+    items = [cart_item_from_test(tests[test_id]) for test_id in test_ids if test_id in tests]
+    return items, [test_id for test_id in test_ids if test_id not in tests]
+
+
+def add_test_to_cart(user_id, test):
+    """
+    Adds a test (raw Test document) to the user's cart in one conditional update, creating the cart
+    if needed. Returns (raw cart document, added) where added is False when the
+    test was already in the cart.
+    """
+    collection = _cart_collection()
+    item = cart_item_from_test(test)
+
+    for _ in range(MAX_ATTEMPTS):
+        # The items.test guard makes the push and the total increments a no-op
+        # when the test is already there, even under concurrent clicks
+        cart = collection.find_one_and_update(
+            {'user_id': user_id, 'items.test': {'$ne': item['test']}},
+            {'$push': {'items': item}, '$inc': {field: item['price'] for field in TOTAL_FIELDS}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if cart:
+            return cart, True
+
+        # Either there is no cart yet or the test is already in it
+        created = collection.update_one(
+            {'user_id': user_id},
+            {'$setOnInsert': dict(
+                {'items': [item], 'created_at': datetime.datetime.utcnow()},
+                **{field: item['price'] for field in TOTAL_FIELDS}
+            )},
+            upsert=True,
+        )
+        if created.upserted_id is not None:
+            return collection.find_one({'_id': created.upserted_id}), True
+
+        cart = collection.find_one({'user_id': user_id, 'items.test': item['test']})
+        if cart:
+            return cart, False
+        # The item was removed in between: try again
+
+    raise RuntimeError('Cart changed concurrently, please retry.')
+
+
+def _remove_test_pipeline(test_id):
+    # Drops the item and recomputes the totals from the remaining item prices, atomically
+    items = {'$filter': {'input': '$items', 'as': 'item', 'cond': {'$ne': ['$$item.test', test_id]}}}
+    return [
+        {'$set': {'items': items}},
+        {'$set': {field: {'$sum': '$items.price'} for field in TOTAL_FIELDS}},
+    ]
+
+
+def remove_test_from_cart(user_id, test_id):
+    """Removes a test from the user's cart in one update. Returns the raw cart document, or None if the test was not in it."""
+    return _cart_collection().find_one_and_update(
+        {'user_id': user_id, 'items.test': test_id},
+        _remove_test_pipeline(test_id),
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def remove_test_from_all_carts(test_id):
+    """Drops a deleted test from every cart that holds it. Returns the number of carts updated."""
+    return _cart_collection().update_many({'items.test': test_id}, _remove_test_pipeline(test_id)).modified_count
+
+
+def _stale_items_pipeline(test_ids=None):
+    # Cart items whose snapshot of the test (price, name, parameter count) no longer matches the test
+    pipeline = []
+    if test_ids is not None:
+        pipeline.append({'$match': {'items.test': {'$in': list(test_ids)}}})
+    pipeline.append({'$unwind': '$items'})
+    if test_ids is not None:
+        pipeline.append({'$match': {'items.test': {'$in': list(test_ids)}}})
+    pipeline += [
+        {'$lookup': {'from': Test._get_collection_name(), 'localField': 'items.test', 'foreignField': '_id', 'as': 'current'}},
+        {'$unwind': '$current'},
+        {'$match': {'$expr': {'$or': [
+            {'$ne': ['$items.price', '$current.price']},
+            {'$ne': ['$items.testName', '$current.testName']},
+            {'$ne': ['$items.parameterCount', '$current.parametersCovered_count']},
+        ]}}},
+        {'$group': {'_id': '$_id', 'items': {'$push': {
+            'test': '$items.test',
+            'old_price': '$items.price',
+            'price': '$current.price',
+            'testName': '$current.testName',
+            'parameterCount': '$current.parametersCovered_count',
+        }}}},
+    ]
+    return pipeline
+
+
+def _reprice_operation(cart_id, changes):
+    """
+    Rewrites the snapshot of each changed item through array filters and moves
+    the totals by the price delta. The filter requires every item to still hold
+    its old price, so a cart changed in the meantime is left for the next run.
+    """
+    query = {'_id': cart_id, '$and': [
+        {'items': {'$elemMatch': {'test': change['test'], 'price': change['old_price']}}} for change in changes
+    ]}
+    update = {'$set': {}}
+    array_filters = []
+    for index, change in enumerate(changes):
+        array_filters.append({f'i{index}.test': change['test']})
+        for field in ('price', 'testName', 'parameterCount'):
+            update['$set'][f'items.$[i{index}].{field}'] = change[field]
+
+    delta = sum((change['price'] or 0) - (change['old_price'] or 0) for change in changes)
+    if delta:
+        update['$inc'] = {field: delta for field in TOTAL_FIELDS}
+    return UpdateOne(query, update, array_filters=array_filters)
+
+
+def reprice_carts(test_ids=None, batch_size=1000):
+    """
+    Refreshes the test snapshot (price, name, parameter count) stored in cart
+    items from the tests collection, for the given tests or all of them, and
+    recomputes the cart totals. Returns the number of carts updated.
+    """
+    collection = _cart_collection()
+    operations, updated = [], 0
+
+    for cart in collection.aggregate(_stale_items_pipeline(test_ids), allowDiskUse=True):
+        operations.append(_reprice_operation(cart['_id'], cart['items']))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+    return updated
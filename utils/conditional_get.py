@@ -0,0 +1,75 @@
+"""
+Conditional GET (ETag / Last-Modified) for read endpoints.
+
+Each endpoint derives its validators from something much cheaper than the
+response itself (a version counter, the latest_health_snapshot entries, a
+digest of a few columns) and answers 304 Not Modified when the client's
+If-None-Match / If-Modified-Since still matches.
+"""
+import datetime
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    """A strong ETag (quoted) digesting the given values."""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        # Mongo and the snapshot store naive UTC datetimes
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp())
+
+
+def set_validators(response, etag, last_modified=None, private=False):
+    """
+    Adds the validators to a response. Clients must revalidate every time
+    (no-cache); private keeps shared caches from storing per-user data.
+    """
+    response['ETag'] = etag
+    timestamp = _timestamp(last_modified)
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
+    if private:
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified=None, private=False):
+    """Returns a 304 response carrying the validators if the client's copy is current, else None."""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    response = get_conditional_response(request, etag=etag, last_modified=_timestamp(last_modified))
+    if response is None:
+        return None
+    return set_validators(response, etag, last_modified, private)
+
+
+def queryset_etag(queryset, fields, *parts):
+    """ETag over the given columns of a (small) queryset, without building model instances."""
+    return make_etag(queryset.model._meta.label, *parts, *queryset.values_list(*fields))
+
+
+class ConditionalListMixin:
+    """
+    For list views over small reference tables: the ETag digests etag_fields
+    of the filtered queryset, so an unchanged table costs one values_list
+    query and no serialization.
+    """
+    etag_fields = ('pk',)
+
+    def list(self, request, *args, **kwargs):
+        etag = queryset_etag(self.filter_queryset(self.get_queryset()), self.etag_fields, request.accepted_renderer.format)
+        response = not_modified(request, etag)
+        if response is not None:
+            return response
+        return set_validators(super().list(request, *args, **kwargs), etag)
@@ -0,0 +1,124 @@
+"""
+Bulk ingestion of health panel records.
+
+Every row is validated by the panel's serializer and by the document itself,
+body parameters are scored with the batch engine, and the valid rows are
+written with one unordered insert_many. The snapshot and the read cache are
+then updated once for the whole batch.
+"""
+import os
+
+from mongoengine.errors import ValidationError as DocumentValidationError
+from pymongo.errors import BulkWriteError
+from rest_framework.exceptions import ValidationError
+
+from health.models import HEALTH_PANEL_MODELS
+from health.raw_serializers import raw_serialize
+from health.serializers import HEALTH_PANEL_SERIALIZERS
+from utils.health_cache import invalidate_user_cache
+from utils.health_score import score_records
+from utils.health_snapshot import snapshot_records_created
+
+MAX_BULK_ROWS = int(os.getenv('HEALTH_MAX_BULK_ROWS', '1000'))
+
+
+def build_document(serializer, row):
+    """
+    Validates one row like the create views do and returns (raw document, None),
+    or (None, errors) without writing anything. serializer is an unbound
+    instance of the panel serializer, reused across rows as DRF does for
+    many=True so that its fields are only built once.
+    """
+    try:
+        validated_data = serializer.run_validation(row)
+    except ValidationError as exc:
+        return None, exc.detail
+
+    # Builds the document and its embedded documents exactly as serializer.save() would, minus the save
+    serializer._saving_instances = False
+    document = serializer.recursive_save(validated_data)
+    try:
+        document.validate()
+    except DocumentValidationError as exc:
+        return None, exc.to_dict() or {'non_field_errors': [str(exc)]}
+    return document.to_mongo().to_dict(), None
+
+
+def _insert(collection, documents):
+    """Unordered insert; returns {position in documents: error message} for the rows Mongo refused."""
+    if not documents:
+        return {}
+    try:
+        collection.insert_many(documents, ordered=False)
+        return {}
+    except BulkWriteError as exc:
+        return {error['index']: error.get('errmsg', 'Insert failed.') for error in exc.details.get('writeErrors', [])}
+
+
+def validate_rows(panel_type, rows):
+    """
+    First phase, without database access: validates the rows and scores the
+    body parameters. Returns (results, valid) where results holds the error
+    result of each rejected row (None elsewhere) and valid lists the
+    (index, raw document) pairs to insert.
+    """
+    serializer = HEALTH_PANEL_SERIALIZERS[panel_type]()
+
+    results = [None] * len(rows)
+    valid = []
+    for index, row in enumerate(rows):
+        if not isinstance(row, dict):
+            results[index] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': ['Expected an object.']}}
+            continue
+        son, errors = build_document(serializer, row)
+        if errors:
+            results[index] = {'index': index, 'status': 'error', 'errors': errors}
+        else:
+            valid.append((index, son))
+
+    if panel_type == 'body_parameters' and valid:
+        scored = []
+        for (index, son), result in zip(valid, score_records([son for _, son in valid])):
+            if result is None:
+                results[index] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': ['Health score calculation failed.']}}
+            else:
+                son.update(result)
+                scored.append((index, son))
+        valid = scored
+
+    return results, valid
+
+
+def insert_rows(panel_type, results, valid, with_data=True):
+    """
+    Second phase: inserts the valid documents of validate_rows, then updates
+    the snapshot and the read cache. Completes and returns results.
+    """
+    model_class = HEALTH_PANEL_MODELS[panel_type]
+    serializer_class = HEALTH_PANEL_SERIALIZERS[panel_type]
+    failed = _insert(model_class._get_collection(), [son for _, son in valid])
+
+    inserted = []
+    for position, (index, son) in enumerate(valid):
+        if position in failed:
+            results[index] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': [failed[position]]}}
+        else:
+            inserted.append(son)
+            results[index] = {'index': index, 'status': 'created', 'id': str(son['_id'])}
+            if with_data:
+                results[index]['data'] = raw_serialize(serializer_class, son)
+
+    if inserted:
+        snapshot_records_created(panel_type, inserted)
+        invalidate_user_cache(panel_type, *(son.get('user_id') for son in inserted))
+    return results
+
+
+def bulk_insert_records(panel_type, rows, with_data=True):
+    """
+    Inserts many records of one panel type. Returns one result per row, in
+    order: {'index', 'status': 'created', 'id', 'data'} or
+    {'index', 'status': 'error', 'errors'}.
+    """
+    results, valid = validate_rows(panel_type, rows)
+    return insert_rows(panel_type, results, valid, with_data)
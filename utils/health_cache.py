@@ -0,0 +1,101 @@
+"""
+Per-user cache of the health read endpoints.
+
+Cached values are keyed by user, panel type and that pair's generation, a
+counter stored in Mongo and bumped by every write of the panel for the user.
+A write therefore invalidates the entries of every process at once; the old
+entries simply stop being read and expire. A read costs one primary key
+lookup of the generations plus a cache get.
+"""
+import hashlib
+import json
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from pymongo import UpdateOne
+
+from health.models import HealthCacheGeneration
+from utils.health_score import RULES_VERSION
+
+CACHE_ALIAS = 'health' if 'health' in settings.CACHES else 'default'
+
+_MISSING = object()
+_stats = {'hits': Counter(), 'misses': Counter()}
+_stats_lock = threading.Lock()
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def _generation_collection():
+    return HealthCacheGeneration._get_collection()
+
+
+def get_generations(user_id):
+    """Returns {panel_type: generation} for the user; panels never written are absent (generation 0)."""
+    doc = _generation_collection().find_one({'_id': user_id})
+    return (doc or {}).get('panels', {})
+
+
+def invalidate_user_cache(panel_type, *user_ids):
+    """Drops the cached reads of panel_type for the given users, in every process."""
+    operations = [
+        UpdateOne({'_id': user_id}, {'$inc': {f'panels.{panel_type}': 1}}, upsert=True)
+        for user_id in set(user_ids) if user_id is not None
+    ]
+    if operations:
+        _generation_collection().bulk_write(operations, ordered=False)
+
+
+def _record(name, outcome):
+    with _stats_lock:
+        _stats[outcome][name] += 1
+
+
+def _key_part(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def _args_digest(args):
+    """A digest of args, so that keys hold no spaces or control characters and stay short (memcached)."""
+    return hashlib.sha1(json.dumps(args, default=_key_part).encode()).hexdigest()
+
+
+def cached_call(name, user_id, panel_type, generations, function, *args):
+    """
+    function(*args), cached under the read name, the user, the panel type and
+    its generation (from get_generations) and args.
+    """
+    key = ':'.join(map(str, (
+        'health', name, RULES_VERSION, user_id, panel_type, generations.get(panel_type, 0), _args_digest(args)
+    )))
+    cache = _cache()
+    value = cache.get(key, _MISSING)
+    if value is not _MISSING:
+        _record(name, 'hits')
+        return value
+
+    _record(name, 'misses')
+    value = function(*args)
+    cache.set(key, value)
+    return value
+
+
+def cache_stats():
+    """Hits, misses and hit rate of each cached read in this process."""
+    with _stats_lock:
+        names = set(_stats['hits']) | set(_stats['misses'])
+        stats = {}
+        for name in sorted(names):
+            hits, misses = _stats['hits'][name], _stats['misses'][name]
+            stats[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits / (hits + misses), 4)}
+        return stats
+
+
+def reset_cache_stats():
+    with _stats_lock:
+        _stats['hits'].clear()
+        _stats['misses'].clear()
@@ -0,0 +1,90 @@
+import datetime
+import json
+import uuid
+
+from bson import DBRef, Decimal128, ObjectId
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+from utils.pagination import HealthCursorPagination
+
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
+
+def _json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime) and value.tzinfo is None:
+        # Mongo datetimes are naive UTC; mark them like the API responses do
+        return value.isoformat() + 'Z'
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, DBRef):
+        return str(value.id)
+    if isinstance(value, Decimal128):
+        return float(value.to_decimal())
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+# Compact encoder shared by every export: no indentation, no spaces
+_encoder = json.JSONEncoder(default=_json_default, separators=(',', ':'))
+
+
+def encode_document(son):
+    """Encodes one raw Mongo document as a JSON line, exposing _id as id like the API does."""
+    if '_id' in son:
+        son['id'] = son.pop('_id')
+    return _encoder.encode(son) + '\n'
+
+
+def iter_ndjson(collection, query=None, batch_size=1000):
+    """
+    Yields NDJSON lines for every document matching query, streaming from a
+    pymongo cursor so that at most one batch is held in memory.
+    """
+    cursor = collection.find(query or {}, batch_size=batch_size)
+    try:
+        for son in cursor:
+            yield encode_document(son)
+    finally:
+        cursor.close()
+
+
+def ndjson_export_response(model_class, request, batch_size=1000):
+    """
+    Streams a health collection as NDJSON, honouring the same user_id,
+    dietician_id and date range filters as the paginated list endpoints.
+    """
+    queryset = HealthCursorPagination().filter_queryset(model_class.objects, request)
+    response = StreamingHttpResponse(
+        iter_ndjson(model_class._get_collection(), queryset._query, batch_size=batch_size),
+        content_type=NDJSON_CONTENT_TYPE,
+    )
+    response['Content-Disposition'] = f'attachment; filename="{model_class._get_collection_name()}.ndjson"'
+    return response
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Selected with ?format=ndjson. List endpoints stream their collection
+    directly; any other response is rendered here one JSON line per item.
+    """
+    media_type = NDJSON_CONTENT_TYPE
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and isinstance(data.get('results'), list):
+            data = data['results']
+        if not isinstance(data, list):
+            data = [data]
+        return ''.join(_encoder.encode(item) + '\n' for item in data).encode(self.charset)
+
+
+# Renderers of the health list endpoints, which stream their collection with ?format=ndjson
+EXPORT_RENDERER_CLASSES = (*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer)
@@ -1,352 +1,411 @@
-# def calculate_health_score(body_params):
-#     # Initialize score components
-#     score_components = {
-#         'bmi': 0,
-#         'body_fat': 0,
-#         'muscle': 0,
-#         'visceral_fat': 0,
-#         'sleep': 0,
-#         'stress': 0,
-#         'body_age': 0,
-#         'hydration': 0
-#     }
-    
-#     try:
-#         height = body_params['height']
-#         if isinstance(height, str):
-#             height = float(height.replace('cm', '').strip())
-
-#         weight = body_params['weight']
-#         bmi = body_params['BMI']
-        
-#         # BMI Score (20% weight)
-#         if bmi < 18.5:
-#             score_components['bmi'] = 60 * 0.20
-#         elif 18.5 <= bmi < 25:
-#             score_components['bmi'] = 100 * 0.20
-#         elif 25 <= bmi < 30:
-#             score_components['bmi'] = 70 * 0.20
-#         else:
-#             score_components['bmi'] = 40 * 0.20
-        
-#         # Body Fat Score (20% weight)
-#         body_fat = body_params['body_fat']
-#         if body_fat < 10:
-#             score_components['body_fat'] = 80 * 0.20
-#         elif 10 <= body_fat < 15:
-#             score_components['body_fat'] = 100 * 0.20
-#         elif 15 <= body_fat < 20:
-#             score_components['body_fat'] = 90 * 0.20
-#         elif 20 <= body_fat < 25:
-#             score_components['body_fat'] = 80 * 0.20
-#         elif 25 <= body_fat < 30:
-#             score_components['body_fat'] = 60 * 0.20
-#         else:
-#             score_components['body_fat'] = 40 * 0.20
-        
-#         # Muscle Mass Score (15% weight)
-#         muscle = body_params['muscle']
-#         muscle_percent = (muscle / weight) * 100
-#         if muscle_percent > 40:
-#             score_components['muscle'] = 100 * 0.15
-#         elif 35 < muscle_percent <= 40:
-#             score_components['muscle'] = 85 * 0.15
-#         elif 30 < muscle_percent <= 35:
-#             score_components['muscle'] = 70 * 0.15
-#         elif 25 < muscle_percent <= 30:
-#             score_components['muscle'] = 60 * 0.15
-#         else:
-#             score_components['muscle'] = 40 * 0.15
-        
-#         # Visceral Fat Score (10% weight)
-#         visceral_fat = int(body_params['viseral_fats'])
-#         if visceral_fat <= 5:
-#             score_components['visceral_fat'] = 100 * 0.10
-#         elif 6 <= visceral_fat <= 9:
-#             score_components['visceral_fat'] = 70 * 0.10
-#         elif 10 <= visceral_fat <= 12:
-#             score_components['visceral_fat'] = 50 * 0.10
-#         else:
-#             score_components['visceral_fat'] = 30 * 0.10
-        
-#         # Sleep Score (15% weight)
-#         # if isinstance(body_params['sleep_time'], str):
-#         #     sleep_hours = float(body_params['sleep_time'].split(':')[0])
-#         # else:
-#         sleep_hours = float(body_params['sleep_time'])
-        
-#         sleep_quality = body_params['sleep_quality'].upper()
-        
-#         if sleep_hours >= 7.5:
-#             sleep_duration_score = 100
-#         elif 7 <= sleep_hours < 7.5:
-#             sleep_duration_score = 90
-#         elif 6 <= sleep_hours < 7:
-#             sleep_duration_score = 70
-#         elif 5 <= sleep_hours < 6:
-#             sleep_duration_score = 50
-#         else:
-#             sleep_duration_score = 30
-        
-#         if sleep_quality == 'A':
-#             sleep_quality_score = 100
-#         elif sleep_quality == 'B':
-#             sleep_quality_score = 80
-#         elif sleep_quality == 'C':
-#             sleep_quality_score = 60
-#         else:  # 'D'
-#             sleep_quality_score = 40
-        
-#         score_components['sleep'] = ((sleep_duration_score * 0.5) + (sleep_quality_score * 0.5)) * 0.15
-        
-#         # Stress Level Score (10% weight)
-#         stress = body_params['stress_level']
-#         if stress <= 3:
-#             score_components['stress'] = 100 * 0.10
-#         elif 3 < stress <= 5:
-#             score_components['stress'] = 80 * 0.10
-#         elif 5 < stress <= 7:
-#             score_components['stress'] = 60 * 0.10
-#         else:
-#             score_components['stress'] = 40 * 0.10
-        
-#         # Body Age (5% weight)
-#         body_age = body_params['body_age']
-#         if body_age <= 30:
-#             score_components['body_age'] = 100 * 0.05
-#         elif 30 < body_age <= 40:
-#             score_components['body_age'] = 80 * 0.05
-#         elif 40 < body_age <= 50:
-#             score_components['body_age'] = 60 * 0.05
-#         else:
-#             score_components['body_age'] = 40 * 0.05
-        
-#         # Hydration (5% weight)
-#         waste_water = body_params['waste_water'].upper()
-#         if waste_water in ['A', '1']:
-#             score_components['hydration'] = 100 * 0.05
-#         elif waste_water in ['B', '2']:
-#             score_components['hydration'] = 80 * 0.05
-#         elif waste_water in ['C', '3']:
-#             score_components['hydration'] = 60 * 0.05
-#         else:
-#             score_components['hydration'] = 40 * 0.05
-        
-#         # Calculate total score
-#         total_score = sum(score_components.values())
-        
-#        # Classify the score
-#         # if total_score >= 80:
-#         #  status = "Good"
-#         # elif 60 <= total_score < 80:
-#         #  status = "Moderate"
-#         # elif 40 <= total_score < 60:
-#         #  status = "Average"
-#         # else:
-#         #     status = "Poor"
-
-
-#         if total_score >= 80:
-#             status = "Good"
-#         elif total_score >= 60:
-#             status = "Moderate"
-#         else:
-#             status = "Needs Attention"
-        
-#         return {
-#             'score': round(total_score, 2),
-#             'status': status,
-#             'components': score_components  # Optional: include component breakdown
-#         }
-    
-#     except Exception as e:
-#         return {
-#             'error': str(e),
-#             'score': 0,
-#             'status': 'Error'
-#         }
-def calculate_health_score(body_params):
-    # Initialize score components
-    score_components = {
-        'bmi': None,
-        'body_fat': None,
-        'muscle': None,
-        'visceral_fat': None,
-        'sleep': None,
-        'stress': None,
-        'body_age': None,
-        'hydration': None
+import os
+import threading
+from bisect import bisect_left, bisect_right
+from functools import lru_cache
+
+import numpy as np
+from pymongo import UpdateOne
+
+
+# -------------------------
+# Scoring rules
+# -------------------------
+# The health score is a weighted average of components, each scored from one
+# or more body_parameters fields. Bump RULES_VERSION whenever the table
+# changes: it is stamped into BodyParameters.components so that records scored
+# with older rules can be found and rescored.
+#
+# A part is either numeric (bucket 'edges' with 'points' per bucket, 'closed'
+# 'left' for "edge <= value < next edge" or 'right' for "edge < value <= next
+# edge") or categorical ('map' of normalized labels to points with a
+# 'default'). A component is only scored when all its numeric inputs are
+# present; a missing categorical input scores the default.
+RULES_VERSION = 1
+
+SCORING_RULES = {
+    'version': RULES_VERSION,
+    'components': [
+        {'name': 'bmi', 'weight': 0.20, 'parts': [
+            {'input': 'bmi', 'edges': [18.5, 25, 30], 'closed': 'left', 'points': [60, 100, 70, 40]},
+        ]},
+        {'name': 'body_fat', 'weight': 0.20, 'parts': [
+            {'input': 'body_fat', 'edges': [10, 15, 20, 25, 30], 'closed': 'left', 'points': [80, 100, 90, 80, 60, 40]},
+        ]},
+        {'name': 'muscle', 'weight': 0.15, 'parts': [
+            # Muscle mass as a percentage of body weight
+            {'input': ('muscle', 'weight'), 'transform': 'percent',
+             'edges': [25, 30, 35, 40], 'closed': 'right', 'points': [40, 60, 70, 85, 100]},
+        ]},
+        {'name': 'visceral_fat', 'weight': 0.10, 'parts': [
+            {'input': 'viseral_fats', 'transform': 'int', 'edges': [5, 9, 12], 'closed': 'right', 'points': [100, 70, 50, 30]},
+        ]},
+        {'name': 'sleep', 'weight': 0.15, 'parts': [
+            {'input': 'sleep_time', 'share': 0.5, 'edges': [5, 6, 7, 7.5], 'closed': 'left', 'points': [30, 50, 70, 90, 100]},
+            {'input': 'sleep_quality', 'share': 0.5, 'normalize': 'capitalize',
+             'map': {'Excellent': 100, 'Good': 80, 'Fair': 60}, 'default': 40},
+        ]},
+        {'name': 'stress', 'weight': 0.10, 'parts': [
+            {'input': 'stress_level', 'edges': [3, 5, 7], 'closed': 'right', 'points': [100, 80, 60, 40]},
+        ]},
+        {'name': 'body_age', 'weight': 0.05, 'parts': [
+            {'input': 'body_age', 'transform': 'int', 'edges': [30, 40, 50], 'closed': 'right', 'points': [100, 80, 60, 40]},
+        ]},
+        {'name': 'hydration', 'weight': 0.05, 'parts': [
+            {'input': 'waste_water', 'normalize': 'upper',
+             'map': {'A': 100, '1': 100, 'B': 80, '2': 80, 'C': 60, '3': 60}, 'default': 40},
+        ]},
+    ],
+    # (minimum score, status), checked in order
+    'status': [(80, 'Good'), (60, 'Moderate')],
+    'default_status': 'Needs Attention',
+}
+
+
+# -------------------------
+# Compiled rules
+# -------------------------
+class _NumericPart:
+    def __init__(self, spec):
+        self.inputs = spec['input'] if isinstance(spec['input'], tuple) else (spec['input'],)
+        self.transform = spec.get('transform')
+        self.share = float(spec.get('share', 1))
+        self.edges = [float(edge) for edge in spec['edges']]
+        self.points = [float(points) for points in spec['points']]
+        self.points_array = np.array(self.points)
+        self.right = spec['closed'] == 'right'
+        self._bisect = bisect_left if self.right else bisect_right
+
+    def value(self, body_params):
+        if self.transform == 'percent':
+            return (float(body_params[self.inputs[0]]) / float(body_params[self.inputs[1]])) * 100
+        if self.transform == 'int':
+            return int(float(body_params[self.inputs[0]]))
+        return float(body_params[self.inputs[0]])
+
+    def bucket(self, body_params):
+        return self._bisect(self.edges, self.value(body_params))
+
+    def values(self, columns):
+        values = [columns[name] for name in self.inputs]
+        if self.transform == 'percent':
+            return (values[0] / values[1]) * 100
+        if self.transform == 'int':
+            return np.trunc(values[0])
+        return values[0]
+
+    def buckets(self, columns):
+        return np.digitize(self.values(columns), self.edges, right=self.right)
+
+
+class _CategoricalPart:
+    inputs = ()
+
+    def __init__(self, spec):
+        self.input = spec['input']
+        self.share = float(spec.get('share', 1))
+        self.normalize = getattr(str, spec['normalize']) if spec.get('normalize') else str
+        # Bucket 0 is the default, then one bucket per distinct label
+        self.points = [float(spec['default'])] + [float(points) for points in spec['map'].values()]
+        self.points_array = np.array(self.points)
+        self.labels = {label: index for index, label in enumerate(spec['map'], start=1)}
+
+    def bucket(self, body_params):
+        return self.labels.get(self.normalize(str(body_params.get(self.input))), 0)
+
+    def buckets(self, columns):
+        # Map each distinct label once instead of once per row
+        labels, inverse = np.unique(np.asarray(columns[self.input], dtype=object).astype(str), return_inverse=True)
+        mapped = np.array([self.labels.get(self.normalize(label), 0) for label in labels], dtype=int)
+        return mapped[inverse.reshape(-1)]
+
+
+class _Component:
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.weight = float(spec['weight'])
+        self.parts = [_NumericPart(part) if 'edges' in part else _CategoricalPart(part) for part in spec['parts']]
+        self.inputs = tuple(name for part in self.parts for name in part.inputs)
+        self._part_buckets = [part.bucket for part in self.parts]
+
+    def buckets(self, body_params):
+        """The bucket index of each part, or None when a numeric input is missing."""
+        for name in self.inputs:
+            if body_params.get(name) is None:
+                return None
+        return tuple([bucket(body_params) for bucket in self._part_buckets])
+
+    def score(self, buckets):
+        points = 0.0
+        for part, bucket in zip(self.parts, buckets):
+            points += part.points[bucket] * part.share
+        return points * self.weight
+
+
+def compile_rules(rules):
+    return {
+        'version': rules['version'],
+        'components': [_Component(spec) for spec in rules['components']],
+        'status': [(float(minimum), label) for minimum, label in rules['status']],
+        'default_status': rules['default_status'],
     }
 
-    total_weight = 0
-    total_score = 0
 
-    # BMI Score (20% weight)
-    if 'BMI' in body_params and body_params['BMI'] is not None:
-        bmi = float(body_params['BMI'])
-        weight = body_params.get('weight', 0)
-        height = body_params.get('height', 0)
-
-        if bmi < 18.5:
-            score = 60 * 0.20
-        elif 18.5 <= bmi < 25:
-            score = 100 * 0.20
-        elif 25 <= bmi < 30:
-            score = 70 * 0.20
-        else:
-            score = 40 * 0.20
+COMPILED_RULES = compile_rules(SCORING_RULES)
 
-        score_components['bmi'] = score
-        total_score += score
-        total_weight += 0.20
-
-    # Body Fat Score (20% weight)
-    if 'body_fat' in body_params and body_params['body_fat'] is not None:
-        body_fat = float(body_params['body_fat'])
-        if body_fat < 10:
-            score = 80 * 0.20
-        elif 10 <= body_fat < 15:
-            score = 100 * 0.20
-        elif 15 <= body_fat < 20:
-            score = 90 * 0.20
-        elif 20 <= body_fat < 25:
-            score = 80 * 0.20
-        elif 25 <= body_fat < 30:
-            score = 60 * 0.20
-        else:
-            score = 40 * 0.20
+# Numeric and categorical inputs read by the rules, e.g. for building batch columns
+CATEGORICAL_INPUTS = tuple(dict.fromkeys(
+    part.input for component in COMPILED_RULES['components'] for part in component.parts
+    if isinstance(part, _CategoricalPart)
+))
+SCORE_INPUTS = tuple(dict.fromkeys(
+    name for component in COMPILED_RULES['components'] for name in component.inputs
+)) + CATEGORICAL_INPUTS
 
-        score_components['body_fat'] = score
-        total_score += score
-        total_weight += 0.20
-
-    # Muscle Mass Score (15% weight)
-    if 'muscle' in body_params and 'weight' in body_params:
-        muscle = float(body_params['muscle'])
-        weight = float(body_params['weight'])
-        muscle_percent = (muscle / weight) * 100
-        if muscle_percent > 40:
-            score = 100 * 0.15
-        elif 35 < muscle_percent <= 40:
-            score = 85 * 0.15
-        elif 30 < muscle_percent <= 35:
-            score = 70 * 0.15
-        elif 25 < muscle_percent <= 30:
-            score = 60 * 0.15
-        else:
-            score = 40 * 0.15
 
-        score_components['muscle'] = score
-        total_score += score
-        total_weight += 0.15
-
-    # Visceral Fat Score (10% weight)
-    if 'viseral_fats' in body_params:
-        visceral_fat = int(body_params['viseral_fats'])
-        if visceral_fat <= 5:
-            score = 100 * 0.10
-        elif 6 <= visceral_fat <= 9:
-            score = 70 * 0.10
-        elif 10 <= visceral_fat <= 12:
-            score = 50 * 0.10
-        else:
-            score = 30 * 0.10
+def _classify(score, rules=COMPILED_RULES):
+    for minimum, label in rules['status']:
+        if score >= minimum:
+            return label
+    return rules['default_status']
 
-        score_components['visceral_fat'] = score
-        total_score += score
-        total_weight += 0.10
-
-    # Sleep Score (15% weight)
-    if 'sleep_time' in body_params and 'sleep_quality' in body_params:
-        sleep_hours = float(body_params['sleep_time'])
-        sleep_quality = str(body_params['sleep_quality']).capitalize()
-
-        if sleep_hours >= 7.5:
-            sleep_duration_score = 100
-        elif 7 <= sleep_hours < 7.5:
-            sleep_duration_score = 90
-        elif 6 <= sleep_hours < 7:
-            sleep_duration_score = 70
-        elif 5 <= sleep_hours < 6:
-            sleep_duration_score = 50
-        else:
-            sleep_duration_score = 30
-
-        if sleep_quality == 'Excellent':
-            sleep_quality_score = 100
-        elif sleep_quality == 'Good':
-            sleep_quality_score = 80
-        elif sleep_quality == 'Fair':
-            sleep_quality_score = 60
-        else:
-            sleep_quality_score = 40
 
-        score = ((sleep_duration_score * 0.5) + (sleep_quality_score * 0.5)) * 0.15
-        score_components['sleep'] = score
-        total_score += score
-        total_weight += 0.15
-
-    # Stress Level Score (10% weight)
-    if 'stress_level' in body_params:
-        stress = float(body_params['stress_level'])
-        if stress <= 3:
-            score = 100 * 0.10
-        elif 3 < stress <= 5:
-            score = 80 * 0.10
-        elif 5 < stress <= 7:
-            score = 60 * 0.10
-        else:
-            score = 40 * 0.10
+def _score_buckets(bucket_key):
+    """
+    Scores one bucket key: per component, the tuple of its parts' bucket
+    indices, or None when the component is not scored. Returns
+    (score, status, component items) and is memoized by the score cache.
+    """
+    rules = COMPILED_RULES
+    score_components = []
 
-        score_components['stress'] = score
-        total_score += score
-        total_weight += 0.10
-
-    # Body Age (5% weight)
-    if 'body_age' in body_params:
-        body_age = int(body_params['body_age'])
-        if body_age <= 30:
-            score = 100 * 0.05
-        elif 30 < body_age <= 40:
-            score = 80 * 0.05
-        elif 40 < body_age <= 50:
-            score = 60 * 0.05
-        else:
-            score = 40 * 0.05
+    total_weight = 0
+    total_score = 0
 
-        score_components['body_age'] = score
-        total_score += score
-        total_weight += 0.05
-
-    # Hydration (5% weight)
-    if 'waste_water' in body_params:
-        waste_water = str(body_params['waste_water']).upper()
-        if waste_water in ['A', '1']:
-            score = 100 * 0.05
-        elif waste_water in ['B', '2']:
-            score = 80 * 0.05
-        elif waste_water in ['C', '3']:
-            score = 60 * 0.05
-        else:
-            score = 40 * 0.05
+    for component, buckets in zip(rules['components'], bucket_key):
+        if buckets is None:
+            score_components.append((component.name, None))
+            continue
 
-        score_components['hydration'] = score
+        score = component.score(buckets)
+        score_components.append((component.name, score))
         total_score += score
-        total_weight += 0.05
+        total_weight += component.weight
 
     # Normalize final score based on available weights
     final_score = (total_score / total_weight) if total_weight > 0 else 0
+    score_components.append(('rules_version', rules['version']))
+
+    return round(final_score, 2), _classify(final_score, rules), tuple(score_components)
+
+
+# -------------------------
+# Score cache
+# -------------------------
+# The score only depends on which bucket each metric falls into, and bucket
+# combinations repeat enormously across records, so scores are memoized on the
+# bucket-index tuple rather than the raw values.
+SCORE_CACHE_SIZE = int(os.getenv('HEALTH_SCORE_CACHE_SIZE', '65536'))
 
-    # Classify the score
-    if final_score >= 80:
-        status = "Good"
-    elif final_score >= 60:
-        status = "Moderate"
+# Set by the cached function when it runs, i.e. on a miss of the calling thread
+_score_cache_miss = threading.local()
+
+
+def _score_buckets_on_miss(key):
+    _score_cache_miss.flag = True
+    return _score_buckets(key)
+
+
+_cached_score_buckets = lru_cache(maxsize=SCORE_CACHE_SIZE)(_score_buckets_on_miss)
+_score_cache_hooks = []
+
+
+def add_score_cache_hook(hook):
+    """Registers hook(hit) to be called with True/False on every score cache lookup, e.g. to feed metrics."""
+    _score_cache_hooks.append(hook)
+
+
+def remove_score_cache_hook(hook):
+    _score_cache_hooks.remove(hook)
+
+
+def score_cache_info():
+    info = _cached_score_buckets.cache_info()
+    return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize, 'maxsize': info.maxsize}
+
+
+def clear_score_cache():
+    _cached_score_buckets.cache_clear()
+
+
+def bucket_key(body_params):
+    """The bucket-index tuple of a dict keyed like the BodyParameters fields."""
+    return tuple([component.buckets(body_params) for component in COMPILED_RULES['components']])
+
+
+def calculate_health_score(body_params):
+    """
+    Scores a dict keyed like the BodyParameters fields. Returns the rounded
+    score, its status and the weighted points of each component (None when
+    the component could not be scored), stamped with the rules version.
+    """
+    key = bucket_key(body_params)
+
+    if _score_cache_hooks:
+        _score_cache_miss.flag = False
+        score, status, score_components = _cached_score_buckets(key)
+        hit = not _score_cache_miss.flag
+        for hook in _score_cache_hooks:
+            hook(hit)
     else:
-        status = "Needs Attention"
+        score, status, score_components = _cached_score_buckets(key)
+
+    return {
+        'score': score,
+        'status': status,
+        'components': dict(score_components)
+    }
+
+
+def score_is_current(record):
+    """Whether a body_parameters document or dict was scored with the current rules."""
+    return (record.get('components') or {}).get('rules_version') == RULES_VERSION
+
+
+# -------------------------
+# Batch scoring
+# -------------------------
+# Columnar equivalent of calculate_health_score for rescoring history, using
+# the same compiled rules with np.digitize bucket lookups.
+def body_parameters_columns(records):
+    """
+    Builds the batch columns from body_parameters documents (raw Mongo documents
+    or dicts keyed like the model). Missing and None values become NaN/None.
+    """
+    columns = {}
+    for name in SCORE_INPUTS:
+        if name in CATEGORICAL_INPUTS:
+            columns[name] = np.array([record.get(name) for record in records], dtype=object)
+        else:
+            columns[name] = np.array(
+                [np.nan if record.get(name) is None else float(record[name]) for record in records], dtype=float
+            )
+    return columns
+
+
+def calculate_health_scores_batch(columns):
+    """
+    Scores many rows at once. columns maps every name of SCORE_INPUTS to a
+    1-d array: floats with NaN for missing values, or objects with None for
+    the categorical inputs.
+
+    Each row gives exactly the result of calculate_health_score on the same
+    values. Returns {'score', 'status', 'components', 'rules_version'} where
+    score and status are arrays and components maps each component to an array
+    with NaN where the scalar function returns None.
+    """
+    rules = COMPILED_RULES
+    columns = {
+        name: np.asarray(values, dtype=object if name in CATEGORICAL_INPUTS else float)
+        for name, values in columns.items()
+    }
+    size = len(next(iter(columns.values())))
+
+    components = {}
+    total_score = np.zeros(size)
+    total_weight = np.zeros(size)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # Same order as calculate_health_score so that the float sums match
+        for component in rules['components']:
+            present = np.ones(size, dtype=bool)
+            for name in component.inputs:
+                present &= ~np.isnan(columns[name])
+
+            points = np.zeros(size)
+            for part in component.parts:
+                if isinstance(part, _NumericPart) and part.transform == 'percent' and \
+                        np.any(present & (columns[part.inputs[1]] == 0)):
+                    # Same failure as the scalar function
+                    raise ZeroDivisionError('float division by zero')
+                buckets = np.where(present, part.buckets(columns), 0)
+                points = points + part.points_array[buckets] * part.share
+
+            score = np.where(present, points * component.weight, np.nan)
+            components[component.name] = score
+            total_score = total_score + np.where(present, score, 0.0)
+            total_weight = total_weight + np.where(present, component.weight, 0.0)
+
+        final_score = np.where(total_weight > 0, total_score / total_weight, 0.0)
+
+    status = np.full(size, rules['default_status'], dtype=object)
+    for minimum, label in reversed(rules['status']):
+        status[final_score >= minimum] = label
+
+    # Python's round() is correctly rounded while np.round is not; the scores
+    # take few distinct values, so round each distinct value once.
+    distinct, inverse = np.unique(final_score, return_inverse=True)
+    rounded = np.array([round(float(value), 2) for value in distinct], dtype=float)
 
     return {
-        'score': round(final_score, 2),
+        'score': rounded[inverse.reshape(-1)],
         'status': status,
-        'components': score_components
+        'components': components,
+        'rules_version': rules['version'],
     }
+
+
+def batch_result_rows(result):
+    """Converts a calculate_health_scores_batch result into the per-row dicts of calculate_health_score."""
+    names = list(result['components'])
+    component_rows = zip(*(result['components'][name].tolist() for name in names))
+    rows = []
+    for score, status, values in zip(result['score'].tolist(), result['status'].tolist(), component_rows):
+        components = {name: None if value != value else value for name, value in zip(names, values)}
+        components['rules_version'] = result['rules_version']
+        rows.append({'score': score, 'status': status, 'components': components})
+    return rows
+
+
+# -------------------------
+# Lazy rescoring
+# -------------------------
+def score_records(records):
+    """
+    Scores body_parameters documents with the batch engine. Returns one result
+    per record, None for the records that cannot be scored.
+    """
+    try:
+        return batch_result_rows(calculate_health_scores_batch(body_parameters_columns(records)))
+    except ZeroDivisionError:
+        # A zero weight fails the muscle ratio; score row by row and leave those records as they are
+        rows = []
+        for record in records:
+            try:
+                rows.append(calculate_health_score(record))
+            except ZeroDivisionError:
+                rows.append(None)
+        return rows
+
+
+def refresh_stale_scores(records):
+    """
+    Rescores, in place and in Mongo, the body_parameters documents in records
+    that were not scored with the current rules. Returns the rescored documents.
+    """
+    stale = [record for record in records if not score_is_current(record)]
+    if not stale:
+        return []
+
+    rescored, operations = [], []
+    for record, result in zip(stale, score_records(stale)):
+        if result is None:
+            continue
+        record.update(result)
+        rescored.append(record)
+        operations.append(UpdateOne({'_id': record['_id']}, {'$set': result}))
+
+    if operations:
+        # Imported here so that scoring alone does not need the Django app registry
+        from health.models import BodyParameters
+        BodyParameters._get_collection().bulk_write(operations, ordered=False)
+    return rescored
@@ -0,0 +1,185 @@
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from health.models import HEALTH_PANEL_MODELS, LatestHealthSnapshot
+
+# Fields copied from a panel record into its snapshot entry
+SNAPSHOT_FIELDS = ('score', 'status', 'bmi', 'created_at', 'updated_at')
+
+
+def _snapshot_collection():
+    return LatestHealthSnapshot._get_collection()
+
+
+def _entry_from_son(son):
+    entry = {'record_id': son['_id']}
+    for field in SNAPSHOT_FIELDS:
+        entry[field] = son.get(field)
+    return entry
+
+
+def _entry_from_record(record):
+    entry = {'record_id': record.pk}
+    for field in SNAPSHOT_FIELDS:
+        entry[field] = getattr(record, field, None)
+    return entry
+
+
+def _promote_entry(panel_type, entry):
+    # Update pipeline replacing the user's entry only if the new record is at
+    # least as recent: comparison and write happen in one atomic upsert
+    path = f'panels.{panel_type}'
+    return [{'$set': {path: {'$cond': [
+        {'$lte': [{'$ifNull': [f'${path}.created_at', None]}, entry['created_at']]},
+        {'$literal': entry},
+        f'${path}',
+    ]}}}]
+
+
+def snapshot_record_created(panel_type, record):
+    """Promotes a freshly saved record into the user's snapshot if it is the newest of its panel type."""
+    _snapshot_collection().update_one(
+        {'_id': record.user_id}, _promote_entry(panel_type, _entry_from_record(record)), upsert=True
+    )
+
+
+def snapshot_records_created(panel_type, records):
+    """Same as snapshot_record_created for many freshly inserted raw documents, in one bulk write."""
+    newest = {}
+    for son in records:
+        user_id = son.get('user_id')
+        if user_id is None:
+            continue
+        if user_id not in newest or (son.get('created_at') or datetime.min) >= (newest[user_id].get('created_at') or datetime.min):
+            newest[user_id] = son
+
+    operations = [
+        UpdateOne({'_id': user_id}, _promote_entry(panel_type, _entry_from_son(son)), upsert=True)
+        for user_id, son in newest.items()
+    ]
+    if operations:
+        _snapshot_collection().bulk_write(operations, ordered=False)
+
+
+def refresh_latest_snapshot(panel_type, user_id):
+    """
+    Recomputes the snapshot entry of one panel type for a user after an update
+    or a delete, which may have changed which record is the newest. The entry
+    is only replaced if it still points at the record read before the query;
+    otherwise a concurrent create promoted a record, which is kept if newer.
+    """
+    if user_id is None:
+        return
+
+    path = f'panels.{panel_type}'
+    before = get_user_snapshot(user_id, [panel_type]).get(panel_type)
+    unchanged = {'_id': user_id, f'{path}.record_id': before['record_id']} if before else None
+    model_class = HEALTH_PANEL_MODELS[panel_type]
+    projection = {field: 1 for field in SNAPSHOT_FIELDS}
+    latest = model_class._get_collection().find_one(
+        {'user_id': user_id}, projection, sort=[('created_at', -1)]
+    )
+
+    if latest:
+        entry = _entry_from_son(latest)
+        if unchanged is None or not _snapshot_collection().update_one(unchanged, {'$set': {path: entry}}).matched_count:
+            _snapshot_collection().update_one({'_id': user_id}, _promote_entry(panel_type, entry), upsert=True)
+    elif unchanged is not None:
+        _snapshot_collection().update_one(unchanged, {'$unset': {path: ''}})
+
+
+def update_snapshot_scores(panel_type, records):
+    """
+    Copies the new score and status of rescored records (raw documents) into
+    the snapshot entries that point at them.
+    """
+    path = f'panels.{panel_type}'
+    operations = [
+        UpdateOne(
+            {'_id': record['user_id'], f'{path}.record_id': record['_id']},
+            {'$set': {f'{path}.score': record.get('score'), f'{path}.status': record.get('status')}},
+        )
+        for record in records if record.get('user_id') is not None
+    ]
+    if operations:
+        _snapshot_collection().bulk_write(operations, ordered=False)
+
+
+def get_latest_snapshots(user_ids, panel_type):
+    """Returns {user_id: snapshot entry} for the users that have one for panel_type."""
+    path = f'panels.{panel_type}'
+    cursor = _snapshot_collection().find(
+        {'_id': {'$in': list(user_ids)}, path: {'$exists': True}}, {path: 1}
+    )
+    return {doc['_id']: doc['panels'][panel_type] for doc in cursor}
+
+
+def get_user_snapshot(user_id, panel_types):
+    """Returns {panel_type: snapshot entry} of one user, for the given panel types that have an entry."""
+    doc = _snapshot_collection().find_one(
+        {'_id': user_id}, {f'panels.{panel_type}': 1 for panel_type in panel_types}
+    )
+    return (doc or {}).get('panels', {})
+
+
+def get_latest_record(panel_type, user_id, as_pymongo=False):
+    """
+    Returns the newest record of panel_type for the user, or None.
+    Uses the snapshot when it has an entry and falls back to a sorted query.
+    With as_pymongo the record is returned as the raw Mongo document.
+    """
+    model_class = HEALTH_PANEL_MODELS[panel_type]
+    queryset = model_class.objects.as_pymongo() if as_pymongo else model_class.objects
+    entry = get_latest_snapshots([user_id], panel_type).get(user_id)
+
+    if entry:
+        record = queryset(pk=entry['record_id']).first()
+        if record:
+            return record
+
+    return queryset(user_id=user_id).order_by('-created_at').first()
+
+
+def rebuild_latest_snapshots(panel_types=None, batch_size=1000):
+    """
+    Rebuilds the snapshot entries of the given panel types (all by default) from
+    the panel collections. Returns {panel_type: number of users written}.
+    """
+    panel_types = panel_types or list(HEALTH_PANEL_MODELS)
+    collection = _snapshot_collection()
+
+    if set(panel_types) == set(HEALTH_PANEL_MODELS):
+        collection.delete_many({})
+    else:
+        collection.update_many({}, {'$unset': {f'panels.{panel_type}': '' for panel_type in panel_types}})
+
+    written = {}
+    for panel_type in panel_types:
+        model_class = HEALTH_PANEL_MODELS[panel_type]
+        group = {'_id': '$user_id', 'record_id': {'$first': '$_id'}}
+        for field in SNAPSHOT_FIELDS:
+            group[field] = {'$first': f'${field}'}
+
+        pipeline = [
+            {'$sort': {'user_id': 1, 'created_at': -1}},
+            {'$group': group},
+        ]
+
+        operations = []
+        written[panel_type] = 0
+        for row in model_class._get_collection().aggregate(pipeline, allowDiskUse=True):
+            user_id = row.pop('_id')
+            if user_id is None:
+                continue
+            operations.append(UpdateOne({'_id': user_id}, {'$set': {f'panels.{panel_type}': row}}, upsert=True))
+            if len(operations) >= batch_size:
+                collection.bulk_write(operations, ordered=False)
+                written[panel_type] += len(operations)
+                operations = []
+
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+            written[panel_type] += len(operations)
+
+    return written
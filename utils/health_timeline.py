@@ -0,0 +1,55 @@
+from health.models import HEALTH_PANEL_MODELS
+from utils.pagination import keyset_filter
+
+# Field added to every timeline document to tell which panel it comes from
+TYPE_FIELD = '_panel_type'
+
+TIMELINE_SORT = {'created_at': -1, '_id': -1}
+
+
+def _projection(panel_type):
+    # The stored fields of the panel, which its serializer exposes (fields = '__all__')
+    return {field.db_field: 1 for field in HEALTH_PANEL_MODELS[panel_type]._fields.values()}
+
+
+def _branch_stages(panel_type, user_id, after, limit):
+    match = {'user_id': user_id}
+    if after:
+        match = {'$and': [match, keyset_filter(*after)]}
+    # Each branch is sorted and limited on its own so that it is served by the
+    # (user_id, created_at, _id) index and never feeds more than a page, of the
+    # serialized fields only, into the merge
+    return [
+        {'$match': match},
+        {'$sort': TIMELINE_SORT},
+        {'$limit': limit},
+        {'$project': _projection(panel_type)},
+        {'$addFields': {TYPE_FIELD: {'$literal': panel_type}}},
+    ]
+
+
+def timeline_pipeline(user_id, panel_types, after=None, limit=50):
+    """
+    Builds the aggregation, to run on the collection of panel_types[0], that
+    merges the records of every panel type of a user with $unionWith, newest first.
+    after is an optional decoded (created_at, _id) cursor.
+    """
+    first, others = panel_types[0], panel_types[1:]
+    pipeline = _branch_stages(first, user_id, after, limit)
+    for panel_type in others:
+        pipeline.append({'$unionWith': {
+            'coll': HEALTH_PANEL_MODELS[panel_type]._get_collection_name(),
+            'pipeline': _branch_stages(panel_type, user_id, after, limit),
+        }})
+    pipeline += [
+        {'$sort': TIMELINE_SORT},
+        {'$limit': limit},
+    ]
+    return pipeline
+
+
+def fetch_timeline(user_id, panel_types=None, after=None, limit=50):
+    """Returns up to limit raw documents across the panel collections, each tagged with its panel type."""
+    panel_types = list(dict.fromkeys(panel_types or HEALTH_PANEL_MODELS))
+    collection = HEALTH_PANEL_MODELS[panel_types[0]]._get_collection()
+    return list(collection.aggregate(timeline_pipeline(user_id, panel_types, after, limit)))
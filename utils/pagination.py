@@ -0,0 +1,144 @@
+import base64
+import json
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+
+
+def encode_cursor(created_at, object_id):
+    payload = json.dumps({'c': created_at.isoformat() if created_at else None, 'i': str(object_id)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns (created_at, ObjectId) from an opaque cursor, raising ValidationError if it is malformed."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        created_at = datetime.fromisoformat(payload['c']) if payload['c'] else None
+        return created_at, ObjectId(payload['i'])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValidationError({'error': 'Invalid cursor.'})
+
+
+def keyset_filter(created_at, object_id):
+    """Mongo filter selecting the documents after (created_at, _id) in descending order."""
+    return {'$or': [
+        {'created_at': {'$lt': created_at}},
+        {'created_at': created_at, '_id': {'$lt': object_id}},
+    ]}
+
+
+def _parse_int_param(request, name):
+    value = request.query_params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({'error': f'Invalid {name} provided. Must be an integer.'})
+
+
+def _parse_date_param(request, name):
+    """Returns (datetime, whether only a date was given), or (None, False) when the parameter is absent."""
+    value = request.query_params.get(name)
+    if not value:
+        return None, False
+
+    parsed_date = parse_date(value)
+    if parsed_date:
+        return datetime.combine(parsed_date, datetime.min.time()), True
+
+    parsed = parse_datetime(value)
+    if not parsed:
+        raise ValidationError({'error': f'Invalid date format for {name}. Use YYYY-MM-DD.'})
+    return parsed, False
+
+
+class HealthCursorPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, _id), newest first, for MongoEngine
+    querysets, including as_pymongo() ones. Only one page is ever read from Mongo, so memory per request
+    stays constant whatever the collection size.
+
+    Query parameters: cursor, page_size, user_id, dietician_id,
+    start_date and end_date (YYYY-MM-DD or ISO datetime, both inclusive; an
+    end_date without a time includes that whole day).
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+
+    def get_page_size(self, request):
+        page_size = _parse_int_param(request, self.page_size_query_param)
+        if page_size is None or page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def filter_queryset(self, queryset, request):
+        """Pushes the optional user_id, dietician_id and date range filters into the Mongo query."""
+        user_id = _parse_int_param(request, 'user_id')
+        if user_id is not None:
+            queryset = queryset.filter(user_id=user_id)
+
+        dietician_id = _parse_int_param(request, 'dietician_id')
+        if dietician_id is not None:
+            queryset = queryset.filter(dietician_id=dietician_id)
+
+        start_date, _ = _parse_date_param(request, 'start_date')
+        if start_date:
+            queryset = queryset.filter(created_at__gte=start_date)
+
+        end_date, whole_day = _parse_date_param(request, 'end_date')
+        if whole_day:
+            queryset = queryset.filter(created_at__lt=end_date + timedelta(days=1))
+        elif end_date:
+            queryset = queryset.filter(created_at__lte=end_date)
+
+        return queryset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        queryset = self.filter_queryset(queryset, request)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(__raw__=keyset_filter(*decode_cursor(cursor)))
+
+        # Fetch one extra document to know whether there is a next page
+        page = list(queryset.order_by('-created_at', '-id').limit(self.page_size + 1))
+
+        self.next_cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            last = page[-1]
+            if isinstance(last, dict):
+                # Raw documents from an as_pymongo() queryset
+                self.next_cursor = encode_cursor(last.get('created_at'), last['_id'])
+            else:
+                self.next_cursor = encode_cursor(last.created_at, last.pk)
+        return page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next_cursor': self.next_cursor,
+            'results': data
+        })
+
+
+class TestSearchPagination(PageNumberPagination):
+    """Page number pagination over the in-memory search results."""
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': self.page.paginator.count,
+            'results': data
+        })
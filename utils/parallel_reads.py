@@ -0,0 +1,50 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Bounded pool shared by every request. The workers only run pymongo reads,
+# which are thread safe and draw from the client's own connection pool.
+MAX_WORKERS = int(os.getenv('HEALTH_READ_WORKERS', '8'))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='health-read')
+    return _executor
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run_timed(tasks):
+    """
+    Runs {key: (func, *args)} concurrently on the shared pool.
+    Returns ({key: result}, {key: seconds}); the first exception raised by a task is re-raised.
+    """
+    if len(tasks) == 1:
+        # Nothing to overlap, skip the pool hand-off
+        key, (func, *args) = next(iter(tasks.items()))
+        result, elapsed = _timed(func, *args)
+        return {key: result}, {key: elapsed}
+
+    executor = _get_executor()
+    futures = {key: executor.submit(_timed, func, *args) for key, (func, *args) in tasks.items()}
+    results, timings = {}, {}
+    for key, future in futures.items():
+        results[key], timings[key] = future.result()
+    return results, timings
+
+
+def server_timing_header(timings):
+    """Formats {name: seconds} as a Server-Timing header value (durations in ms)."""
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.items())
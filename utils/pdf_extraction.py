@@ -0,0 +1,98 @@
+"""
+Page-level PDF extraction for the medical report analyzer.
+
+Pages are extracted independently, so multi-page reports are split into
+contiguous page ranges and fanned out over a process pool. Table extraction
+(pdfplumber's default, ruling line based strategy) only runs on pages that
+have lines, rectangles or curves: on the others it cannot find anything.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import pdfplumber
+
+PDF_WORKERS = int(os.getenv('PDF_EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _executor(workers):
+    # One long-lived pool per size; spawned rather than forked since the
+    # web process runs threads
+    with _executors_lock:
+        if workers not in _executors:
+            _executors[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _executors[workers]
+
+
+def has_ruling_lines(page):
+    return bool(page.lines or page.rects or page.curves)
+
+
+def extract_page(page):
+    """{'page', 'text', 'tables'} of one pdfplumber page; table cells are strings, '' for empty ones."""
+    tables = page.extract_tables() if has_ruling_lines(page) else []
+    return {
+        'page': page.page_number,
+        'text': page.extract_text() or '',
+        'tables': [
+            [['' if cell is None else cell for cell in row] for row in table]
+            for table in tables if table
+        ],
+    }
+
+
+def _extract_range(pdf_bytes, page_numbers):
+    with pdfplumber.open(BytesIO(pdf_bytes), pages=page_numbers) as pdf:
+        return [extract_page(page) for page in pdf.pages]
+
+
+def _page_ranges(page_count, parts):
+    size, extra = divmod(page_count, parts)
+    ranges, start = [], 1
+    for index in range(parts):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def extract_pages(pdf_bytes, workers=None):
+    """
+    Extracts every page of a PDF, in order. With more than one worker and
+    more than one page, contiguous page ranges are extracted on a process pool.
+    """
+    workers = PDF_WORKERS if workers is None else workers
+    with pdfplumber.open(BytesIO(pdf_bytes)) as pdf:
+        page_count = len(pdf.pages)
+        if workers <= 1 or page_count < 2:
+            return [extract_page(page) for page in pdf.pages]
+
+    futures = [
+        _executor(workers).submit(_extract_range, pdf_bytes, page_numbers)
+        for page_numbers in _page_ranges(page_count, min(workers, page_count))
+    ]
+    return [page for future in futures for page in future.result()]
+
+
+def render_pages(pages):
+    """
+    The text handed to the analyzer's prompt: each page's text then its
+    tables, with the PAGE and TABLE markers and tab separated cells.
+    """
+    parts = []
+    for page in pages:
+        parts.append(f"\n--- PAGE {page['page']} ---\n")
+        if page['text']:
+            parts.append(page['text'])
+        for table in page['tables']:
+            parts.append("\n--- TABLE START ---\n")
+            parts.extend("\t".join(row) for row in table)
+            parts.append("\n--- TABLE END ---\n")
+    return "\n".join(parts)
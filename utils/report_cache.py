@@ -0,0 +1,109 @@
+"""
+Content-addressed cache of the report analyzer.
+
+Entries are keyed by kind, the SHA-256 of the PDF bytes and the version of
+whatever produced them (extraction engine, model and prompt), so a repeated
+upload of the same file is served without extracting or calling the LLM
+again, and changing the prompt or the model never serves stale results.
+Entries unused for REPORT_CACHE_TTL_DAYS expire through a TTL index; when the
+cache grows beyond REPORT_CACHE_MAX_BYTES the least recently used are evicted.
+Inserts only add to a running total of the size; the entries are summed again
+when that total goes over the budget.
+"""
+import datetime
+import hashlib
+import logging
+import os
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DocumentTooLarge, DuplicateKeyError
+
+from health.models import ReportAnalysisCache, ReportAnalysisCacheStats
+
+REPORT_CACHE_MAX_BYTES = int(os.getenv('REPORT_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+# Entries evicted per delete when over budget
+EVICTION_BATCH = 100
+
+logger = logging.getLogger(__name__)
+
+
+def _collection():
+    return ReportAnalysisCache._get_collection()
+
+
+def _stats_collection():
+    return ReportAnalysisCacheStats._get_collection()
+
+
+def _add_size(size, count):
+    """Adds to the running total and returns the new size."""
+    doc = _stats_collection().find_one_and_update(
+        {'_id': 'size'}, {'$inc': {'size': size, 'count': count}}, upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    return doc['size']
+
+
+def pdf_digest(pdf_bytes):
+    return hashlib.sha256(pdf_bytes).hexdigest()
+
+
+def _key(kind, digest, version):
+    return f'{kind}:{digest}:{version}'
+
+
+def get_cached(kind, digest, version):
+    """The cached value (a string), or None. A hit refreshes the entry's LRU position and TTL."""
+    doc = _collection().find_one_and_update(
+        {'_id': _key(kind, digest, version)},
+        {'$set': {'last_used_at': datetime.datetime.utcnow()}},
+        projection={'value': 1},
+    )
+    return doc['value'] if doc else None
+
+
+def set_cached(kind, digest, version, value):
+    now = datetime.datetime.utcnow()
+    size = len(value.encode())
+    try:
+        _collection().insert_one({
+            '_id': _key(kind, digest, version), 'kind': kind, 'value': value,
+            'size': size, 'created_at': now, 'last_used_at': now,
+        })
+    except DuplicateKeyError:
+        # A concurrent upload of the same file stored it first
+        return
+    except DocumentTooLarge:
+        logger.info('Not caching the %s of %s: %s bytes exceed the Mongo document limit', kind, digest, size)
+        return
+    if _add_size(size, 1) > REPORT_CACHE_MAX_BYTES:
+        evict()
+
+
+def cache_size():
+    result = list(_collection().aggregate([{'$group': {'_id': None, 'size': {'$sum': '$size'}, 'count': {'$sum': 1}}}]))
+    return (result[0]['size'], result[0]['count']) if result else (0, 0)
+
+
+def evict(max_bytes=None):
+    """Deletes least recently used entries until the cache fits in max_bytes. Returns the number deleted."""
+    max_bytes = REPORT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    size, count = cache_size()
+    _stats_collection().update_one(
+        {'_id': 'size'}, {'$set': {'size': size, 'count': count, 'counted_at': datetime.datetime.utcnow()}}, upsert=True,
+    )
+    deleted = 0
+    while size > max_bytes:
+        oldest = list(_collection().find({}, {'size': 1}).sort('last_used_at', ASCENDING).limit(EVICTION_BATCH))
+        if not oldest:
+            break
+        victims, freed = [], 0
+        for doc in oldest:
+            victims.append(doc['_id'])
+            freed += doc.get('size') or 0
+            if size - freed <= max_bytes:
+                break
+        removed = _collection().delete_many({'_id': {'$in': victims}}).deleted_count
+        size -= freed
+        deleted += removed
+        _add_size(-freed, -removed)
+    return deleted
@@ -0,0 +1,228 @@
+"""
+Queue of report analyses.
+
+Jobs are stored in Mongo and claimed atomically, with a lease, by whoever
+runs them: the bounded thread pool of the web process that received the
+upload, or the run_report_jobs command. A job whose worker died is claimed
+again once its lease expires, unless it already used all its attempts.
+The PDF is kept in the job document until the job finishes. Failures of
+the LLM client, and answers that could not be parsed, are retried with
+exponential backoff up to the job's max_attempts.
+"""
+import datetime
+import json
+import os
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import ReturnDocument
+
+from health.models import ReportAnalysisJob
+from utils.report_mapping import ingest_report
+from utils.test_medical_analyzer import LLM_TIMEOUT, analyze_pdf_report
+
+REPORT_JOB_WORKERS = int(os.getenv('REPORT_JOB_WORKERS', '2'))
+MAX_ATTEMPTS = int(os.getenv('REPORT_JOB_MAX_ATTEMPTS', '3'))
+# Seconds before the first retry, doubled at each further one
+RETRY_BASE_DELAY = float(os.getenv('REPORT_JOB_RETRY_DELAY', '5'))
+LEASE_SECONDS = LLM_TIMEOUT + 60
+# The PDF is kept in the job document, which Mongo caps at 16 MB
+MAX_PDF_BYTES = 15 * 1024 * 1024
+# After this, a write of a job's records whose request died may be taken over
+RECORDS_LOCK_SECONDS = 300
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _collection():
+    return ReportAnalysisJob._get_collection()
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=REPORT_JOB_WORKERS, thread_name_prefix='report-job')
+        return _executor
+
+
+def kick():
+    """Asks the local pool to run the jobs that are due."""
+    _get_executor().submit(drain)
+
+
+def submit_job(pdf_content_bytes, filename, user_id=None, max_attempts=MAX_ATTEMPTS, run_locally=True, submitted_by=None):
+    """Queues an analysis of user_id's report, uploaded by submitted_by (default: the user), and returns its job id."""
+    now = datetime.datetime.utcnow()
+    job_id = _collection().insert_one({
+        'user_id': user_id, 'submitted_by': user_id if submitted_by is None else submitted_by,
+        'filename': filename, 'pdf': pdf_content_bytes,
+        'status': 'queued', 'attempts': 0, 'max_attempts': max_attempts,
+        'next_attempt_at': now, 'timings': {}, 'created_at': now,
+    }).inserted_id
+    if run_locally:
+        kick()
+    return job_id
+
+
+def fail_expired_jobs(now=None):
+    """Marks failed the jobs whose lease expired on their last attempt. Returns how many."""
+    now = now or datetime.datetime.utcnow()
+    return _collection().update_many(
+        {'status': 'running', 'lease_expires_at': {'$lt': now}, '$expr': {'$gte': ['$attempts', '$max_attempts']}},
+        {
+            '$set': {'status': 'failed', 'error': 'The analysis did not finish in time.', 'finished_at': now},
+            '$unset': {'pdf': ''},
+        },
+    ).modified_count
+
+
+def claim_job():
+    """Atomically takes the next due job (or one whose lease expired) and marks it running."""
+    now = datetime.datetime.utcnow()
+    fail_expired_jobs(now)
+    return _collection().find_one_and_update(
+        {'$or': [
+            {'status': 'queued', 'next_attempt_at': {'$lte': now}},
+            {'status': 'running', 'lease_expires_at': {'$lt': now}, '$expr': {'$lt': ['$attempts', '$max_attempts']}},
+        ]},
+        {
+            '$set': {'status': 'running', 'lease_expires_at': now + datetime.timedelta(seconds=LEASE_SECONDS)},
+            '$min': {'started_at': now},
+            '$inc': {'attempts': 1},
+        },
+        sort=[('next_attempt_at', 1)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def retry_delay(attempts):
+    delay = RETRY_BASE_DELAY * 2 ** (attempts - 1)
+    return delay + random.uniform(0, delay / 10)
+
+
+def run_job(job, client=None):
+    """Runs one claimed job and records its outcome. Returns the new status."""
+    timings = dict(job.get('timings') or {})
+    timings.setdefault('queue_wait', round((job['started_at'] - job['created_at']).total_seconds(), 3))
+    step_timings = {}
+    started = datetime.datetime.utcnow()
+    # Only the worker holding this attempt may record its outcome
+    owned = {'_id': job['_id'], 'status': 'running', 'attempts': job['attempts']}
+
+    try:
+        result = analyze_pdf_report(job['pdf'], job['filename'], client, raise_errors=True, timings=step_timings)
+        # An answer that could not be parsed is as transient as a raised error
+        error = result.get('error')
+    except Exception as exc:
+        result, error = None, str(exc)
+
+    now = datetime.datetime.utcnow()
+    timings.update(step_timings, run=round((now - started).total_seconds(), 3))
+    if error is not None:
+        if job['attempts'] < job['max_attempts']:
+            delay = retry_delay(job['attempts'])
+            _collection().update_one(owned, {'$set': {
+                'status': 'queued', 'error': error, 'timings': timings,
+                'next_attempt_at': now + datetime.timedelta(seconds=delay),
+            }})
+            timer = threading.Timer(delay, kick)
+            timer.daemon = True
+            timer.start()
+            return 'queued'
+        _collection().update_one(owned, {
+            '$set': {'status': 'failed', 'error': error, 'timings': timings, 'finished_at': now},
+            '$unset': {'pdf': ''},
+        })
+        return 'failed'
+
+    timings['total'] = round((now - job['created_at']).total_seconds(), 3)
+    _collection().update_one(owned, {
+        '$set': {'status': 'succeeded', 'result': json.dumps(result), 'error': None, 'timings': timings, 'finished_at': now},
+        '$unset': {'pdf': ''},
+    })
+    return 'succeeded'
+
+
+def drain(client=None):
+    """Runs due jobs until there are none left. Returns the number of attempts made."""
+    count = 0
+    while True:
+        job = claim_job()
+        if job is None:
+            return count
+        run_job(job, client)
+        count += 1
+
+
+def get_job(job_id):
+    """The job without its PDF, or None."""
+    return _collection().find_one({'_id': job_id}, {'pdf': 0})
+
+
+def job_status(job):
+    """The API view of a job."""
+    data = {
+        'job_id': str(job['_id']),
+        'status': job['status'],
+        'filename': job.get('filename'),
+        'attempts': job.get('attempts', 0),
+        'max_attempts': job.get('max_attempts'),
+        'created_at': job.get('created_at'),
+        'started_at': job.get('started_at'),
+        'finished_at': job.get('finished_at'),
+        'timings': job.get('timings') or {},
+    }
+    if job['status'] == 'succeeded':
+        data['result'] = json.loads(job['result'])
+    elif job.get('error'):
+        data['error'] = job['error']
+    if job['status'] == 'queued' and job.get('attempts'):
+        data['next_attempt_at'] = job.get('next_attempt_at')
+    if 'records' in job:
+        data['records'] = job['records']
+        data['records_complete'] = bool(job.get('records_complete'))
+    return data
+
+
+def ingest_job_result(job, dietician_id=None, dry_run=False):
+    """
+    Writes the health panels mapped from a succeeded job's result for its
+    user (see utils.report_mapping.ingest_report). Panels already written by
+    an earlier call are skipped, so a partial failure can be retried. Returns
+    None when every panel was already written or another request is writing
+    them; otherwise the outcome, with 'records' holding all the panels
+    written so far.
+    """
+    analysis = json.loads(job['result'])
+    if dry_run:
+        return dict(ingest_report(analysis, job['user_id'], dietician_id, dry_run=True), records=job.get('records') or {})
+
+    # Claims the result so that concurrent requests do not write it twice
+    now = datetime.datetime.utcnow()
+    job = _collection().find_one_and_update(
+        {'_id': job['_id'], 'records_complete': {'$ne': True}, '$or': [
+            {'records_pending': {'$exists': False}},
+            {'records_pending': {'$lt': now - datetime.timedelta(seconds=RECORDS_LOCK_SECONDS)}},
+        ]},
+        {'$set': {'records_pending': now}},
+        projection={'records': 1, 'user_id': 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if job is None:
+        return None
+    records = job.get('records') or {}
+    try:
+        outcome = ingest_report(analysis, job['user_id'], dietician_id, skip_panels=records)
+    except Exception:
+        _collection().update_one({'_id': job['_id']}, {'$unset': {'records_pending': ''}})
+        raise
+    # The panels written are kept; when some failed the others may be retried
+    records = dict(records, **outcome['created'])
+    _collection().update_one({'_id': job['_id']}, {
+        '$set': {'records': records, 'records_complete': bool(records) and not outcome['errors']},
+        '$unset': {'records_pending': ''},
+    })
+    return dict(outcome, records=records)
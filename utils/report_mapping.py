@@ -0,0 +1,361 @@
+"""
+Maps analyzed reports (utils.test_medical_analyzer) into health panel records.
+
+Investigation names are looked up in a synonym index built once at import:
+names are normalized (case, punctuation, "serum"/"plasma" prefixes) and also
+indexed with their words sorted, so "Vitamin D, 25 Hydroxy" and
+"25-Hydroxy Vitamin D" both find vitamin_d_25. Ratios are only indexed as
+written, since "HDL/LDL" is the inverse of "LDL/HDL". Values are converted to
+the unit the panel stores, censored values ("<0.5") are left out, and all
+panels of a report are validated before any of them is written.
+"""
+import datetime
+import re
+
+from utils.health_bulk import insert_rows, validate_rows
+
+# Panel type, field path, unit stored, {other unit: factor to the stored unit}, names found on reports,
+# and optionally the factor from a related quantity reported under those names (BUN is urea / 2.14);
+# such derived values give way to a measured value of the field.
+# Units are written as normalize_unit returns them; fields without a unit are stored as text.
+FIELDS = [
+    # BloodTestValues
+    ('blood_test', 'vitamin_d_25', 'ng/ml', {'nmol/l': 1 / 2.496},
+     ('25 hydroxy vitamin d', '25 oh vitamin d', 'vitamin d 25 hydroxy', 'vitamin d total', 'total vitamin d',
+      'vitamin d', 'vit d', '25 oh vit d', 'vitamin d3', '25 hydroxycholecalciferol')),
+    ('blood_test', 'thyroid_profile.thyroid_t3', 'ng/ml', {'ng/dl': 0.01, 'nmol/l': 0.651},
+     ('t3', 't3 total', 'total t3', 'triiodothyronine', 'triiodothyronine t3', 'total triiodothyronine')),
+    ('blood_test', 'thyroid_profile.thyroid_t4', 'ug/dl', {'nmol/l': 1 / 12.87, 'ng/ml': 0.1},
+     ('t4', 't4 total', 'total t4', 'thyroxine', 'thyroxine t4', 'total thyroxine')),
+    ('blood_test', 'thyroid_profile.thyroid_tsh', 'uiu/ml', {'miu/l': 1, 'miu/ml': 1000},
+     ('tsh', 'thyroid stimulating hormone', 'thyroid stimulating hormone tsh', 'tsh ultrasensitive',
+      'ultrasensitive tsh', 'tsh 3rd generation')),
+    # LipidProfile
+    ('lipid_profile', 'total_cholesterol', 'mg/dl', {'mmol/l': 38.67},
+     ('total cholesterol', 'cholesterol', 'cholesterol total')),
+    ('lipid_profile', 'hdl_cholesterol', 'mg/dl', {'mmol/l': 38.67},
+     ('hdl', 'hdl cholesterol', 'hdl cholesterol direct', 'hdl c')),
+    ('lipid_profile', 'ldl_cholesterol', 'mg/dl', {'mmol/l': 38.67},
+     ('ldl', 'ldl cholesterol', 'ldl cholesterol direct', 'ldl c', 'ldl cholesterol calculated')),
+    ('lipid_profile', 'vldl_cholesterol', 'mg/dl', {'mmol/l': 38.67},
+     ('vldl', 'vldl cholesterol', 'vldl c', 'vldl cholesterol calculated')),
+    ('lipid_profile', 'triglycerides', 'mg/dl', {'mmol/l': 88.57}, ('triglycerides', 'triglyceride', 'tg')),
+    ('lipid_profile', 'chol_hdl_ratio', '', {},
+     ('total cholesterol hdl ratio', 'chol hdl ratio', 'cholesterol hdl ratio', 'tc hdl ratio', 'total cholesterol hdl cholesterol ratio')),
+    ('lipid_profile', 'ldl_hdl_ratio', '', {}, ('ldl hdl ratio', 'ldl cholesterol hdl cholesterol ratio', 'ldl c hdl c ratio')),
+    # LiverFunctionTest
+    ('liver_function', 'total_bilirubin', 'mg/dl', {'umol/l': 1 / 17.1}, ('total bilirubin', 'bilirubin total', 'bilirubin')),
+    ('liver_function', 'direct_bilirubin', 'mg/dl', {'umol/l': 1 / 17.1},
+     ('direct bilirubin', 'bilirubin direct', 'conjugated bilirubin', 'bilirubin conjugated')),
+    ('liver_function', 'indirect_bilirubin', 'mg/dl', {'umol/l': 1 / 17.1},
+     ('indirect bilirubin', 'bilirubin indirect', 'unconjugated bilirubin', 'bilirubin unconjugated')),
+    ('liver_function', 'alt', 'u/l', {}, ('alt', 'sgpt', 'alt sgpt', 'alanine aminotransferase', 'alanine transaminase')),
+    ('liver_function', 'ast', 'u/l', {}, ('ast', 'sgot', 'ast sgot', 'aspartate aminotransferase', 'aspartate transaminase')),
+    ('liver_function', 'alp', 'u/l', {}, ('alp', 'alkaline phosphatase')),
+    ('liver_function', 'gamma_gt', 'u/l', {}, ('gamma gt', 'ggt', 'ggtp', 'gamma glutamyl transferase', 'gamma glutamyl transpeptidase')),
+    ('liver_function', 'total_protein', 'g/dl', {'g/l': 0.1}, ('total protein', 'protein total', 'total proteins')),
+    ('liver_function', 'albumin', 'g/dl', {'g/l': 0.1}, ('albumin',)),
+    ('liver_function', 'globulin', 'g/dl', {'g/l': 0.1}, ('globulin',)),
+    ('liver_function', 'a_g_ratio', '', {}, ('a g ratio', 'albumin globulin ratio', 'ag ratio')),
+    ('liver_function', 'ast_alt_ratio', '', {}, ('ast alt ratio', 'sgot sgpt ratio', 'de ritis ratio')),
+    ('liver_function', 'phosphorus_serum.phosphorus', 'mg/dl', {'mmol/l': 3.097},
+     ('phosphorus', 'phosphorous', 'inorganic phosphorus')),
+    ('liver_function', 'transferrin_saturation.transferrin_saturation_index', '%', {},
+     ('transferrin saturation', 'transferrin saturation index', 'tsat', '% saturation')),
+    # BloodUreaNitrogenTest
+    ('bun_test', 'blood_urea_nitrogen.urea', 'mg/dl', {'mmol/l': 6.006}, ('urea', 'blood urea')),
+    # BUN only counts the urea's nitrogen: mg/dL of urea = BUN mg/dL x 2.14
+    ('bun_test', 'blood_urea_nitrogen.urea', 'mg/dl', {}, ('blood urea nitrogen', 'bun', 'urea nitrogen'), 2.14),
+    ('bun_test', 'calcium_serum.calcium', 'mg/dl', {'mmol/l': 4.008}, ('calcium', 'calcium total', 'total calcium')),
+    ('bun_test', 'creatinine_serum.creatinine', 'mg/dl', {'umol/l': 1 / 88.4}, ('creatinine',)),
+    ('bun_test', 'glycosylated_hemoglobin.glycosylated_hemoglobin', '%', {},
+     ('hba1c', 'glycosylated hemoglobin', 'glycated hemoglobin', 'glycosylated haemoglobin', 'hb a1c')),
+    ('bun_test', 'glycosylated_hemoglobin.estimated_average_glucose', 'mg/dl', {'mmol/l': 18.016},
+     ('estimated average glucose', 'eag', 'mean blood glucose')),
+    ('bun_test', 'vitamin_b12.vitamin_b12', 'pg/ml', {'pmol/l': 1.355}, ('vitamin b12', 'vit b12', 'cyanocobalamin', 'cobalamin')),
+    ('bun_test', 'electrolytes_serum.sodium', 'mmol/l', {'meq/l': 1}, ('sodium', 'na', 'na+')),
+    ('bun_test', 'electrolytes_serum.potassium', 'mmol/l', {'meq/l': 1}, ('potassium', 'k', 'k+')),
+    ('bun_test', 'electrolytes_serum.chloride', 'mmol/l', {'meq/l': 1}, ('chloride', 'cl', 'cl-')),
+    ('bun_test', 'ferritin.ferritin', 'ng/ml', {'ug/l': 1}, ('ferritin',)),
+    ('bun_test', 'iron_with_tibc.iron', 'ug/dl', {'umol/l': 5.585}, ('iron', 'serum iron', 'iron total')),
+    ('bun_test', 'iron_with_tibc.tibc', 'ug/dl', {'umol/l': 5.585}, ('tibc', 'total iron binding capacity')),
+    # ErythrocyteSedimentationRate: hemogram
+    ('esr', 'hemogram.hemoglobin', 'g/dl', {'g/l': 0.1}, ('hemoglobin', 'haemoglobin', 'hb', 'hgb')),
+    ('esr', 'hemogram.pcv_hct', '%', {}, ('pcv', 'hct', 'hematocrit', 'haematocrit', 'packed cell volume', 'pcv hct')),
+    ('esr', 'hemogram.total_rbc_count', '10^6/ul', {},
+     ('total rbc count', 'rbc count', 'rbc', 'red blood cell count', 'red blood cells', 'erythrocyte count')),
+    ('esr', 'hemogram.mcv', 'fl', {}, ('mcv', 'mean corpuscular volume')),
+    ('esr', 'hemogram.mch', 'pg', {}, ('mch', 'mean corpuscular hemoglobin', 'mean corpuscular haemoglobin')),
+    ('esr', 'hemogram.mchc', 'g/dl', {'g/l': 0.1},
+     ('mchc', 'mean corpuscular hemoglobin concentration', 'mean corpuscular haemoglobin concentration')),
+    ('esr', 'hemogram.rdw_cv', '%', {}, ('rdw cv', 'rdw', 'red cell distribution width')),
+    ('esr', 'hemogram.mpv', 'fl', {}, ('mpv', 'mean platelet volume')),
+    ('esr', 'hemogram.total_wbc_count', '/ul', {'10^3/ul': 1000},
+     ('total wbc count', 'wbc count', 'wbc', 'total leucocyte count', 'total leukocyte count', 'tlc', 'white blood cells')),
+    ('esr', 'hemogram.platelet_count', '10^3/ul', {'/ul': 0.001, 'lakh/ul': 100},
+     ('platelet count', 'platelets', 'plt', 'platelet')),
+    ('esr', 'hemogram.neutrophils', '%', {}, ('neutrophils', 'neutrophil', 'polymorphs')),
+    ('esr', 'hemogram.lymphocytes', '%', {}, ('lymphocytes', 'lymphocyte')),
+    ('esr', 'hemogram.eosinophils', '%', {}, ('eosinophils', 'eosinophil')),
+    ('esr', 'hemogram.monocytes', '%', {}, ('monocytes', 'monocyte')),
+    ('esr', 'hemogram.basophils', '%', {}, ('basophils', 'basophil')),
+    ('esr', 'hemogram.absolute_neutrophil_count', '/ul', {'10^3/ul': 1000},
+     ('absolute neutrophil count', 'anc', 'neutrophils absolute', 'absolute neutrophils', 'neutrophils', 'polymorphs')),
+    ('esr', 'hemogram.absolute_lymphocyte_count', '/ul', {'10^3/ul': 1000},
+     ('absolute lymphocyte count', 'alc', 'lymphocytes absolute', 'absolute lymphocytes', 'lymphocytes')),
+    ('esr', 'hemogram.absolute_eosinophil_count', '/ul', {'10^3/ul': 1000},
+     ('absolute eosinophil count', 'aec', 'eosinophils absolute', 'absolute eosinophils', 'eosinophils')),
+    ('esr', 'hemogram.absolute_monocyte_count', '/ul', {'10^3/ul': 1000},
+     ('absolute monocyte count', 'amc', 'monocytes absolute', 'absolute monocytes', 'monocytes')),
+    ('esr', 'hemogram.absolute_basophil_count', '/ul', {'10^3/ul': 1000},
+     ('absolute basophil count', 'abc', 'basophils absolute', 'absolute basophils', 'basophils')),
+    ('esr', 'hemogram.neutrophil_lymphocyte_ratio', '', {}, ('neutrophil lymphocyte ratio', 'nlr')),
+    ('esr', 'peripheral_blood_smear.rbc', None, {}, ('rbc', 'rbc morphology', 'red blood cells')),
+    ('esr', 'peripheral_blood_smear.wbc', None, {}, ('wbc', 'wbc morphology', 'white blood cells')),
+    ('esr', 'peripheral_blood_smear.platelets', None, {}, ('platelets', 'platelet morphology')),
+    # CompleteUrineExamination
+    ('urine_examination', 'physical_examination.colour', None, {}, ('colour', 'color')),
+    ('urine_examination', 'physical_examination.appearance', None, {}, ('appearance', 'transparency', 'clarity')),
+    ('urine_examination', 'chemical_examination.reaction_and_ph', None, {}, ('reaction and ph', 'reaction', 'ph', 'reaction ph')),
+    ('urine_examination', 'chemical_examination.specific_gravity', None, {}, ('specific gravity', 'sp gravity')),
+    ('urine_examination', 'chemical_examination.protein', None, {}, ('protein', 'albumin', 'urine protein', 'urine albumin')),
+    ('urine_examination', 'chemical_examination.glucose', None, {}, ('glucose', 'sugar', 'urine glucose', 'urine sugar')),
+    ('urine_examination', 'chemical_examination.blood', None, {}, ('blood', 'occult blood')),
+    ('urine_examination', 'chemical_examination.ketones', None, {}, ('ketones', 'ketone bodies', 'acetone')),
+    ('urine_examination', 'chemical_examination.bilirubin', None, {}, ('bilirubin', 'bile pigments')),
+    ('urine_examination', 'chemical_examination.leucocytes', None, {}, ('leucocytes', 'leukocytes', 'leucocyte esterase')),
+    ('urine_examination', 'chemical_examination.nitrites', None, {}, ('nitrites', 'nitrite')),
+    ('urine_examination', 'chemical_examination.urobilinogen', None, {}, ('urobilinogen',)),
+    ('urine_examination', 'microscopic_examination.pus_cells', None, {}, ('pus cells', 'wbc', 'leucocytes pus cells')),
+    ('urine_examination', 'microscopic_examination.epithelial_cells', None, {}, ('epithelial cells', 'epithelial cell')),
+    ('urine_examination', 'microscopic_examination.rbc', None, {}, ('rbc', 'red blood cells', 'rbcs')),
+    ('urine_examination', 'microscopic_examination.casts', None, {}, ('casts', 'cast')),
+    ('urine_examination', 'microscopic_examination.crystals', None, {}, ('crystals', 'crystal')),
+    ('urine_examination', 'microscopic_examination.others', None, {}, ('others', 'other findings', 'bacteria')),
+]
+
+# Fields only used when the section's department or test name mentions one of the words
+CONTEXTS = {
+    'urine_examination': ('urine', 'cue', 'urinalysis'),
+    'esr.peripheral_blood_smear': ('smear', 'peripheral', 'morphology'),
+}
+
+# Normalized spellings of the same unit
+UNIT_ALIASES = {
+    'gm/dl': 'g/dl', 'gms/dl': 'g/dl', 'g%': 'g/dl', 'gm%': 'g/dl', 'gms%': 'g/dl',
+    'mg%': 'mg/dl', 'mgs/dl': 'mg/dl',
+    'mcg/dl': 'ug/dl', 'mcg/l': 'ug/l', 'ng/l': 'pg/ml', 'mcg/ml': 'ug/ml',
+    'uiu/ml': 'uiu/ml', 'uu/ml': 'uiu/ml', 'miu/l': 'miu/l',
+    'iu/l': 'u/l', 'u/l': 'u/l', 'units/l': 'u/l',
+    'fl': 'fl', 'femtolitre': 'fl', 'femtoliter': 'fl', 'cu.microns': 'fl', 'cumicrons': 'fl',
+    'pg': 'pg', 'picograms': 'pg',
+    'percent': '%', '%': '%',
+    'million/ul': '10^6/ul', 'mill/ul': '10^6/ul', 'millions/ul': '10^6/ul', '10^6/ul': '10^6/ul', '10^12/l': '10^6/ul',
+    'thou/ul': '10^3/ul', 'thousand/ul': '10^3/ul', 'k/ul': '10^3/ul', '10^3/ul': '10^3/ul', '10^9/l': '10^3/ul',
+    'lakh/ul': 'lakh/ul', 'lakhs/ul': 'lakh/ul', 'lacs/ul': 'lakh/ul', 'lac/ul': 'lakh/ul',
+    'cells/ul': '/ul', '/ul': '/ul',
+}
+
+NAME_STOPWORDS = {'serum', 's', 'plasma', 'whole', 'blood'}
+FLAG_RE = re.compile(r'^(?:\(?(?:h|l|high|low|\*+)\)?\s*)+', re.IGNORECASE)
+NUMBER_RE = re.compile(r'^\s*([<>≤≥]=?)?\s*(-?\d[\d,]*(?:\.\d+)?|-?\.\d+)\s*(.*)$')
+INTERVAL_UNIT_RE = re.compile(r'\d\s*(?:-|–|to)\s*[\d.]+\s*([^\d\s].*)$|^[<>]=?\s*[\d.]+\s*([^\d\s].*)$')
+DATE_FORMATS = (
+    '%d/%m/%Y %I:%M %p', '%d/%m/%Y %H:%M', '%d/%m/%Y', '%d-%m-%Y %I:%M %p', '%d-%m-%Y %H:%M', '%d-%m-%Y',
+    '%d-%b-%Y %I:%M %p', '%d-%b-%Y %H:%M', '%d-%b-%Y', '%d %b %Y %I:%M %p', '%d %b %Y',
+)
+
+
+def normalize_name(name):
+    words = re.sub(r'[^a-z0-9%+]+', ' ', str(name or '').lower()).split()
+    return ' '.join(word for word in words if word not in NAME_STOPWORDS) or ' '.join(words)
+
+
+def normalize_unit(unit):
+    unit = str(unit or '').strip().lower().replace('µ', 'u').replace('μ', 'u').replace(' ', '')
+    unit = unit.replace('³', '^3').replace('⁶', '^6').replace('x10', '10').replace('10e', '10^')
+    unit = re.sub(r'(?:cumm|cu\.mm|mm3|mm\^3)$', 'ul', unit)
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def _context(panel_type, path):
+    return CONTEXTS.get(f'{panel_type}.{path.split(".")[0]}') or CONTEXTS.get(panel_type)
+
+
+def _build_index():
+    """{name key: [(panel type, path, unit, conversions, factor, context words)]}; contextual targets first."""
+    index = {}
+    for panel_type, path, unit, conversions, names, *factor in FIELDS:
+        target = (panel_type, path, unit, conversions, factor[0] if factor else 1, _context(panel_type, path))
+        for name in names:
+            normalized = normalize_name(name)
+            keys = {normalized}
+            if 'ratio' not in normalized.split():
+                keys.add(' '.join(sorted(normalized.split())))
+            for key in keys:
+                index.setdefault(key, []).append(target)
+    for targets in index.values():
+        targets.sort(key=lambda target: target[5] is None)
+    return index
+
+
+SYNONYM_INDEX = _build_index()
+
+
+def _name_keys(name):
+    """Lookup keys of a report name, most specific first: as written, without the parenthesized part, the parenthesized part."""
+    keys = []
+    for variant in (name, re.sub(r'\(.*?\)', ' ', name), ' '.join(re.findall(r'\((.*?)\)', name))):
+        normalized = normalize_name(variant)
+        if normalized:
+            keys += [normalized, ' '.join(sorted(normalized.split()))]
+    return keys
+
+
+def find_fields(name, section_text=''):
+    """
+    Candidate (panel type, path, unit, conversions, factor) of a report investigation
+    name, best first: the same name may be a percentage or an absolute count,
+    and the unit read decides.
+    """
+    section_text = section_text.lower()
+    candidates = []
+    for key in _name_keys(name):
+        for panel_type, path, unit, conversions, factor, context in SYNONYM_INDEX.get(key, ()):
+            target = (panel_type, path, unit, conversions, factor)
+            if target not in candidates and (context is None or any(word in section_text for word in context)):
+                candidates.append(target)
+    return candidates
+
+
+def convert_value(investigation, unit, conversions):
+    """(value in the stored unit, unit read) or raises ValueError with the reason."""
+    observed = str(investigation.get('observed_value') or '').strip()
+    if unit is None:
+        if not observed:
+            raise ValueError('No observed value.')
+        return observed, ''
+
+    match = NUMBER_RE.match(observed)
+    if not match:
+        raise ValueError(f'Not a number: {observed}')
+    if match.group(1):
+        raise ValueError(f'Censored value: {observed}')
+    value = float(match.group(2).replace(',', ''))
+    found = investigation.get('unit') or FLAG_RE.sub('', match.group(3)).strip()
+    if not found:
+        interval = INTERVAL_UNIT_RE.search(str(investigation.get('biological_reference_interval') or '').strip())
+        found = interval and (interval.group(1) or interval.group(2)) or ''
+    found = normalize_unit(found)
+
+    if not found or found == unit or not unit:
+        return value, found
+    if found in conversions:
+        return round(value * conversions[found], 4), found
+    raise ValueError(f'Unknown unit {found} for {unit or "a ratio"}.')
+
+
+def map_report(analysis):
+    """
+    Maps the investigations of an analysis to panel fields. Returns
+    {'panels': {panel type: record}, 'mapped': [...], 'unmapped': [...]};
+    records have embedded fields as nested dicts, and the first value of a
+    field wins when a report repeats it, unless it was derived (urea from BUN)
+    and a measured value follows.
+    """
+    panels, mapped, unmapped, seen = {}, [], [], {}
+    for section in analysis.get('test_sections') or []:
+        section_text = f"{section.get('department') or ''} {section.get('test_name') or ''}"
+        for investigation in section.get('investigations') or []:
+            name = str(investigation.get('name') or '').strip()
+            reason = 'Unknown investigation.'
+            for panel_type, path, unit, conversions, factor in find_fields(name, section_text):
+                previous = seen.get((panel_type, path))
+                if previous is not None and (factor != 1 or not previous[2]):
+                    reason = f'Duplicate of {panel_type}.{path}.'
+                    continue
+                try:
+                    value, found_unit = convert_value(investigation, unit, conversions)
+                    if factor != 1:
+                        value = round(value * factor, 4)
+                    break
+                except ValueError as exc:
+                    reason = str(exc)
+            else:
+                unmapped.append({'name': name, 'observed_value': investigation.get('observed_value'), 'reason': reason})
+                continue
+
+            if (panel_type, path) in seen:
+                replaced, observed_value, _ = seen[(panel_type, path)]
+                mapped.remove(replaced)
+                unmapped.append({'name': replaced['name'], 'observed_value': observed_value,
+                                 'reason': f'Replaced by the measured {panel_type}.{path}.'})
+            record = panels.setdefault(panel_type, {})
+            *parents, field = path.split('.')
+            for parent in parents:
+                record = record.setdefault(parent, {})
+            record[field] = value
+            entry = {'name': name, 'panel_type': panel_type, 'field': path, 'value': value, 'unit': unit or found_unit}
+            seen[(panel_type, path)] = (entry, investigation.get('observed_value'), factor != 1)
+            mapped.append(entry)
+    return {'panels': panels, 'mapped': mapped, 'unmapped': unmapped}
+
+
+def report_date(analysis):
+    """When the samples were collected (or the report issued), or None."""
+    details = analysis.get('patient_details') or {}
+    for key in ('collected_on', 'reported_on', 'registered_on'):
+        text = re.sub(r'\s+', ' ', str(details.get(key) or '')).strip()
+        try:
+            date = datetime.datetime.fromisoformat(text)
+        except ValueError:
+            pass
+        else:
+            # Stored like every datetime here: naive UTC
+            if date.tzinfo is not None:
+                date = date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return date
+        for date_format in DATE_FORMATS:
+            try:
+                return datetime.datetime.strptime(text, date_format)
+            except ValueError:
+                continue
+    return None
+
+
+def ingest_report(analysis, user_id, dietician_id=None, dry_run=False, skip_panels=()):
+    """
+    Writes the panels mapped from an analysis for a user, dated like the
+    report (created_at, and date for blood tests) so that an old report does
+    not become the latest record. Every panel record is validated first and
+    nothing is written if one of them is invalid; then each panel is inserted
+    with the bulk path, which also updates the snapshot and the read cache.
+    Panels in skip_panels, written by an earlier call, are left out. Returns
+    the mapping with 'created' ({panel type: id}) and 'errors' ({panel type: errors}).
+    """
+    mapping = map_report(analysis)
+    date = (report_date(analysis) or datetime.datetime.utcnow()).isoformat()
+    validated, errors = {}, {}
+    for panel_type, record in mapping['panels'].items():
+        if panel_type in skip_panels:
+            continue
+        row = dict(record, user_id=user_id, created_at=date)
+        if dietician_id is not None:
+            row['dietician_id'] = dietician_id
+        if panel_type == 'blood_test':
+            row['date'] = date
+        results, valid = validate_rows(panel_type, [row])
+        if valid:
+            validated[panel_type] = (results, valid)
+        else:
+            errors[panel_type] = results[0]['errors']
+
+    created = {}
+    if not errors and not dry_run:
+        for panel_type, (results, valid) in validated.items():
+            result = insert_rows(panel_type, results, valid, with_data=False)[0]
+            if result['status'] == 'created':
+                created[panel_type] = result['id']
+            else:
+                errors[panel_type] = result['errors']
+    return dict(mapping, created=created, errors=errors)
@@ -0,0 +1,346 @@
+"""
+Rule-based parser of lab reports with a known results layout.
+
+Most reports put their results under an "Investigation / Observed Value /
+(Unit) / Biological Reference Interval" header, either as a ruled table
+(found by pdfplumber) or as aligned text lines. A template names the header
+of each column; the parser finds that header on each page, reads the rows
+under it and builds the same JSON as the LLM prompt asks for.
+
+The result is only trusted when the rows it understood cover at least
+MIN_TEMPLATE_COVERAGE of the result-like rows of the report; otherwise the
+analyzer falls back to the LLM. Outcomes are counted in ReportParserStats.
+"""
+import datetime
+import os
+import re
+
+from pymongo import UpdateOne
+
+from health.models import ReportParserStats
+
+MIN_TEMPLATE_COVERAGE = float(os.getenv('REPORT_TEMPLATE_MIN_COVERAGE', '0.9'))
+
+# Column headers of each known layout, by field of the investigation
+TEMPLATES = [
+    {
+        'name': 'investigation_observed_value',
+        'columns': {
+            'name': ('investigation', 'investigations', 'test description'),
+            'observed_value': ('observed value', 'observed values'),
+            'unit': ('unit', 'units'),
+            'biological_reference_interval': (
+                'biological reference interval', 'biological ref interval', 'bio ref interval',
+                'biological reference range', 'reference interval',
+            ),
+            'method': ('method',),
+        },
+    },
+    {
+        'name': 'test_result_range',
+        'columns': {
+            'name': ('test', 'test name', 'parameter', 'parameters'),
+            'observed_value': ('result', 'results', 'value'),
+            'unit': ('unit', 'units'),
+            'biological_reference_interval': ('reference range', 'normal range', 'ref range', 'normal values'),
+            'method': ('method',),
+        },
+    },
+]
+REQUIRED_COLUMNS = ('name', 'observed_value', 'biological_reference_interval')
+
+PATIENT_LABELS = {
+    'name': ('patient name', 'name'),
+    'age_gender': ('age / gender', 'age/gender', 'age / sex', 'age/sex', 'age'),
+    'registered_by': ('registered by', 'referred by', 'ref. by', 'ref by'),
+    'reg_no': ('reg. no', 'reg no', 'registration no', 'umr no', 'uhid'),
+    'tid_sid': ('tid/sid', 'tid / sid', 'sid', 'sample id'),
+    'registered_on': ('registered on', 'registration date', 'reg. date'),
+    'collected_on': ('collected on', 'collection date', 'sample collected on'),
+    'reported_on': ('reported on', 'report date'),
+    'reference': ('reference', 'ref. lab'),
+}
+
+VALUE_RE = re.compile(
+    r'^(?:[<>]=?\s*)?-?\d+(?:[.,]\d+)*$|^(?:positive|negative|nil|absent|present|reactive|non-reactive|'
+    r'normal|trace|clear|pale yellow|yellow|detected|not detected)$',
+    re.IGNORECASE,
+)
+# The reference interval ending a text row
+INTERVAL_TAIL_RE = re.compile(
+    r'(?:^|\s)(?:-?\d+(?:\.\d+)?\s*(?:-|–|to)\s*-?\d+(?:\.\d+)?|(?:[<>≤≥]=?|up\s*to)\s*\d+(?:\.\d+)?|'
+    r'negative|positive|nil|absent|non-reactive|reactive|not detected)$',
+    re.IGNORECASE,
+)
+# Abnormal value flags printed next to the value
+FLAG_RE = re.compile(r'^(?:\(?[HL]\)?|high|low|\*+)$', re.IGNORECASE)
+DEPARTMENT_RE = re.compile(r'^department of .+$', re.IGNORECASE | re.MULTILINE)
+# Lines that end a block of results
+END_RE = re.compile(r'^(?:interpretation|note|comments?|remarks?|\*+\s*end of report)\b', re.IGNORECASE)
+
+
+def _normalize(text):
+    return re.sub(r'[^a-z0-9/ ]+', '', re.sub(r'\s+', ' ', str(text or '').lower())).strip()
+
+
+def _clean(text):
+    return re.sub(r'\s+', ' ', str(text or '')).strip()
+
+
+def _header_columns(cells):
+    """(template, {field: cell index}) of the first template matching a header row, or (None, None)."""
+    normalized = [_normalize(cell) for cell in cells]
+    for template in TEMPLATES:
+        positions = {}
+        for field, aliases in template['columns'].items():
+            for index, cell in enumerate(normalized):
+                if cell in aliases and index not in positions.values():
+                    positions[field] = index
+                    break
+        if all(field in positions for field in REQUIRED_COLUMNS):
+            return template, positions
+    return None, None
+
+
+def _text_header(line):
+    """(template, ordered fields) when a text line is a header: the column names, in order, and nothing else."""
+    rest = _normalize(line)
+    for template in TEMPLATES:
+        fields, remaining = [], rest
+        while remaining:
+            # Longest alias first so that "test name" wins over "test"
+            match = max(
+                ((field, alias) for field, aliases in template['columns'].items() if field not in fields
+                 for alias in aliases if remaining == alias or remaining.startswith(alias + ' ')),
+                key=lambda pair: len(pair[1]), default=None,
+            )
+            if match is None:
+                break
+            fields.append(match[0])
+            remaining = remaining[len(match[1]):].strip()
+        if not remaining and all(field in fields for field in REQUIRED_COLUMNS):
+            return template, fields
+    return None, None
+
+
+def _split_text_row(line):
+    """
+    Investigation of a text row, or None. The row is read from its end, since
+    names may hold numbers ("Vitamin D 25 OH", "CA 125"): a reference interval,
+    an optional unit, the value (optionally flagged H or L) and the name
+    before it. Rows whose end is not exactly that are not understood.
+    """
+    interval = INTERVAL_TAIL_RE.search(line)
+    if not interval:
+        return None
+    words = line[:interval.start()].split()
+    unit = ''
+    if words and not VALUE_RE.match(words[-1]) and not FLAG_RE.match(words[-1]):
+        unit = words.pop()
+    if words and FLAG_RE.match(words[-1]):
+        words.pop()
+    # Qualitative values may be two words ("Not Detected", "Pale Yellow")
+    for size in (2, 1):
+        value = ' '.join(words[-size:])
+        if len(words) > size and VALUE_RE.match(value):
+            name = words[:-size]
+            if FLAG_RE.match(name[-1]) and len(name) > 1:
+                name = name[:-1]
+            return {
+                'name': ' '.join(name).rstrip(':'),
+                'observed_value': value,
+                'unit': unit,
+                'biological_reference_interval': interval.group(0).strip(),
+                'method': '',
+            }
+    return None
+
+
+def _is_result_like(line):
+    """Whether a line looks like an investigation (a value then a reference interval) under any layout."""
+    return ':' not in line and _split_text_row(line) is not None
+
+
+class _Sections:
+    """Groups investigations into test sections per page, department and test name."""
+
+    def __init__(self):
+        self.sections = []
+
+    def add(self, page_number, department, test_name, investigation):
+        key = (page_number, department, test_name)
+        if not self.sections or self.sections[-1]['_key'] != key:
+            self.sections.append({
+                '_key': key, 'department': department or '', 'test_name': test_name or '',
+                'investigations': [], 'interpretation': '', 'doctor_name': '', 'doctor_designation': '',
+                'page_number': page_number,
+            })
+        self.sections[-1]['investigations'].append(investigation)
+
+    def add_method(self, method):
+        if self.sections and self.sections[-1]['investigations']:
+            self.sections[-1]['investigations'][-1]['method'] = method
+
+    def result(self):
+        return [{key: value for key, value in section.items() if key != '_key'} for section in self.sections]
+
+
+def _investigation(row):
+    investigation = {
+        'name': row['name'],
+        'observed_value': row['observed_value'],
+        'biological_reference_interval': row['biological_reference_interval'],
+        'method': row.get('method', ''),
+    }
+    if row.get('unit'):
+        investigation['unit'] = row['unit']
+    return investigation
+
+
+def _parse_table(table, page_number, department, sections, counts):
+    """Parses a pdfplumber table; returns the template name if its header matched."""
+    header_index, template, positions = None, None, None
+    for index, row in enumerate(table):
+        template, positions = _header_columns(row)
+        if template:
+            header_index = index
+            break
+    if template is None:
+        return None
+
+    test_name = ''
+    for row in table[header_index + 1:]:
+        cells = {field: _clean(row[index]) if index < len(row) else '' for field, index in positions.items()}
+        filled = [cell for cell in row if _clean(cell)]
+        if not filled:
+            continue
+        if cells['name'].lower().startswith('method') and not cells['observed_value']:
+            sections.add_method(_clean(cells['name'].partition(':')[2] or cells['name'][6:]))
+            continue
+        if len(filled) == 1 and cells['name']:
+            test_name = cells['name']
+            continue
+        counts['candidates'] += 1
+        if cells['name'] and cells['observed_value']:
+            counts['parsed'] += 1
+            sections.add(page_number, department, test_name, _investigation(cells))
+    return template['name']
+
+
+def _parse_text(text, page_number, sections, counts):
+    """Parses the results blocks of a page's text; returns the names of the templates found."""
+    template_names, fields = set(), None
+    department, test_name, previous = '', '', ''
+    for line in (line.strip() for line in text.splitlines()):
+        if not line:
+            continue
+        if DEPARTMENT_RE.match(line):
+            department, fields = line, None
+            continue
+        template, header_fields = _text_header(line)
+        if template:
+            template_names.add(template['name'])
+            fields = header_fields
+            # The line above the header names the test, unless it is a label or a result
+            if previous and ':' not in previous and not _is_result_like(previous):
+                test_name = previous
+            continue
+        previous = line
+        if fields is None:
+            # Outside a known block: results here would be missed
+            if _is_result_like(line):
+                counts['candidates'] += 1
+            continue
+        if END_RE.match(line):
+            fields = None
+            continue
+        if line.lower().startswith('method'):
+            sections.add_method(_clean(line.partition(':')[2] or line[6:]))
+            continue
+        if not any(char.isdigit() for char in line) and not _split_text_row(line):
+            test_name = line
+            continue
+        if ':' in line:
+            continue
+        counts['candidates'] += 1
+        row = _split_text_row(line)
+        if row:
+            counts['parsed'] += 1
+            sections.add(page_number, department, test_name, _investigation(row))
+    return template_names
+
+
+# A value ends at the next known label
+_NEXT_LABEL = '|'.join(re.escape(label) for labels in PATIENT_LABELS.values() for label in labels)
+
+
+def _label_value(text, labels):
+    for label in labels:
+        match = re.search(
+            rf'(?:^|\s){re.escape(label)}\s*[:\-]\s*(.+?)(?=\s+(?:{_NEXT_LABEL})\s*[:\-]|$)',
+            text, re.IGNORECASE | re.MULTILINE,
+        )
+        if match:
+            return _clean(match.group(1))
+    return None
+
+
+def patient_details(text):
+    return {field: _label_value(text, labels) for field, labels in PATIENT_LABELS.items()}
+
+
+def parse_report(pages):
+    """
+    Parses the pages of utils.pdf_extraction.extract_pages. Returns
+    (analysis, info): analysis has the LLM's output format, or is None when
+    no template matched or the coverage is below MIN_TEMPLATE_COVERAGE; info
+    holds the templates found, the coverage and the row counts.
+    """
+    sections = _Sections()
+    counts = {'candidates': 0, 'parsed': 0}
+    templates = set()
+    for page in pages:
+        departments = DEPARTMENT_RE.findall(page['text'])
+        matched = [
+            _parse_table(table, page['page'], _clean(departments[0]) if departments else '', sections, counts)
+            for table in page['tables']
+        ]
+        matched = [name for name in matched if name]
+        if matched:
+            templates.update(matched)
+        else:
+            templates.update(_parse_text(page['text'], page['page'], sections, counts))
+
+    coverage = counts['parsed'] / counts['candidates'] if counts['candidates'] else 0.0
+    info = {'templates': sorted(templates), 'coverage': round(coverage, 3), **counts}
+    if not templates or not counts['parsed'] or coverage < MIN_TEMPLATE_COVERAGE:
+        return None, info
+
+    first_text = pages[0]['text'] if pages else ''
+    return {'patient_details': patient_details(first_text), 'test_sections': sections.result()}, info
+
+
+def record_outcome(info, fast_path):
+    """Counts a parsed report: by template on the fast path, or by reason when it fell back to the LLM."""
+    if fast_path:
+        keys = ['reports', 'fast_path'] + [f'template:{name}' for name in info['templates']]
+    else:
+        keys = ['reports', 'llm', 'fallback:low_coverage' if info['templates'] else 'fallback:unknown_layout']
+    now = datetime.datetime.utcnow()
+    ReportParserStats._get_collection().bulk_write([
+        UpdateOne({'_id': key}, {'$inc': {'count': 1}, '$set': {'last_at': now}}, upsert=True) for key in keys
+    ], ordered=False)
+
+
+def parser_stats():
+    """Share of the analyzed reports that took the template fast path, with counts per template and fallback reason."""
+    counts = {doc['_id']: doc.get('count', 0) for doc in ReportParserStats._get_collection().find()}
+    reports = counts.get('reports', 0)
+    return {
+        'reports': reports,
+        'fast_path': counts.get('fast_path', 0),
+        'llm': counts.get('llm', 0),
+        'fast_path_ratio': round(counts.get('fast_path', 0) / reports, 3) if reports else None,
+        'templates': {key[9:]: value for key, value in counts.items() if key.startswith('template:')},
+        'fallbacks': {key[9:]: value for key, value in counts.items() if key.startswith('fallback:')},
+    }
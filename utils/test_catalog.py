@@ -0,0 +1,139 @@
+"""
+In-process cache of the test catalog (tests and categories).
+
+Every process keeps an immutable snapshot of the catalog, serialized once,
+and swaps in a new one when the catalog version stored in Mongo changes. The
+version is bumped by every test/category write and polled at most every
+CATALOG_CHECK_INTERVAL seconds, so a read costs a dict lookup, plus one tiny
+query per interval.
+"""
+import datetime
+import os
+import threading
+import time
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from rest_framework.renderers import JSONRenderer
+
+from health.models import CatalogVersion, Category, Test
+from health.raw_serializers import raw_serialize
+from health.serializers import CategorySerializer, TestSerializer
+from utils.test_search import TestSearchIndex, text_search
+
+CATALOG_NAME = 'tests'
+CATALOG_CHECK_INTERVAL = float(os.getenv('CATALOG_CHECK_INTERVAL', '2'))
+
+
+def _version_document():
+    return CatalogVersion._get_collection().find_one({'_id': CATALOG_NAME}) or {}
+
+
+def get_catalog_version():
+    return _version_document().get('version', 0)
+
+
+def bump_catalog_version():
+    """Marks the catalog as changed for every process. Call after any test or category write."""
+    doc = CatalogVersion._get_collection().find_one_and_update(
+        {'_id': CATALOG_NAME},
+        {'$inc': {'version': 1}, '$set': {'updated_at': datetime.datetime.utcnow()}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    # Reload this process's catalog on its next read
+    _state['checked_at'] = 0
+    return doc['version']
+
+
+class TestCatalog:
+    """An immutable, fully serialized snapshot of the tests and categories."""
+
+    def __init__(self, version, tests, categories, updated_at=None):
+        self.version = version
+        # Time of the last catalog write, for Last-Modified
+        self.updated_at = updated_at
+        renderer = JSONRenderer()
+
+        # Raw documents, used e.g. to build cart items
+        self.raw_tests = {str(test['_id']): test for test in tests}
+        self.tests = {test_id: raw_serialize(TestSerializer, test) for test_id, test in self.raw_tests.items()}
+        self.test_ids = list(self.tests)
+
+        self.tests_by_category = {}
+        for test_id, test in self.raw_tests.items():
+            category = test.get('category')
+            if category is not None:
+                self.tests_by_category.setdefault(str(getattr(category, 'id', category)), []).append(test_id)
+
+        self.categories = [raw_serialize(CategorySerializer, category) for category in categories]
+        self.search_index = TestSearchIndex(self.raw_tests)
+
+        # Response bodies as the JSON renderer would produce them
+        self.list_json = renderer.render(self.list_tests())
+        self.category_list_json = renderer.render(self.categories)
+        self.list_json_by_category = {
+            category: renderer.render(self.list_tests(category)) for category in self.tests_by_category
+        }
+        self.empty_list_json = renderer.render([])
+
+    @classmethod
+    def load(cls):
+        # Read the version first: a write racing with the load bumps it again and triggers another reload
+        version = _version_document()
+        tests = list(Test.objects.as_pymongo())
+        categories = list(Category.objects.as_pymongo())
+        return cls(version.get('version', 0), tests, categories, version.get('updated_at'))
+
+    def list_tests(self, category=None):
+        test_ids = self.tests_by_category.get(str(category), []) if category else self.test_ids
+        return [self.tests[test_id] for test_id in test_ids]
+
+    def list_json_for(self, category=None):
+        if not category:
+            return self.list_json
+        return self.list_json_by_category.get(str(category), self.empty_list_json)
+
+    def search(self, query):
+        """
+        Serialized tests matching query, best first: prefix matches on test and
+        parameter names, or the Mongo full-text search (which also covers the
+        FAQs) when nothing matches by prefix.
+        """
+        test_ids = self.search_index.search(query)
+        if not test_ids and query.strip():
+            test_ids = [test_id for test_id in text_search(query) if test_id in self.tests]
+        return [self.tests[test_id] for test_id in test_ids]
+
+    def get_test(self, test_id):
+        return self.tests.get(str(test_id))
+
+    def get_raw_test(self, test_id):
+        return self.raw_tests.get(str(test_id))
+
+
+_state = {'catalog': None, 'checked_at': 0}
+_lock = threading.Lock()
+
+
+def get_catalog():
+    """Returns the current catalog, reloading it if the version in Mongo moved on."""
+    catalog = _state['catalog']
+    if catalog is not None and time.monotonic() - _state['checked_at'] < CATALOG_CHECK_INTERVAL:
+        return catalog
+
+    with _lock:
+        catalog = _state['catalog']
+        if catalog is None or time.monotonic() - _state['checked_at'] >= CATALOG_CHECK_INTERVAL:
+            if catalog is None or get_catalog_version() != catalog.version:
+                catalog = TestCatalog.load()
+                _state['catalog'] = catalog
+            _state['checked_at'] = time.monotonic()
+    return catalog
+
+
+def find_raw_test(test_id):
+    """A raw Test document from the catalog, falling back to Mongo for tests created since the last reload."""
+    test = get_catalog().get_raw_test(test_id)
+    if test is None and ObjectId.is_valid(str(test_id)):
+        test = Test.objects(id=test_id).as_pymongo().first()
+    return test
@@ -1,69 +1,120 @@
-from google.generativeai import GenerativeModel
-import google.generativeai as genai
 import os
-import pdfplumber
-from io import BytesIO
 import json
+import time
 
-genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+from utils.pdf_extraction import extract_pages, render_pages
+from utils.report_cache import get_cached, pdf_digest, set_cached
+from utils.report_templates import parse_report, record_outcome
 
-client = genai.GenerativeModel("gemini-1.5-flash")  # Or 
+MODEL_NAME = "gemini-1.5-flash"
+LLM_TIMEOUT = int(os.environ.get('REPORT_LLM_TIMEOUT', '600'))
+# Part of the cache keys of the analyses: bump PROMPT_VERSION whenever the
+# prompt changes, and EXTRACTION_VERSION whenever the extracted pages do
+EXTRACTION_VERSION = 1
+PROMPT_VERSION = 1
+# Reports with a known results layout are parsed by utils.report_templates without the LLM
+USE_TEMPLATE_PARSER = os.environ.get('REPORT_TEMPLATE_PARSER', '1') != '0'
 
-actual_filename = "C:\\Users\\Asus\\Desktop\\GIT REPO HEALTH\\HealthSync-backend\\report analyzer\\UMR3110365.pdf"
 
-uploaded_file = genai.upload_file(
-    path=actual_filename,
-    display_name="My Medical Report", # Optional: give it a friendly name
-    mime_type='application/pdf'
-)
+# -------------------------
+# LLM clients
+# -------------------------
+# A client turns the prompt (and the report itself) into the model's text
+# response; it raises on transport errors and timeouts so that callers can retry.
+class LLMClient:
+    name = None
+
+    def generate(self, prompt: str, pdf_content_bytes: bytes) -> str:
+        raise NotImplementedError
+
+
+class GeminiClient(LLMClient):
+    name = MODEL_NAME
+
+    def __init__(self, model_name=MODEL_NAME, timeout=LLM_TIMEOUT):
+        self.name = model_name
+        self.timeout = timeout
+        self._model = None
+
+    def _get_model(self):
+        if self._model is None:
+            # Imported and configured on first use, not when the module is imported
+            import google.generativeai as genai
+            genai.configure(api_key=os.environ.get('GEMINI_API_KEY'))
+            self._model = genai.GenerativeModel(self.name)
+        return self._model
+
+    def generate(self, prompt, pdf_content_bytes):
+        report = {"mime_type": "application/pdf", "data": pdf_content_bytes}
+        response = self._get_model().generate_content(
+            contents=[report, prompt], request_options={"timeout": self.timeout}
+        )
+        return response.text if response else ""
+
+
+class FakeLLMClient(LLMClient):
+    """
+    Stand-in model for tests and benchmarks: answers after `delay` seconds with
+    `response` (by default an empty report skeleton), after raising
+    ConnectionError on the first `failures` calls.
+    """
+    name = "fake"
+
+    def __init__(self, response=None, delay=0.0, failures=0):
+        self.response = response
+        self.delay = delay
+        self.failures = failures
+        self.calls = 0
+
+    def generate(self, prompt, pdf_content_bytes):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.calls <= self.failures:
+            raise ConnectionError("Fake LLM failure")
+        if self.response is not None:
+            return self.response
+        return json.dumps({"patient_details": {}, "test_sections": [], "prompt_characters": len(prompt)})
+
+
+LLM_CLIENTS = {
+    'gemini': GeminiClient,
+    'fake': FakeLLMClient,
+}
+_default_client = None
+
+
+def get_llm_client() -> LLMClient:
+    """The process wide client, chosen by REPORT_LLM_CLIENT (gemini by default)."""
+    global _default_client
+    if _default_client is None:
+        _default_client = LLM_CLIENTS[os.environ.get('REPORT_LLM_CLIENT', 'gemini')]()
+    return _default_client
+
+
+def set_llm_client(client: LLMClient):
+    global _default_client
+    _default_client = client
 
-print(f"Uploaded file name: {uploaded_file.name}")
-print(f"Uploaded file URI: {uploaded_file.uri}")
 
 def extract_text_from_pdf(pdf_content_bytes: bytes) -> str:
     """
     Extracts text from PDF bytes, attempting to preserve table structure.
+    Pages are extracted in parallel by utils.pdf_extraction.
     """
-    full_text = []
     try:
-        with pdfplumber.open(BytesIO(pdf_content_bytes)) as pdf:
-            for page_num, page in enumerate(pdf.pages):
-                full_text.append(f"\n--- PAGE {page_num + 1} ---\n")
-                
-                # Extract text
-                text = page.extract_text()
-                if text:
-                    full_text.append(text)
-                
-                # Attempt to extract tables and format them clearly
-                tables = page.extract_tables()
-                for table in tables:
-                    if table: # Ensure table is not empty
-                        full_text.append("\n--- TABLE START ---\n")
-                        for row in table:
-                            cleaned_row = [cell if cell is not None else "" for cell in row]
-                            full_text.append("\t".join(cleaned_row))
-                        full_text.append("\n--- TABLE END ---\n")
-            
-        return "\n".join(full_text)
+        return render_pages(extract_pages(pdf_content_bytes))
     except Exception as e:
         print(f"Error extracting text from PDF with pdfplumber: {e}")
         return f"Error: Could not extract text from PDF: {e}"
 
 
-def analyze_pdf_report(pdf_content_bytes: bytes, filename: str) -> dict:
+def _analyze_text(extracted_text: str, pdf_content_bytes: bytes, client: LLMClient, raise_errors: bool = False) -> dict:
     """
-    Analyzes a PDF medical report by first extracting text and then using Gemini
-    to extract key parameters in JSON format.
+    Uses the LLM to extract key parameters, in JSON format, from the text of a
+    report. With raise_errors, failures of the client itself (transport,
+    timeout) propagate instead of being returned as an error.
     """
-    if not filename.lower().endswith('.pdf'):
-        return {"error": "Unsupported file type. Only PDF files are supported for this analysis."}
-
-    extracted_text = extract_text_from_pdf(pdf_content_bytes)
-    
-    if extracted_text.startswith("Error:"):
-        return {"error": extracted_text}
-
     try:
         # --- MODIFIED PROMPT FOR BETTER JSON ADHERENCE ---
         prompt = f"""
@@ -111,40 +162,105 @@ def analyze_pdf_report(pdf_content_bytes: bytes, filename: str) -> dict:
         --- END OF EXTRACTED PDF TEXT ---
         """
 
-        response = client.generate_content(contents=[uploaded_file, prompt], request_options={"timeout": 600})
-        if response:
-            print(response.text)
-        else:
-            return {"error": "No response text from LLM."}
-
-        if response and response.text:
-            try:
-                # IMPORTANT: Strip leading/trailing whitespace to help with JSON parsing
-                llm_response_text = response.text.strip() 
-                
-                # Check if the response already starts and ends with JSON markers
-                if llm_response_text.startswith('{') and llm_response_text.endswith('}'):
-                    json_string = llm_response_text
-                else:
-                    # Fallback for cases where LLM might add preamble/postamble text
-                    json_start = llm_response_text.find('{')
-                    json_end = llm_response_text.rfind('}') + 1
-                    if json_start != -1 and json_end != -1:
-                        json_string = llm_response_text[json_start:json_end]
-                    else:
-                        return {"error": "Could not find a complete JSON object in the model's response.", "raw_response": llm_response_text}
-                        
-                return json.loads(json_string)
-            except json.JSONDecodeError as e:
-                return {"error": f"Failed to parse JSON from LLM response: {e}", "raw_response": llm_response_text}
-        else:
-            return {"error": "No response text from LLM."}
-
+        llm_response_text = client.generate(prompt, pdf_content_bytes)
     except Exception as e:
+        if raise_errors:
+            raise
         return {"error": f"An error occurred during LLM analysis: {e}"}
 
+    if not llm_response_text:
+        return {"error": "No response text from LLM."}
+
+    try:
+        # IMPORTANT: Strip leading/trailing whitespace to help with JSON parsing
+        llm_response_text = llm_response_text.strip()
+
+        # Check if the response already starts and ends with JSON markers
+        if llm_response_text.startswith('{') and llm_response_text.endswith('}'):
+            json_string = llm_response_text
+        else:
+            # Fallback for cases where LLM might add preamble/postamble text
+            json_start = llm_response_text.find('{')
+            json_end = llm_response_text.rfind('}') + 1
+            if json_start != -1 and json_end != -1:
+                json_string = llm_response_text[json_start:json_end]
+            else:
+                return {"error": "Could not find a complete JSON object in the model's response.", "raw_response": llm_response_text}
+
+        return json.loads(json_string)
+    except json.JSONDecodeError as e:
+        return {"error": f"Failed to parse JSON from LLM response: {e}", "raw_response": llm_response_text}
+
+
+def analysis_version(client: LLMClient) -> str:
+    return f"{client.name}/prompt-{PROMPT_VERSION}"
+
+
+def analyze_pdf_report(pdf_content_bytes: bytes, filename: str, client: LLMClient = None,
+                       raise_errors: bool = False, timings: dict = None, use_templates: bool = None) -> dict:
+    """
+    Analyzes a PDF medical report by first extracting its pages, then either
+    parsing them with a known layout template (utils.report_templates) or
+    using the LLM client (get_llm_client() by default) to extract key
+    parameters in JSON format. The extracted pages and the LLM analysis are
+    cached by the SHA-256 of the file, so a repeated upload of the same report
+    neither re-extracts nor calls the LLM. timings, if given, receives the
+    seconds spent per step and the parser used ('template' or 'llm').
+    """
+    if not filename.lower().endswith('.pdf'):
+        return {"error": "Unsupported file type. Only PDF files are supported for this analysis."}
+
+    client = client or get_llm_client()
+    use_templates = USE_TEMPLATE_PARSER if use_templates is None else use_templates
+    timings = {} if timings is None else timings
+    digest = pdf_digest(pdf_content_bytes)
+    cached_analysis = get_cached('analysis', digest, analysis_version(client))
+    if cached_analysis is not None:
+        timings['cached'] = True
+        return json.loads(cached_analysis)
+
+    started = time.perf_counter()
+    cached_pages = get_cached('pages', digest, EXTRACTION_VERSION)
+    if cached_pages is None:
+        try:
+            pages = extract_pages(pdf_content_bytes)
+        except Exception as e:
+            print(f"Error extracting text from PDF with pdfplumber: {e}")
+            return {"error": f"Error: Could not extract text from PDF: {e}"}
+        set_cached('pages', digest, EXTRACTION_VERSION, json.dumps(pages))
+    else:
+        pages = json.loads(cached_pages)
+    timings['extraction'] = round(time.perf_counter() - started, 3)
+
+    if use_templates:
+        started = time.perf_counter()
+        try:
+            analysis, info = parse_report(pages)
+        except Exception as e:
+            # A layout the rules did not foresee: the LLM still gets the report
+            print(f"Error parsing the report with the templates: {e}")
+            analysis, info = None, {'templates': [], 'coverage': 0.0}
+        timings['template'] = round(time.perf_counter() - started, 3)
+        timings['template_coverage'] = info['coverage']
+        record_outcome(info, fast_path=analysis is not None)
+        if analysis is not None:
+            timings['parser'] = 'template'
+            return analysis
+
+    timings['parser'] = 'llm'
+    started = time.perf_counter()
+    try:
+        result = _analyze_text(render_pages(pages), pdf_content_bytes, client, raise_errors)
+    finally:
+        timings['llm'] = round(time.perf_counter() - started, 3)
+    # Failures are not cached: a retry calls the LLM again
+    if "error" not in result:
+        set_cached('analysis', digest, analysis_version(client), json.dumps(result))
+    return result
+
+
 if __name__ == "__main__":
-    #actual_filename = "C:\\Users\\Asus\\Desktop\\GIT REPO HEALTH\\HealthSync-backend\\report analyzer\\UMR3110365.pdf"
+    actual_filename = "C:\\Users\\Asus\\Desktop\\GIT REPO HEALTH\\HealthSync-backend\\report analyzer\\UMR3110365.pdf"
     try:
         with open(actual_filename, "rb") as f:
             pdf_content_bytes_from_file = f.read()
@@ -0,0 +1,109 @@
+import re
+
+from pymongo.errors import OperationFailure
+
+from health.models import Test
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Relevance of a query token found in a field; an exact token match adds EXACT_BONUS
+NAME_WEIGHT = 3.0
+PARAMETER_WEIGHT = 1.0
+EXACT_BONUS = 1.0
+# Added when the whole query starts the test name
+NAME_PREFIX_BONUS = 5.0
+
+_PREFIX = '_p'
+_EXACT = '_e'
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(str(text or '').lower())
+
+
+class PrefixTrie:
+    """
+    Character trie over tokens. Every node keeps the best weight of each test
+    having a token with that prefix, so a lookup is one walk down the query
+    token, whatever the number of matches below it.
+    """
+
+    def __init__(self):
+        self.root = {}
+
+    def insert(self, token, test_id, weight):
+        node = self.root
+        for char in token:
+            node = node.setdefault(char, {})
+            matches = node.setdefault(_PREFIX, {})
+            matches[test_id] = max(weight, matches.get(test_id, 0))
+        exact = node.setdefault(_EXACT, {})
+        exact[test_id] = max(weight, exact.get(test_id, 0))
+
+    def lookup(self, prefix):
+        """Returns ({test_id: weight} for tokens starting with prefix, {test_id: weight} for tokens equal to it)."""
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return {}, {}
+        return node.get(_PREFIX, {}), node.get(_EXACT, {})
+
+
+class TestSearchIndex:
+    """Prefix search over the testName and parametersCovered_list.name of the catalog tests."""
+
+    def __init__(self, raw_tests):
+        self.trie = PrefixTrie()
+        self.names = {}
+        for test_id, test in raw_tests.items():
+            name = str(test.get('testName') or '')
+            self.names[test_id] = name.lower()
+            for token in tokenize(name):
+                self.trie.insert(token, test_id, NAME_WEIGHT)
+            for parameter in test.get('parametersCovered_list') or []:
+                for token in tokenize(parameter.get('name')):
+                    self.trie.insert(token, test_id, PARAMETER_WEIGHT)
+
+    def search(self, query):
+        """Test ids matching every query token as a prefix, best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        scores = None
+        for token in tokens:
+            prefix_matches, exact_matches = self.trie.lookup(token)
+            if scores is None:
+                scores = {test_id: weight for test_id, weight in prefix_matches.items()}
+            else:
+                scores = {
+                    test_id: score + prefix_matches[test_id]
+                    for test_id, score in scores.items() if test_id in prefix_matches
+                }
+            for test_id in exact_matches:
+                if test_id in scores:
+                    scores[test_id] += EXACT_BONUS
+            if not scores:
+                return []
+
+        query = ' '.join(tokens)
+        for test_id in scores:
+            if self.names[test_id].startswith(query):
+                scores[test_id] += NAME_PREFIX_BONUS
+
+        return sorted(scores, key=lambda test_id: (-scores[test_id], self.names[test_id]))
+
+
+def text_search(query, limit=100):
+    """
+    Test ids from the Mongo text index (names, parameters and FAQ text), by
+    text score. Returns [] when the index has not been created yet.
+    """
+    try:
+        cursor = Test._get_collection().find(
+            {'$text': {'$search': query}}, {'score': {'$meta': 'textScore'}},
+        ).sort([('score', {'$meta': 'textScore'})]).limit(limit)
+        return [str(doc['_id']) for doc in cursor]
+    except OperationFailure:
+        return []
@@ -1,5 +1,8 @@
+from datetime import datetime
+
 from accounts.models import Account
 from health.models import BodyParameters
+from utils.health_snapshot import get_latest_snapshots
 
 def fetch_user_profile_by_id(profile_id):
     try:
@@ -19,30 +22,83 @@ def fetch_user_profile_by_id(profile_id):
         return {"error": "User profile not found."}
     except Exception as e:
         return {"error": f"Unexpected error: {str(e)}"}
+def latest_body_parameters_by_user(user_ids):
+    """
+    Returns {user_id: latest BodyParameters summary} for the given users.
+    Reads the latest_health_snapshot collection and falls back to a single
+    $sort/$group aggregation for users that have no snapshot entry yet.
+    """
+    if not user_ids:
+        return {}
+
+    latest = get_latest_snapshots(user_ids, 'body_parameters')
+    missing = [user_id for user_id in user_ids if user_id not in latest]
+    if not missing:
+        return latest
+
+    pipeline = [
+        {'$match': {'user_id': {'$in': missing}}},
+        {'$sort': {'user_id': 1, 'created_at': -1}},
+        {'$group': {
+            '_id': '$user_id',
+            'bmi': {'$first': '$bmi'},
+            'score': {'$first': '$score'},
+            'status': {'$first': '$status'},
+            'created_at': {'$first': '$created_at'},
+        }},
+    ]
+    for row in BodyParameters.objects.aggregate(pipeline):
+        latest[row['_id']] = row
+    return latest
+
+
 def dietician_clients_health_summary(dietician_id):
+    """
+    Builds the dietician dashboard: client counts plus the latest body parameter
+    summary of every client. Runs one SQL query for the accounts and a constant
+    number of Mongo queries for the latest records, whatever the number of clients.
+    """
     try:
-        users = Account.objects.filter(dietician_id=dietician_id)
-        total_clients = users.count()
+        users = list(
+            Account.objects.filter(dietician_id=dietician_id).only('id', 'username', 'DOB', 'gender')
+        )
+        latest_per_user = latest_body_parameters_by_user([user.id for user in users])
 
         healthy_clients = 0
         need_attention = 0
-        client_list = []
+        clients = []
 
         for user in users:
-            client_list.append(user.id)  # internal use only
+            latest_param = latest_per_user.get(user.id)
+            if not latest_param:
+                continue
 
-            latest_param = BodyParameters.objects.filter(user_id=user.id).order_by('-created_at').first()
-            if latest_param:
-                if latest_param.status == "Good":
-                    healthy_clients += 1
-                elif latest_param.status in ["Average", "Poor"]:
-                    need_attention += 1
+            if latest_param['status'] == "Good":
+                healthy_clients += 1
+            elif latest_param['status'] in ["Average", "Poor"]:
+                need_attention += 1
+
+            clients.append({
+                "userId": str(user.id),
+                "userProfile": {
+                    "name": user.username,
+                    "DOB": user.DOB,
+                    "gender": user.gender,
+                },
+                "bmi": latest_param.get('bmi'),
+                "score": latest_param.get('score'),
+                "status": latest_param.get('status'),
+                "last_visit": latest_param.get('created_at'),
+            })
+
+        # Most recently seen clients first, as the dashboard always listed them
+        clients.sort(key=lambda client: client["last_visit"] or datetime.min, reverse=True)
 
         return {
-            "totalClients": total_clients,
+            "totalClients": len(users),
             "healthyClients": healthy_clients,
             "needsAttention": need_attention,
-            "_userIds": client_list  # underscore to mark as internal
+            "clients": clients,
         }
 
     except Exception as e:
@@ -50,3 +106,8 @@ def dietician_clients_health_summary(dietician_id):
             "status": "error",
             "message": str(e)
         }
+
+
+def is_client_of(dietician_id, user_id):
+    """Whether the account user_id is a client of the dietician."""
+    return Account.objects.filter(id=user_id, dietician_id=dietician_id).exists()